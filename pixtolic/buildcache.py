@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from os import path
+import shutil
+from time import time
+
+import nmigen
+from nmigen.build.run import LocalBuildProducts
+
+
+PACKAGE_DIR = path.dirname(__file__)
+DEFAULT_ROOT = path.join(path.expanduser('~'), '.cache', 'pixtolic', 'builds')
+
+
+def source_digest(root=PACKAGE_DIR):
+    # every python file in the package, so that any change to the
+    # gateware (or to the code that generates it) is a new key
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.py'):
+                continue
+            fname = path.join(dirpath, filename)
+            h.update(path.relpath(fname, root).encode())
+            with open(fname, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class BuildCache:
+
+    """Reuse builds of a design that hasn't changed.
+
+    There are two levels of keys. The first is a hash of everything
+    that goes into a design before it is elaborated: `params` (anything
+    JSON serializable, e.g. the resolution and color depth), the
+    contents of `files` the design reads (images) and the source of the
+    whole package. When that matches, the previous build is returned
+    without even elaborating. Otherwise the design is elaborated and
+    the build plan (RTLIL, constraints and build script) is hashed; if
+    some earlier build had exactly the same plan, e.g. because only a
+    comment changed, its netlist and bitstream are reused and yosys
+    and nextpnr are skipped.
+
+    Each build is kept in its own directory under `root`, with the
+    RTLIL, the synthesized netlist and the bitstream. Only the
+    `max_entries` most recently used ones are kept.
+
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, max_entries=16):
+        self.root = root = path.abspath(root)
+        self.max_entries = max_entries
+        self.builds_dir = path.join(root, 'plans')
+        self.keys_dir = path.join(root, 'keys')
+        os.makedirs(self.builds_dir, exist_ok=True)
+        os.makedirs(self.keys_dir, exist_ok=True)
+
+    def key(self, params, files=()):
+        h = hashlib.sha256()
+        h.update(json.dumps(params, sort_keys=True).encode())
+        for fname in files:
+            with open(fname, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        h.update(source_digest().encode())
+        h.update(str(getattr(nmigen, '__version__', '')).encode())
+        return h.hexdigest()
+
+    def lookup(self, key, name):
+        # the build directory for `key`, if it is still around
+        try:
+            with open(path.join(self.keys_dir, key)) as f:
+                plan_digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        build_dir = path.join(self.builds_dir, plan_digest)
+        if not path.exists(path.join(build_dir, f'{name}.bin')):
+            return None
+        return build_dir
+
+    def build(self, platform, elaboratable, name='top', params=None, files=(),
+              **kwargs):
+        """Like `platform.build(elaboratable, name, do_build=True)`, but
+        returns the products of an earlier build when possible."""
+        # the toolchain options change the build as much as the design
+        key = self.key(
+            dict(params or {}, name=name, platform=type(platform).__name__, options=kwargs),
+            files,
+        )
+        build_dir = self.lookup(key, name)
+        if build_dir is None:
+            plan = platform.prepare(elaboratable, name, **kwargs)
+            plan_digest = plan.digest().hex()
+            build_dir = path.join(self.builds_dir, plan_digest)
+            if not path.exists(path.join(build_dir, f'{name}.bin')):
+                # build somewhere else first so that a failed or
+                # interrupted build never looks like a finished one
+                staging = f'{build_dir}.partial'
+                shutil.rmtree(staging, ignore_errors=True)
+                plan.execute_local(staging)
+                shutil.rmtree(build_dir, ignore_errors=True)
+                os.replace(staging, build_dir)
+            with open(path.join(self.keys_dir, key), 'w') as f:
+                f.write(plan_digest)
+
+        now = time()
+        os.utime(build_dir, (now, now))
+        self.evict()
+        return LocalBuildProducts(build_dir)
+
+    def evict(self):
+        builds = sorted(
+            (entry for entry in os.scandir(self.builds_dir)
+             if entry.is_dir() and not entry.name.endswith('.partial')),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        for entry in builds[self.max_entries:]:
+            shutil.rmtree(entry.path)
+
+        kept = {entry.name for entry in builds[:self.max_entries]}
+        for entry in os.scandir(self.keys_dir):
+            with open(entry.path) as f:
+                if f.read().strip() not in kept:
+                    os.remove(entry.path)
@@ -0,0 +1,119 @@
+# timings from the VESA Coordinated Video Timings (CVT 1.2) formulas,
+# for any size and refresh rate instead of the fixed table in
+# resolutions.py. reduced blanking drops most of the horizontal
+# blanking (which only CRTs needed), so the same mode needs a 20-30%
+# slower pixel clock.
+#
+# the sync polarities CVT asks for (-hsync +vsync, or +hsync -vsync
+# with reduced blanking) aren't represented here; VgaTiming always
+# drives both active low.
+
+from math import floor
+import sys
+
+from pixtolic.config.resolutions import ScanTimings, VgaResolution
+
+
+CELL_GRANULARITY = 8
+CLOCK_STEP = 0.25           # MHz
+
+# CVT
+MIN_VSYNC_BP = 550          # us
+MIN_V_PORCH = 3
+MIN_V_BPORCH = 6
+H_SYNC_PERCENT = 8
+C_PRIME = 30                # ((C - J) * K / 256) + J with C=40, J=20, K=128
+M_PRIME = 300               # K / 256 * M with M=600
+
+# CVT reduced blanking
+RB_H_BLANK = 160
+RB_H_SYNC = 32
+RB_MIN_V_BLANK = 460        # us
+RB_V_FPORCH = 3
+RB_MIN_V_BPORCH = 6
+
+
+def vsync_lines(width, height):
+    # the vertical sync width encodes the aspect ratio
+    for (w, h), lines in {(4, 3): 4, (16, 9): 5, (16, 10): 6, (5, 4): 7, (15, 9): 7}.items():
+        if height * w // h == width:
+            return lines
+    return 10
+
+
+def cvt(width, height, refresh=60, reduced_blanking=False):
+    """`VgaResolution` for a `width` x `height` progressive mode at
+    `refresh` Hz."""
+    h_pixels = width // CELL_GRANULARITY * CELL_GRANULARITY
+    v_lines = height
+    v_sync = vsync_lines(h_pixels, v_lines)
+
+    if reduced_blanking:
+        h_period_est = (1e6 / refresh - RB_MIN_V_BLANK) / v_lines
+        vbi_lines = max(
+            floor(RB_MIN_V_BLANK / h_period_est) + 1,
+            RB_V_FPORCH + v_sync + RB_MIN_V_BPORCH,
+        )
+        total_lines = v_lines + vbi_lines
+        h_blank = RB_H_BLANK
+        total_pixels = h_pixels + h_blank
+        pixel_freq = CLOCK_STEP * floor(refresh * total_lines * total_pixels / 1e6 / CLOCK_STEP)
+        h_sync = RB_H_SYNC
+        h_back_porch = h_blank // 2
+        v_front_porch = RB_V_FPORCH
+        v_back_porch = vbi_lines - RB_V_FPORCH - v_sync
+    else:
+        h_period_est = (1e6 / refresh - MIN_VSYNC_BP) / (v_lines + MIN_V_PORCH)
+        v_sync_bp = max(floor(MIN_VSYNC_BP / h_period_est) + 1, v_sync + MIN_V_BPORCH)
+        duty_cycle = max(C_PRIME - M_PRIME * h_period_est / 1000, 20)
+        h_blank = floor(
+            h_pixels * duty_cycle / (100 - duty_cycle) / (2 * CELL_GRANULARITY)
+        ) * 2 * CELL_GRANULARITY
+        total_pixels = h_pixels + h_blank
+        pixel_freq = CLOCK_STEP * floor(total_pixels / h_period_est / CLOCK_STEP)
+        h_sync = floor(H_SYNC_PERCENT / 100 * total_pixels / CELL_GRANULARITY) * CELL_GRANULARITY
+        h_back_porch = h_blank // 2
+        v_front_porch = MIN_V_PORCH
+        v_back_porch = v_sync_bp - v_sync
+
+    return VgaResolution(
+        pixclk_freq=pixel_freq * 1e6,
+        h_timings=ScanTimings(
+            sync_pulse=h_sync,
+            back_porch=h_back_porch,
+            visible=h_pixels,
+            front_porch=h_blank - h_sync - h_back_porch,
+        ),
+        v_timings=ScanTimings(
+            sync_pulse=v_sync,
+            back_porch=v_back_porch,
+            visible=v_lines,
+            front_porch=v_front_porch,
+        ),
+    )
+
+
+def catalog(sizes, refresh=60):
+    """{name: VgaResolution} with a CVT and a CVT-RB mode for each
+    (width, height) in `sizes`."""
+    modes = {}
+    for width, height in sizes:
+        modes[f'CVT_{width}_{height}p_{refresh}hz'] = cvt(width, height, refresh)
+        modes[f'CVT_RB_{width}_{height}p_{refresh}hz'] = cvt(width, height, refresh, reduced_blanking=True)
+    return modes
+
+
+if __name__ == '__main__':
+    # compare with what the PLL can make from the 12 MHz clock
+    from pixtolic.config.resolutions import resolutions
+    from pixtolic.device import pll
+
+    sizes = sorted({(resolution.width, resolution.height) for resolution in resolutions.values()})
+    modes = catalog(sizes, refresh=float(sys.argv[1]) if len(sys.argv) > 1 else 60)
+    matches = {match.name: match for match in pll.rank(modes=modes)}
+    for name, resolution in modes.items():
+        match = matches[name]
+        print(
+            f'{name:28} {resolution.pixclk_freq / 1e6:8.2f} MHz -> PLL {match.freq_out:8.3f} MHz '
+            f'{match.refresh:7.3f} Hz ({100 * match.refresh_error:.3f}% off)'
+        )
@@ -9,6 +9,8 @@ from nmigen import *
 from nmigen.lib.cdc import ResetSynchronizer
 from nmigen.cli import main
 
+from pixtolic.device import pll
+
 
 class iCE40PLL(Elaboratable):
 
@@ -29,9 +31,12 @@ class iCE40PLL(Elaboratable):
 
     """
 
-    def __init__(self, freq_in_mhz, freq_out_mhz, domain_name='sync'):
+    def __init__(self, freq_in_mhz, freq_out_mhz, domain_name='sync',
+                 max_error=0.01):
         self.freq_in = freq_in_mhz
         self.freq_out = freq_out_mhz
+        # how far off (relative) the output may be before giving up
+        self.max_error = max_error
         self.coeff = self._calc_freq_coefficients()
         self.clk_pin = Signal()
         self.buf_clkin = Signal()
@@ -45,24 +50,18 @@ class iCE40PLL(Elaboratable):
         ]
 
     def _calc_freq_coefficients(self):
-        # cribbed from Icestorm's icepll.
+        # look up the closest frequency in the precomputed table of
+        # everything the PLL can make, see pixtolic.device.pll
         f_in, f_req = self.freq_in, self.freq_out
         assert 10 <= f_in <= 13
         assert 16 <= f_req <= 275
-        coefficients = namedtuple('coefficients', 'divr divf divq')
-        divf_range = 128        # see comments in icepll.cc
-        best_fout = float('inf')
-        for divr in range(16):
-            pfd = f_in / (divr + 1)
-            if 10 <= pfd <= 133:
-                for divf in range(divf_range):
-                    vco = pfd * (divf + 1)
-                    if 533 <= vco <= 1066:
-                        for divq in range(1, 7):
-                            fout = vco * 2**-divq
-                            if abs(fout - f_req) < abs(best_fout - f_req):
-                                best_fout = fout
-                                best = coefficients(divr, divf, divq)
+        best_fout, best = pll.nearest(f_in, f_req)
+        error = abs(best_fout - f_req) / f_req
+        if error > self.max_error:
+            raise ValueError(
+                f'PLL: requested {f_req} MHz, the closest it can make is '
+                f'{best_fout} MHz ({100 * error:.2f}% off)'
+            )
         if best_fout != f_req:
             warnings.warn(
                 f'PLL: requested {f_req} MHz, got {best_fout} MHz)',
@@ -95,3 +94,59 @@ class iCE40PLL(Elaboratable):
         m = Module()
         m.submodules += [pll, rs]
         return m
+
+
+class iCE40SPRAM(Elaboratable):
+
+    """One of the UP5K's four 16K x 16 single-port RAMs
+    (SB_SPRAM256KA), clocked by `domain`. `data_out` has the word at
+    `addr` a clock later, like a read port; with `write_en`, `data_in`
+    is written there instead.
+
+    Simulations (with no platform) get a Memory that behaves the same,
+    but only `depth` words deep, since the Python simulator can't
+    handle one as big as the SPRAM.
+
+    """
+
+    DEPTH = 16384
+    WIDTH = 16
+
+    def __init__(self, domain='sync', depth=DEPTH):
+        self.domain = domain
+        self.depth = depth
+        self.addr = Signal(range(self.DEPTH))
+        self.data_in = Signal(self.WIDTH)
+        self.data_out = Signal(self.WIDTH)
+        self.write_en = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        if platform is None:
+            memory = Memory(width=self.WIDTH, depth=self.depth)
+            m.submodules.rd_port = rd_port = memory.read_port(domain=self.domain, transparent=False)
+            m.submodules.wr_port = wr_port = memory.write_port(domain=self.domain)
+            m.d.comb += [
+                rd_port.addr.eq(self.addr),
+                self.data_out.eq(rd_port.data),
+                wr_port.addr.eq(self.addr),
+                wr_port.data.eq(self.data_in),
+                wr_port.en.eq(self.write_en),
+            ]
+            return m
+
+        m.submodules.spram = Instance(
+            'SB_SPRAM256KA',
+            i_ADDRESS=self.addr,
+            i_DATAIN=self.data_in,
+            i_MASKWREN=Const(0b1111, 4),
+            i_WREN=self.write_en,
+            i_CHIPSELECT=Const(1),
+            i_CLOCK=ClockSignal(self.domain),
+            i_STANDBY=Const(0),
+            i_SLEEP=Const(0),
+            i_POWEROFF=Const(1),
+            o_DATAOUT=self.data_out,
+        )
+        return m
@@ -0,0 +1,52 @@
+# swap the contents of a memory in a finished iCE40 bitstream with
+# icestorm's icebram, instead of synthesizing and placing the whole
+# design again. the design has to be built with a placeholder in that
+# memory: random words, which icebram can find again in the block RAM
+# contents of the .asc file and replace.
+
+import os
+from os import path
+from random import Random
+import subprocess
+import tempfile
+
+
+def tool(name):
+    # same convention as nmigen's toolchain overrides, e.g. ICEPACK=...
+    return os.environ.get(name.upper(), name)
+
+
+def placeholder(depth, width, seed=0):
+    rng = Random(seed)
+    return [rng.getrandbits(width) for _ in range(depth)]
+
+
+def write_hex(fname, words, width):
+    digits = -(-width // 4)
+    with open(fname, 'w') as f:
+        for word in words:
+            f.write(f'{word:0{digits}x}\n')
+
+
+def patch(asc, old_words, new_words, width):
+    """Return the text of the .asc bitstream `asc` with the memory that
+    was initialized to `old_words` holding `new_words` instead."""
+    if len(old_words) != len(new_words):
+        raise ValueError(f'memory has {len(old_words)} words, got {len(new_words)}')
+    with tempfile.TemporaryDirectory() as tmp:
+        old_hex = path.join(tmp, 'old.hex')
+        new_hex = path.join(tmp, 'new.hex')
+        write_hex(old_hex, old_words, width)
+        write_hex(new_hex, new_words, width)
+        return subprocess.run(
+            [tool('icebram'), old_hex, new_hex],
+            input=asc, capture_output=True, text=True, check=True,
+        ).stdout
+
+
+def pack(asc, bin_file):
+    with tempfile.TemporaryDirectory() as tmp:
+        asc_file = path.join(tmp, 'patched.asc')
+        with open(asc_file, 'w') as f:
+            f.write(asc)
+        subprocess.run([tool('icepack'), asc_file, bin_file], check=True)
@@ -0,0 +1,103 @@
+# every output frequency the iCE40 PLL can make from a given input
+# clock, worked out once and kept on disk, so picking coefficients is
+# a lookup instead of a search over divr x divf x divq.
+
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+import json
+import os
+from os import path
+import sys
+
+from pixtolic.config.resolutions import resolutions
+
+
+CACHE_DIR = path.join(path.expanduser('~'), '.cache', 'pixtolic')
+
+Coefficients = namedtuple('Coefficients', 'divr divf divq')
+Setting = namedtuple('Setting', 'freq_out coefficients')
+Match = namedtuple('Match', 'name freq_out coefficients refresh refresh_error')
+
+
+def search(freq_in):
+    # cribbed from Icestorm's icepll. all frequencies in MHz
+    assert 10 <= freq_in <= 13
+    divf_range = 128        # see comments in icepll.cc
+    found = {}
+    for divr in range(16):
+        pfd = freq_in / (divr + 1)
+        if 10 <= pfd <= 133:
+            for divf in range(divf_range):
+                vco = pfd * (divf + 1)
+                if 533 <= vco <= 1066:
+                    for divq in range(1, 7):
+                        freq_out = vco * 2**-divq
+                        if 16 <= freq_out <= 275:
+                            # the first coefficients found for each
+                            # frequency win, same as icepll
+                            found.setdefault(round(freq_out, 9), Coefficients(divr, divf, divq))
+    return [Setting(freq_out, coefficients) for freq_out, coefficients in sorted(found.items())]
+
+
+@lru_cache()
+def table(freq_in, cache_dir=CACHE_DIR):
+    """All (freq_out, coefficients) for `freq_in`, sorted by
+    frequency."""
+    fname = path.join(cache_dir, f'ice40-pll-{freq_in:g}MHz.json')
+    try:
+        with open(fname) as f:
+            return [Setting(freq_out, Coefficients(*coefficients)) for freq_out, coefficients in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        pass
+    settings = search(freq_in)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(fname, 'w') as f:
+            json.dump(settings, f)
+    except OSError:
+        # not being able to cache it is no reason to fail a build
+        pass
+    return settings
+
+
+def nearest(freq_in, freq_out):
+    """The reachable setting closest to `freq_out` (MHz)."""
+    settings = table(freq_in)
+    i = bisect_left([setting.freq_out for setting in settings], freq_out)
+    candidates = settings[max(i - 1, 0):i + 1]
+    return min(candidates, key=lambda setting: abs(setting.freq_out - freq_out))
+
+
+def refresh_rate(resolution, pixclk_freq):
+    return pixclk_freq / (resolution.h.fullscan * resolution.v.fullscan)
+
+
+def rank(freq_in=12, modes=None):
+    """Modes (default: everything in `resolutions`) ordered by how far
+    off their refresh rate would be with the closest pixel clock the
+    PLL can make. Takes {name: VgaResolution}."""
+    if modes is None:
+        modes = {name.name: resolution for name, resolution in resolutions.items()}
+    matches = []
+    for name, resolution in modes.items():
+        setting = nearest(freq_in, resolution.pixclk_freq / 1e6)
+        refresh = refresh_rate(resolution, setting.freq_out * 1e6)
+        nominal = refresh_rate(resolution, resolution.pixclk_freq)
+        matches.append(Match(
+            name,
+            setting.freq_out,
+            setting.coefficients,
+            refresh,
+            abs(refresh - nominal) / nominal,
+        ))
+    return sorted(matches, key=lambda match: match.refresh_error)
+
+
+if __name__ == '__main__':
+    freq_in = float(sys.argv[1]) if len(sys.argv) > 1 else 12
+    for match in rank(freq_in):
+        print(
+            f'{match.name:24} {match.freq_out:8.3f} MHz {match.refresh:7.3f} Hz '
+            f'({100 * match.refresh_error:.3f}% off)  {match.coefficients}'
+        )
@@ -0,0 +1,129 @@
+import sys
+
+from pixtolic.processors.alu import (
+    PixelOperand,
+    PixelDestination,
+    PixelOpcode,
+    REGISTER_WIDTH,
+    pixel_instruction_layout,
+)
+from pixtolic.util import int_for, fields_for
+
+
+OPERANDS = {
+    'gp0': PixelOperand.GP0,
+    'gp1': PixelOperand.GP1,
+    'gp2': PixelOperand.GP2,
+    'gp3': PixelOperand.GP3,
+    'x': PixelOperand.XPOS,
+    'y': PixelOperand.YPOS,
+    'frame': PixelOperand.FRAME,
+}
+DESTINATIONS = {
+    'gp0': PixelDestination.GP0,
+    'gp1': PixelDestination.GP1,
+    'gp2': PixelDestination.GP2,
+    'gp3': PixelDestination.GP3,
+    'out': PixelDestination.OUTPUT,
+}
+UNARY = {PixelOpcode.NOT}
+
+
+class AssemblyError(ValueError):
+    pass
+
+
+def parse_immediate(token):
+    try:
+        value = int(token, 0)
+    except ValueError:
+        return None
+    if not -2**(REGISTER_WIDTH - 1) <= value < 2**REGISTER_WIDTH:
+        raise AssemblyError(f'{token} does not fit in {REGISTER_WIDTH} bits')
+    return value % 2**REGISTER_WIDTH
+
+
+def assemble_line(line):
+    """One instruction, e.g. 'sub gp0, x, y' or 'gt out, gp0, 0', as an
+    instruction word; None for blank lines and comments."""
+    line = line.split(';')[0].split('#')[0].strip()
+    if not line:
+        return None
+    mnemonic, *rest = line.split(None, 1)
+    rest = rest[0] if rest else ''
+    try:
+        opcode = PixelOpcode[mnemonic.upper()]
+    except KeyError:
+        raise AssemblyError(f'unknown opcode {mnemonic!r}') from None
+    args = [arg.strip().lower() for arg in rest.split(',')] if rest.strip() else []
+    count = 2 if opcode in UNARY else 3
+    if len(args) != count:
+        raise AssemblyError(f'{mnemonic} takes {count} operands, got {len(args)}')
+
+    dest, *sources = args
+    if dest not in DESTINATIONS:
+        raise AssemblyError(f'{dest!r} is not a destination (one of {", ".join(DESTINATIONS)})')
+    immediate = None
+    operands = []
+    for source in sources:
+        value = parse_immediate(source)
+        if value is None:
+            if source not in OPERANDS:
+                raise AssemblyError(f'{source!r} is not an operand (one of {", ".join(OPERANDS)} or a number)')
+            operands.append(OPERANDS[source])
+            continue
+        # both operands can be immediates, as long as they're the same
+        if immediate is not None and immediate != value:
+            raise AssemblyError('only one immediate value per instruction')
+        immediate = value
+        operands.append(PixelOperand.IMM)
+    if len(operands) == 1:
+        # the right operand is ignored
+        operands.append(PixelOperand.GP0)
+
+    return int_for(
+        pixel_instruction_layout,
+        left_op=operands[0].value,
+        right_op=operands[1].value,
+        dest=DESTINATIONS[dest].value,
+        opcode=opcode.value,
+        immediate=immediate or 0,
+    )
+
+
+def assemble(source):
+    """Assemble a program, one instruction per line, into a list of
+    instruction words for the PixelProcessor."""
+    words = []
+    for number, line in enumerate(source.splitlines(), 1):
+        try:
+            word = assemble_line(line)
+        except AssemblyError as e:
+            raise AssemblyError(f'line {number}: {e}') from None
+        if word is not None:
+            words.append(word)
+    return words
+
+
+def disassemble(words):
+    """Instruction words back to the text `assemble` takes."""
+    names = {operand: name for name, operand in OPERANDS.items()}
+    dest_names = {dest.value: name for name, dest in DESTINATIONS.items()}
+    lines = []
+    for word in words:
+        fields = fields_for(pixel_instruction_layout, word)
+        opcode = PixelOpcode(fields['opcode'])
+        operands = [fields['left_op']] if opcode in UNARY else [fields['left_op'], fields['right_op']]
+        sources = [
+            str(fields['immediate']) if op == PixelOperand.IMM.value else names[PixelOperand(op)]
+            for op in operands
+        ]
+        lines.append(f'{opcode.name.lower()} {", ".join([dest_names[fields["dest"]]] + sources)}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # assemble a file (or stdin) and print the words in hex
+    with open(sys.argv[1]) if len(sys.argv) > 1 else sys.stdin as f:
+        for word in assemble(f.read()):
+            print(f'{word:012x}')
@@ -0,0 +1,296 @@
+# compiles pixel expressions like
+#
+#     d = x - y
+#     out = (d > 0) | (frame & 1 == 0)
+#
+# into PixelALU programs. the source is parsed as Python, so the
+# operators and their precedence are Python's: ~ & | ^ + - << >> * and
+# the comparisons, `a if cond else b`, plus unary -, `not` and !=,
+# which are lowered onto the instruction set. values are 32 bit
+# unsigned like in the hardware, so >> is a logical shift, and * only
+# multiplies the low 16 bits of each side (see PixelALU).
+#
+# the expressions become a DAG with constants folded, identities like
+# x + 0 simplified and repeated subexpressions shared; only what `out`
+# depends on is emitted. instructions are ordered so that the deeper
+# operand is evaluated first (Sethi-Ullman), which keeps the fewest
+# values live, then GP0-GP3 are allocated over that order. there is
+# nowhere to spill to, so a program that needs more than four live
+# values is an error.
+
+import argparse
+import ast
+import sys
+
+from pixtolic.host.assembler import assemble
+from pixtolic.host.emulator import execute
+from pixtolic.processors.alu import PixelOpcode, REGISTER_COUNT, REGISTER_WIDTH
+
+
+MASK = 2 ** REGISTER_WIDTH - 1
+INPUTS = ('x', 'y', 'frame')
+
+BINARY = {
+    ast.BitAnd: PixelOpcode.AND,
+    ast.BitOr: PixelOpcode.OR,
+    ast.BitXor: PixelOpcode.XOR,
+    ast.Add: PixelOpcode.ADD,
+    ast.Sub: PixelOpcode.SUB,
+    ast.LShift: PixelOpcode.SHL,
+    ast.RShift: PixelOpcode.SHR,
+    ast.Mult: PixelOpcode.MUL,
+}
+COMPARE = {
+    ast.Eq: PixelOpcode.EQ,
+    ast.Gt: PixelOpcode.GT,
+    ast.GtE: PixelOpcode.GTE,
+    ast.Lt: PixelOpcode.LT,
+    ast.LtE: PixelOpcode.LTE,
+}
+COMMUTATIVE = {
+    PixelOpcode.AND, PixelOpcode.OR, PixelOpcode.XOR, PixelOpcode.ADD, PixelOpcode.EQ, PixelOpcode.MUL,
+}
+
+
+class CompileError(ValueError):
+    pass
+
+
+# DAG nodes are plain tuples, so equal subexpressions are equal nodes:
+# ('input', name), ('const', value), (opcode, left, right) with
+# right=None for NOT, or (SELECT, left, right, condition)
+
+def const(value):
+    return ('const', value & MASK)
+
+
+def is_const(node, value=None):
+    return node[0] == 'const' and (value is None or node[1] == value)
+
+
+def fold(opcode, left, right=None):
+    if is_const(left) and (right is None or is_const(right)):
+        return const(int(execute(opcode.value, left[1], right[1] if right else 0)))
+    if opcode in COMMUTATIVE and is_const(left):
+        left, right = right, left
+
+    if opcode in (PixelOpcode.ADD, PixelOpcode.SUB, PixelOpcode.OR, PixelOpcode.XOR,
+                  PixelOpcode.SHL, PixelOpcode.SHR) and is_const(right, 0):
+        return left
+    if opcode in (PixelOpcode.AND, PixelOpcode.MUL) and is_const(right, 0):
+        return const(0)
+    if opcode == PixelOpcode.AND and is_const(right, MASK):
+        return left
+    if opcode == PixelOpcode.NOT and left[0] == PixelOpcode.NOT:
+        return left[1]
+    if left == right:
+        if opcode in (PixelOpcode.AND, PixelOpcode.OR):
+            return left
+        if opcode in (PixelOpcode.XOR, PixelOpcode.SUB, PixelOpcode.GT, PixelOpcode.LT):
+            return const(0)
+        if opcode in (PixelOpcode.EQ, PixelOpcode.GTE, PixelOpcode.LTE):
+            return const(1)
+    return (opcode, left, right)
+
+
+def select(condition, left, right):
+    if is_const(condition):
+        return left if condition[1] else right
+    if left == right:
+        return left
+    if is_const(left) and is_const(right):
+        # only one immediate fits in an instruction, so the other one
+        # goes through a register
+        right = (PixelOpcode.OR, right, right)
+    return (PixelOpcode.SELECT, left, right, condition)
+
+
+def lower(expr, names):
+    if isinstance(expr, ast.Constant) and type(expr.value) is int:
+        return const(expr.value)
+    if isinstance(expr, ast.Name):
+        if expr.id not in names:
+            raise CompileError(f'line {expr.lineno}: {expr.id!r} is not defined')
+        return names[expr.id]
+    if isinstance(expr, ast.BinOp) and type(expr.op) in BINARY:
+        return fold(BINARY[type(expr.op)], lower(expr.left, names), lower(expr.right, names))
+    if isinstance(expr, ast.UnaryOp):
+        operand = lower(expr.operand, names)
+        if isinstance(expr.op, ast.Invert):
+            return fold(PixelOpcode.NOT, operand)
+        if isinstance(expr.op, ast.USub):
+            return fold(PixelOpcode.SUB, const(0), operand)
+        if isinstance(expr.op, ast.UAdd):
+            return operand
+        if isinstance(expr.op, ast.Not):
+            return fold(PixelOpcode.EQ, operand, const(0))
+    if isinstance(expr, ast.IfExp):
+        return select(lower(expr.test, names), lower(expr.body, names), lower(expr.orelse, names))
+    if isinstance(expr, ast.Compare):
+        # a < b < c is (a < b) & (b < c), like in Python
+        result = None
+        left = lower(expr.left, names)
+        for op, comparator in zip(expr.ops, expr.comparators):
+            right = lower(comparator, names)
+            if isinstance(op, ast.NotEq):
+                term = fold(PixelOpcode.XOR, fold(PixelOpcode.EQ, left, right), const(1))
+            elif type(op) in COMPARE:
+                term = fold(COMPARE[type(op)], left, right)
+            else:
+                break
+            result = term if result is None else fold(PixelOpcode.AND, result, term)
+            left = right
+        else:
+            return result
+    raise CompileError(f'line {expr.lineno}: unsupported expression {ast.dump(expr)}')
+
+
+def parse(source):
+    """The DAG for `out` in `source`."""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        raise CompileError(f'line {e.lineno}: {e.msg}') from None
+    names = {name: ('input', name) for name in INPUTS}
+    for statement in tree.body:
+        if not (isinstance(statement, ast.Assign)
+                and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Name)):
+            raise CompileError(f'line {statement.lineno}: expected `name = expression`')
+        name = statement.targets[0].id
+        if name in INPUTS:
+            raise CompileError(f'line {statement.lineno}: {name} is an input')
+        names[name] = lower(statement.value, names)
+    if 'out' not in names:
+        raise CompileError('nothing is assigned to out')
+    return names['out']
+
+
+def is_op(node):
+    return isinstance(node[0], PixelOpcode)
+
+
+def operands(node):
+    return [operand for operand in node[1:] if operand is not None and is_op(operand)]
+
+
+def schedule(root):
+    """Operations in the order they should run, deepest operand
+    first."""
+    need = {}
+
+    def registers_needed(node):
+        if node not in need:
+            counts = sorted((registers_needed(operand) for operand in operands(node)), reverse=True)
+            need[node] = max([1] + [count + i for i, count in enumerate(counts)])
+        return need[node]
+
+    order = []
+    done = set()
+
+    def visit(node):
+        if node in done:
+            return
+        for operand in sorted(operands(node), key=registers_needed, reverse=True):
+            visit(operand)
+        done.add(node)
+        order.append(node)
+
+    if is_op(root):
+        visit(root)
+    return order
+
+
+def emit(root):
+    """Assembly for the DAG `root`, allocating registers as it goes."""
+    if not is_op(root) or root[0] == PixelOpcode.SELECT:
+        # the output has to be written by something, and a SELECT
+        # writing the output would take its condition from there
+        root = (PixelOpcode.OR, root, root)
+    order = schedule(root)
+    last_use = {}
+    for i, node in enumerate(order):
+        for operand in operands(node):
+            last_use[operand] = i
+    free = list(range(REGISTER_COUNT))
+    registers = {}
+
+    def allocate():
+        if not free:
+            raise CompileError(
+                f'more than {REGISTER_COUNT} values are live at once, '
+                f'break the expression up differently'
+            )
+        free.sort()
+        return free.pop(0)
+
+    def name(node):
+        if node[0] == 'input':
+            return node[1]
+        if node[0] == 'const':
+            return str(node[1])
+        return f'gp{registers[node]}'
+
+    def line(opcode, dest, *sources):
+        return f'{opcode.name.lower()} {", ".join([dest] + [name(source) for source in sources])}'
+
+    lines = []
+    for i, node in enumerate(order):
+        opcode, *sources = [part for part in node if part is not None]
+        if i == len(order) - 1:
+            lines.append(line(opcode, 'out', *sources))
+            break
+        # operands are read before the result is written, so an
+        # operand dying here can hand its register to the result
+        dying = {operand for operand in operands(node) if last_use[operand] == i}
+        if opcode == PixelOpcode.SELECT:
+            left, right, condition = sources
+            sources = [left, right]
+            if condition in dying:
+                # SELECT's condition is in its destination
+                dying.remove(condition)
+                registers[node] = registers[condition]
+            else:
+                # copy the condition somewhere it can be overwritten
+                registers[node] = allocate()
+                lines.append(line(PixelOpcode.OR, f'gp{registers[node]}', condition, condition))
+            for operand in dying:
+                free.append(registers[operand])
+        else:
+            for operand in dying:
+                free.append(registers[operand])
+            registers[node] = allocate()
+        lines.append(line(opcode, f'gp{registers[node]}', *sources))
+    return '\n'.join(lines)
+
+
+def compile_assembly(source):
+    return emit(parse(source))
+
+
+def compile_program(source):
+    """Instruction words for the expression program `source`."""
+    return assemble(compile_assembly(source))
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.compiler',
+        description='compile a pixel expression program and print the assembly',
+    )
+    p.add_argument('source', nargs='?', help='program text, or a file to read it from (default: stdin)')
+    args = p.parse_args()
+
+    if args.source is None:
+        source = sys.stdin.read()
+    elif '=' in args.source:
+        source = args.source
+    else:
+        with open(args.source) as f:
+            source = f.read()
+    try:
+        assembly = compile_assembly(source)
+    except CompileError as e:
+        sys.exit(f'error: {e}')
+    print(assembly)
+    print(f'; {len(assembly.splitlines())} instructions', file=sys.stderr)
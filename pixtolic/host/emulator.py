@@ -0,0 +1,145 @@
+import numpy as np
+
+from pixtolic.host.image import split_rgb, to_image
+from pixtolic.processors.alu import (
+    PixelOperand,
+    PixelDestination,
+    PixelOpcode,
+    REGISTER_COUNT,
+    REGISTER_WIDTH,
+    pixel_instruction_layout,
+)
+from pixtolic.util import fields_for
+
+
+class PixelEmulator:
+
+    """Run PixelALU programs over a whole frame at once with NumPy.
+
+    Every pixel gets its own copy of GP0-GP3 and the output register,
+    stored as uint32 planes, so one instruction is a handful of
+    vectorized operations over the frame instead of a pysim step per
+    pixel. XPOS and YPOS are broadcast grids and FRAME / IMM are
+    scalars; arithmetic wraps at 32 bits and comparisons are unsigned,
+    exactly like the gateware.
+
+    Hardware lanes keep their registers from one pixel batch to the
+    next, while here every pixel starts with zeroed registers, so
+    programs should write a register before reading it if they are
+    meant to agree with the board pixel for pixel.
+
+    """
+
+    def __init__(self, width, height, pixel_depth=4):
+        self.width = width
+        self.height = height
+        self.pixel_depth = pixel_depth
+        self.x_pos = np.arange(width, dtype='uint32')[np.newaxis, :]
+        self.y_pos = np.arange(height, dtype='uint32')[:, np.newaxis]
+        self.reset()
+
+    def reset(self):
+        shape = (self.height, self.width)
+        self.registers = np.zeros((REGISTER_COUNT,) + shape, dtype='uint32')
+        self.output = np.zeros(shape, dtype='uint32')
+
+    def step(self, instruction, x_pos=None, y_pos=None, frame=0):
+        """Execute one instruction word on every pixel, returning the
+        ALU result (before truncation to the output width)."""
+        fields = fields_for(pixel_instruction_layout, instruction)
+        operands = {
+            PixelOperand.XPOS.value: self.x_pos if x_pos is None else x_pos,
+            PixelOperand.YPOS.value: self.y_pos if y_pos is None else y_pos,
+            PixelOperand.FRAME.value: frame,
+            PixelOperand.IMM.value: fields['immediate'],
+        }
+        left = self.operand(operands, fields['left_op'])
+        right = self.operand(operands, fields['right_op'])
+        if fields['dest'] == PixelDestination.OUTPUT.value:
+            target = self.output
+        else:
+            # out-of-range destinations land on the last register, the
+            # same way an nmigen Array index does
+            target = self.registers[min(fields['dest'], REGISTER_COUNT - 1)]
+        result = execute(fields['opcode'], left, right, predicate=target)
+
+        if fields['dest'] == PixelDestination.OUTPUT.value:
+            target[...] = result & (2 ** (3 * self.pixel_depth) - 1)
+        else:
+            target[...] = result
+        return result
+
+    def operand(self, operands, sel):
+        if sel in operands:
+            return np.asarray(operands[sel], dtype='uint32')
+        return self.registers[sel & 0x3]
+
+    def run(self, program, frame=0):
+        """Run a whole program (a sequence of instruction words) and
+        return the frame as a (height, width, 3) array of
+        pixel_depth-bit channels."""
+        for instruction in program:
+            self.step(instruction, frame=frame)
+        return split_rgb(self.output, self.pixel_depth)
+
+    def image(self, program, frame=0):
+        return to_image(self.run(program, frame=frame), self.pixel_depth)
+
+
+def execute(opcode, left, right, predicate=0):
+    """What the ALU computes for `opcode`, on uint32 arrays (or
+    scalars). Everything wraps at 32 bits and comparisons are unsigned
+    and give 0 or 1. SHL/SHR shift by the low 5 bits of `right`
+    (logical shifts), MUL multiplies the low 16 bits of both operands,
+    and SELECT gives `left` where `predicate` (the value already in
+    the destination) is nonzero and `right` elsewhere."""
+    mask = 2 ** REGISTER_WIDTH - 1
+    left = np.asarray(left, dtype='uint32')
+    right = np.asarray(right, dtype='uint32')
+    with np.errstate(over='ignore'):
+        if opcode == PixelOpcode.NOT.value:
+            result = ~left
+        elif opcode == PixelOpcode.AND.value:
+            result = left & right
+        elif opcode == PixelOpcode.OR.value:
+            result = left | right
+        elif opcode == PixelOpcode.XOR.value:
+            result = left ^ right
+        elif opcode == PixelOpcode.ADD.value:
+            result = left + right
+        elif opcode == PixelOpcode.SUB.value:
+            result = left - right
+        elif opcode == PixelOpcode.EQ.value:
+            result = left == right
+        elif opcode == PixelOpcode.GT.value:
+            result = left > right
+        elif opcode == PixelOpcode.GTE.value:
+            result = left >= right
+        elif opcode == PixelOpcode.LT.value:
+            result = left < right
+        elif opcode == PixelOpcode.LTE.value:
+            result = left <= right
+        elif opcode == PixelOpcode.SHL.value:
+            result = left << (right & 31)
+        elif opcode == PixelOpcode.SHR.value:
+            result = left >> (right & 31)
+        elif opcode == PixelOpcode.MUL.value:
+            result = (left & 0xFFFF) * (right & 0xFFFF)
+        elif opcode == PixelOpcode.SELECT.value:
+            result = np.where(np.asarray(predicate) != 0, left, right)
+        else:
+            # unused opcodes leave the result at its reset value
+            result = np.zeros_like(left)
+    return np.asarray(result).astype('uint32') & mask
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+
+    from pixtolic.processors.ppu import default_program
+
+    emulator = PixelEmulator(800, 600)
+    start = perf_counter()
+    emulator.image(default_program()).save('emulator.png')
+    elapsed = perf_counter() - start
+    print(f'{len(default_program())} instructions in {elapsed * 1e3:.1f} ms')
@@ -0,0 +1,67 @@
+import argparse
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from pixtolic.sources.still import image_words
+
+
+# where the images go in the SPI flash, well past the bitstream
+FLASH_OFFSET = 0x100000
+FLASH_SIZE = 0x1000000
+
+
+def frame_bytes(width, height, color_depth):
+    # each frame starts on a byte
+    return -(-width * height * 3 * color_depth // 8)
+
+
+def pack(words, color_depth):
+    """The pixel words of one frame as FlashStream reads them: one
+    after the other, most significant bit first, with no padding
+    between pixels."""
+    width = 3 * color_depth
+    words = np.asarray(words, dtype='uint32')
+    bits = (words[:, None] >> np.arange(width - 1, -1, -1)) & 1
+    return np.packbits(bits.astype('uint8').flatten()).tobytes()
+
+
+def flash_image(frames, color_depth):
+    """All of `frames` (lists of pixel words, all the same size)
+    packed one after the other, to be written at FLASH_OFFSET."""
+    return b''.join(pack(words, color_depth) for words in frames)
+
+
+def load_frames(fnames, size, color_depth):
+    # every frame of every image, so animated GIFs come out as all
+    # their frames
+    frames = []
+    for fname in fnames:
+        for frame in ImageSequence.Iterator(Image.open(fname)):
+            frames.append(image_words(frame.convert('RGB').resize(size), color_depth))
+    return frames
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.flash',
+        description='pack images (or animation frames) into a file to write to the '
+                    'SPI flash for a board built with --flash',
+    )
+    p.add_argument('image', nargs='+')
+    p.add_argument('--size', default='400x300',
+                   help='size of the frames the board was built with (default: %(default)s)')
+    p.add_argument('--color-depth', type=int, default=4)
+    p.add_argument('-o', '--output', default='frames.bin')
+    args = p.parse_args()
+    size = tuple(int(n) for n in args.size.split('x'))
+
+    frames = load_frames(args.image, size, args.color_depth)
+    data = flash_image(frames, args.color_depth)
+    if FLASH_OFFSET + len(data) > FLASH_SIZE:
+        p.error(f'{len(frames)} frames take {len(data)} bytes, more than the '
+                f'{FLASH_SIZE - FLASH_OFFSET} there is room for')
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    print(f'{len(frames)} frames, {len(data)} bytes. build with --flash {len(frames)} '
+          f'and write them with: iceprog -o {FLASH_OFFSET // 1024}k {args.output}')
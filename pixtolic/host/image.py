@@ -0,0 +1,24 @@
+import numpy as np
+from PIL import Image
+
+
+def split_rgb(words, color_depth):
+    # packed words (red in the top bits, like Still and the ALU
+    # output) -> array of shape words.shape + (3,)
+    words = np.asarray(words, dtype='uint32')
+    mask = 2 ** color_depth - 1
+    return np.stack(
+        [
+            (words >> (color_depth * 2)) & mask,
+            (words >> (color_depth * 1)) & mask,
+            (words >> (color_depth * 0)) & mask,
+        ],
+        axis=-1,
+    ).astype('uint8')
+
+
+def to_image(rgb, color_depth):
+    # stretch color_depth-bit channels to the full 8-bit range
+    scale = 255 / (2 ** color_depth - 1)
+    arr = np.round(np.asarray(rgb) * scale).astype('uint8')
+    return Image.fromarray(arr, mode='RGB')
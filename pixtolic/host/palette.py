@@ -0,0 +1,98 @@
+import argparse
+
+import numpy as np
+from PIL import Image
+
+from pixtolic.host.image import split_rgb, to_image
+
+
+def channels(image, color_depth):
+    # (height, width, 3) channels of color_depth bits each
+    return np.array(image.convert('RGB'), dtype='uint32') >> (8 - color_depth)
+
+
+def nearest(colors, palette):
+    # index of the closest palette entry to each of `colors`
+    distance = ((colors[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+    return distance.argmin(axis=1)
+
+
+def median_cut(colors, counts, size):
+    """Up to `size` colors standing in for `colors` (n, 3), each of
+    which covers `counts` pixels: the box around them is split at the
+    median of its widest channel until there are `size` boxes, and each
+    box is replaced by its average."""
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < size:
+        # split the box with the most pixels times the widest extent
+        scores = [
+            counts[box].sum() * np.ptp(colors[box], axis=0).max() if len(box) > 1 else 0
+            for box in boxes
+        ]
+        i = int(np.argmax(scores))
+        if scores[i] == 0:
+            # fewer colors than `size` to begin with
+            break
+        box = boxes.pop(i)
+        channel = np.ptp(colors[box], axis=0).argmax()
+        box = box[np.argsort(colors[box, channel], kind='stable')]
+        total = np.cumsum(counts[box])
+        split = int(np.clip(np.searchsorted(total, total[-1] / 2) + 1, 1, len(box) - 1))
+        boxes += [box[:split], box[split:]]
+    return np.array([np.average(colors[box], axis=0, weights=counts[box]) for box in boxes])
+
+
+def kmeans(colors, counts, centers, iterations=8):
+    """Move `centers` to the average of the colors nearest to them, a
+    few times over."""
+    centers = centers.copy()
+    for _ in range(iterations):
+        closest = nearest(colors, centers)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, closest, colors * counts[:, None])
+        weights = np.bincount(closest, weights=counts, minlength=len(centers))
+        used = weights > 0
+        centers[used] = sums[used] / weights[used, None]
+    return centers
+
+
+def quantize(image, color_depth, colors=16, iterations=8):
+    """A palette of `colors` color words (red in the top bits, like
+    Still's) for `image` at `color_depth`, and the index of the palette
+    entry for each pixel, row by row."""
+    rgb = channels(image, color_depth).reshape(-1, 3)
+    unique, inverse, counts = np.unique(rgb, axis=0, return_inverse=True, return_counts=True)
+    unique = unique.astype(float)
+    centers = kmeans(unique, counts, median_cut(unique, counts, colors), iterations)
+    palette = np.clip(np.round(centers), 0, 2 ** color_depth - 1).astype('uint32')
+    indices = nearest(unique, palette.astype(float))[inverse.reshape(-1)]
+    words = palette[:, 0] << (2 * color_depth) | palette[:, 1] << color_depth | palette[:, 2]
+    return words.tolist() + [0] * (colors - len(words)), indices.tolist()
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.palette',
+        description='quantize an image the way IndexedStill does and show how it comes out',
+    )
+    p.add_argument('image')
+    p.add_argument('--size', default='160x120')
+    p.add_argument('--colors', type=int, default=16)
+    p.add_argument('--color-depth', type=int, default=4)
+    p.add_argument('-o', '--output', help='save the quantized image here')
+    args = p.parse_args()
+    size = tuple(int(n) for n in args.size.split('x'))
+
+    image = Image.open(args.image).resize(size)
+    palette, indices = quantize(image, args.color_depth, args.colors)
+    quantized = split_rgb(np.array(palette)[indices], args.color_depth).reshape(size[1], size[0], 3)
+    error = np.sqrt(np.mean((quantized.astype(float) - channels(image, args.color_depth)) ** 2))
+    index_bits = (args.colors - 1).bit_length()
+    print(
+        f'{args.colors} colors: {size[0] * size[1] * index_bits / 1024:.1f} kbit of indices '
+        f'instead of {size[0] * size[1] * 3 * args.color_depth / 1024:.1f} kbit of colors, '
+        f'RMS error {error:.2f} of {2 ** args.color_depth - 1} per channel'
+    )
+    if args.output:
+        to_image(quantized, args.color_depth).save(args.output)
+        print('wrote', args.output)
@@ -4,6 +4,8 @@ import binascii
 import aioconsole
 import serial_asyncio
 
+from pixtolic.ui.uart import DEFAULT_BAUD_RATE
+
 
 class Repl(asyncio.Protocol):
     def connection_made(self, transport):
@@ -36,7 +38,7 @@ if __name__ == '__main__':
         loop,
         Repl,
         '/dev/ttyUSB0',
-        baudrate=115200,
+        baudrate=DEFAULT_BAUD_RATE,
     )
     loop.run_until_complete(coro)
     loop.run_forever()
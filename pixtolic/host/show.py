@@ -0,0 +1,85 @@
+import argparse
+from time import perf_counter, sleep
+
+from PIL import Image
+import serial
+
+from pixtolic.host.upload import Refused, send
+from pixtolic.sources.still import image_words
+from pixtolic.ui.image_loader import IMAGE, SHOW, image_payloads
+from pixtolic.ui.uart import DEFAULT_BAUD_RATE
+
+
+def show(s, words, previous=None, color_depth=4, double_buffered=False, retries=2):
+    """Replace the image on the board on the open port `s` with
+    `words`, sending only what changed since `previous` if it's
+    known. Returns the number of bytes sent.
+
+    A packet that doesn't get through may have written garbage
+    anywhere in the image, so then the whole image is sent again
+    without skipping anything, up to `retries` times.
+
+    With `double_buffered`, the image is drawn into a Framebuffer's
+    back buffer and shown once it's all there, and `previous` has to be
+    the image before the one on the screen, since that's what the back
+    buffer holds."""
+    payloads = image_payloads(words, previous, color_depth)
+    sent = 0
+    for attempt in range(retries + 1):
+        try:
+            for payload in payloads:
+                sent += len(payload)
+                send(s, IMAGE, payload, retries=0)
+            break
+        except (Refused, RuntimeError):
+            if attempt == retries:
+                raise
+            payloads = image_payloads(words, None, color_depth)
+    if double_buffered:
+        # answered once the buffers have swapped
+        send(s, SHOW, b'')
+    return sent
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.show',
+        description='show images on the board without rebuilding it. each one after '
+                    'the first is sent as the difference from the one before',
+    )
+    p.add_argument('image', nargs='+')
+    p.add_argument('--size',
+                   help='size of the image the board was built with '
+                        '(default: 100x75, or 200x150 with --double-buffered)')
+    p.add_argument('--color-depth', type=int, default=4)
+    p.add_argument('--delay', type=float, default=0,
+                   help='seconds to wait between images')
+    p.add_argument('--loop', action='store_true', help='keep going round the images')
+    p.add_argument('--double-buffered', action='store_true',
+                   help='for a board built with --framebuffer: draw each image out of '
+                        'sight and swap it in between frames')
+    p.add_argument('--port', default='/dev/ttyUSB0')
+    p.add_argument('--baudrate', type=int, default=DEFAULT_BAUD_RATE)
+    args = p.parse_args()
+    size = tuple(int(n) for n in (args.size or ('200x150' if args.double_buffered else '100x75')).split('x'))
+
+    frames = [
+        image_words(Image.open(fname).resize(size), args.color_depth)
+        for fname in args.image
+    ]
+    raw = size[0] * size[1] * 3 * args.color_depth // 8
+    # what the buffer being drawn into holds, oldest first
+    shown = [None, None] if args.double_buffered else [None]
+    with serial.Serial(args.port, args.baudrate, timeout=1) as s:
+        while True:
+            for fname, words in zip(args.image, frames):
+                start = perf_counter()
+                sent = show(s, words, shown[0], args.color_depth, args.double_buffered)
+                print(
+                    f'{fname}: {sent} bytes ({raw / max(sent, 1):.1f}x smaller than raw) '
+                    f'in {1000 * (perf_counter() - start):.1f} ms'
+                )
+                shown = shown[1:] + [words]
+                sleep(args.delay)
+            if not args.loop:
+                break
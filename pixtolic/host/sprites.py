@@ -0,0 +1,51 @@
+import argparse
+from time import perf_counter, sleep
+
+import numpy as np
+import serial
+
+from pixtolic.host.upload import send
+from pixtolic.ui.sprite_loader import SPRITES, sprite_payload
+from pixtolic.ui.uart import DEFAULT_BAUD_RATE
+
+
+def move(s, sprites, first=0):
+    """Move sprites `first` on to `sprites`, (x, y, tile) each, on the
+    open port `s`. They move at the top of the next frame."""
+    send(s, SPRITES, sprite_payload(first, sprites))
+
+
+def bounce(positions, velocities, size):
+    # one step of balls bouncing off the edges of a scene of `size`
+    positions += velocities
+    for axis in (0, 1):
+        low = positions[:, axis] < 0
+        high = positions[:, axis] > size[axis] - 8
+        velocities[low | high, axis] *= -1
+        positions[:, axis] = np.clip(positions[:, axis], 0, size[axis] - 8)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.sprites',
+        description='bounce the sprites of a board built with --tiles around the scene',
+    )
+    p.add_argument('--count', type=int, default=8, help='how many sprites to move')
+    p.add_argument('--tile', type=int, default=0, help='tile to show them as (0 is the ball)')
+    p.add_argument('--size', default='400x304',
+                   help='size of the scene the board was built with (default: %(default)s)')
+    p.add_argument('--rate', type=float, default=56, help='moves a second')
+    p.add_argument('--port', default='/dev/ttyUSB0')
+    p.add_argument('--baudrate', type=int, default=DEFAULT_BAUD_RATE)
+    args = p.parse_args()
+    size = tuple(int(n) for n in args.size.split('x'))
+
+    rng = np.random.RandomState()
+    positions = rng.uniform(0, 1, (args.count, 2)) * (np.array(size) - 8)
+    velocities = rng.uniform(-3, 3, (args.count, 2))
+    with serial.Serial(args.port, args.baudrate, timeout=1) as s:
+        while True:
+            start = perf_counter()
+            bounce(positions, velocities, size)
+            move(s, [(int(x), int(y), args.tile) for x, y in positions])
+            sleep(max(0, 1 / args.rate - (perf_counter() - start)))
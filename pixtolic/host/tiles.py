@@ -0,0 +1,98 @@
+import argparse
+
+import numpy as np
+from PIL import Image
+
+from pixtolic.host.image import split_rgb, to_image
+from pixtolic.host.palette import quantize
+
+
+TILE = 8
+
+
+def ball(index):
+    """An 8x8 sprite tile of a ball in palette entry `index`, with 0
+    (transparent) around it."""
+    y, x = np.mgrid[:TILE, :TILE] + 0.5
+    inside = (x - TILE / 2) ** 2 + (y - TILE / 2) ** 2 <= (TILE / 2) ** 2
+    return np.where(inside, index, 0)
+
+
+def brightest(palette, color_depth):
+    # the brightest palette entry other than 0, which sprites can't
+    # use since it's transparent for them
+    rgb = split_rgb(palette, color_depth).astype(int)
+    return 1 + int(rgb[1:].sum(axis=1).argmax())
+
+
+def tileset(image, color_depth, max_tiles=128, colors=16, first=0):
+    """Cut `image` (a multiple of 8 pixels each way) into 8x8 tiles of
+    palette indices. Returns the palette, the tiles (n, 8, 8) and the
+    map of tile numbers (rows, cols), which start from `first` to leave
+    room for that many sprite tiles before them. If there are more
+    different tiles than fit in `max_tiles`, the most common ones are
+    kept and the rest are drawn with whichever of those looks
+    closest."""
+    palette, indices = quantize(image, color_depth, colors)
+    rows, cols = image.height // TILE, image.width // TILE
+    cells = (
+        np.array(indices).reshape(rows, TILE, cols, TILE)
+        .transpose(0, 2, 1, 3).reshape(rows * cols, TILE * TILE)
+    )
+    unique, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    room = max_tiles - first
+    if len(unique) > room:
+        keep = np.argsort(-counts, kind='stable')[:room]
+        rgb = split_rgb(palette, color_depth).astype(float)
+        kept = rgb[unique[keep]].reshape(room, -1)
+        closest = np.empty(len(unique), dtype=int)
+        for i, tile in enumerate(unique):
+            closest[i] = ((kept - rgb[tile].reshape(-1)) ** 2).sum(axis=1).argmin()
+        unique, inverse = unique[keep], closest[inverse]
+    return palette, unique.reshape(-1, TILE, TILE), (inverse + first).reshape(rows, cols)
+
+
+def render(palette, tiles, tilemap, sprites=()):
+    """The scene a TileEngine shows, as palette words: the tiles laid
+    out by `tilemap`, with `sprites` (x, y, tile) drawn over them, the
+    first one on top."""
+    rows, cols = tilemap.shape
+    indices = tiles[tilemap].transpose(0, 2, 1, 3).reshape(rows * TILE, cols * TILE)
+    for x, y, tile in reversed(list(sprites)):
+        for row in range(TILE):
+            for column in range(TILE):
+                index = tiles[tile][row][column]
+                if index and 0 <= y + row < indices.shape[0] and 0 <= x + column < indices.shape[1]:
+                    indices[y + row, x + column] = index
+    return np.array(palette, dtype='uint32')[indices]
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.tiles',
+        description='cut an image into tiles the way the board built with --tiles does '
+                    'and show how it comes out',
+    )
+    p.add_argument('image')
+    p.add_argument('--size', default='400x304')
+    p.add_argument('--tiles', type=int, default=128)
+    p.add_argument('--color-depth', type=int, default=4)
+    p.add_argument('-o', '--output', help='save the tiled image here')
+    args = p.parse_args()
+    size = tuple(int(n) for n in args.size.split('x'))
+
+    image = Image.open(args.image).convert('RGB').resize(size)
+    palette, tiles, tilemap = tileset(image, args.color_depth, args.tiles)
+    index_bits = (len(palette) - 1).bit_length()
+    map_bits = tilemap.size * (len(tiles) - 1).bit_length()
+    tile_bits = tiles.size * index_bits
+    print(
+        f'{tilemap.shape[1]}x{tilemap.shape[0]} map of {len(tiles)} tiles: '
+        f'{(map_bits + tile_bits) / 8192:.1f} KB of block RAM instead of '
+        f'{size[0] * size[1] * 3 * args.color_depth / 8192:.1f} KB'
+    )
+    if args.output:
+        scene = split_rgb(render(palette, tiles, tilemap), args.color_depth)
+        to_image(scene, args.color_depth).save(args.output)
+        print('wrote', args.output)
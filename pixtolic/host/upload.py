@@ -0,0 +1,66 @@
+import argparse
+import sys
+from time import perf_counter
+
+import serial
+
+from pixtolic.host.assembler import AssemblyError, assemble
+from pixtolic.host.compiler import CompileError, compile_program
+from pixtolic.ui.loader import PROGRAM, program_payload
+from pixtolic.ui.packet import ACK, NAK, packet
+from pixtolic.ui.uart import DEFAULT_BAUD_RATE
+
+
+class Refused(Exception):
+    pass
+
+
+def send(s, command, payload, retries=2):
+    """Send one packet on the open port `s` and wait for the reply,
+    sending it again if it got lost or corrupted on the way."""
+    data = packet(command, payload)
+    for _ in range(retries + 1):
+        s.write(data)
+        reply = s.read(1)
+        if reply == bytes([ACK]):
+            return
+    if reply == bytes([NAK]):
+        raise Refused(f'the board refused the packet ({len(payload)} bytes for command {command:#04x})')
+    raise RuntimeError(f'no reply from {s.port}' if not reply else f'unexpected reply {reply!r}')
+
+
+def upload(port, words, baudrate=DEFAULT_BAUD_RATE, timeout=1):
+    """Send a program to a board built with `--ppu-lanes` and wait for
+    it to be accepted."""
+    with serial.Serial(port, baudrate, timeout=timeout) as s:
+        try:
+            send(s, PROGRAM, program_payload(words))
+        except Refused:
+            raise ValueError(f'the board has no room for {len(words)} instructions') from None
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.host.upload',
+        description='compile a pixel program and load it into the running pixel processor',
+    )
+    p.add_argument('source', help="program text (e.g. 'out = x ^ y') or a file to read it from")
+    p.add_argument('--asm', action='store_true',
+                   help='the source is assembly instead of expressions')
+    p.add_argument('--port', default='/dev/ttyUSB0')
+    p.add_argument('--baudrate', type=int, default=DEFAULT_BAUD_RATE)
+    args = p.parse_args()
+
+    if '=' in args.source or ',' in args.source:
+        source = args.source
+    else:
+        with open(args.source) as f:
+            source = f.read()
+    try:
+        words = assemble(source) if args.asm else compile_program(source)
+    except (AssemblyError, CompileError) as e:
+        sys.exit(f'error: {e}')
+
+    start = perf_counter()
+    upload(args.port, words, args.baudrate)
+    print(f'loaded {len(words)} instructions in {1000 * (perf_counter() - start):.1f} ms')
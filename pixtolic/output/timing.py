@@ -5,36 +5,51 @@ from nmigen import *
 
 class VgaTiming(Elaboratable):
     
-    def __init__(self, resolution):
+    def __init__(self, resolution, start_line=0, start_pixel=0, fast_forward=False):
         self.res = resolution
         self.hsync = Signal()
         self.vsync = Signal()
         self.active = Signal()
 
-        self.scan_counter = Signal(range(self.res.width + self.res.h.overscan))
-        self.line_counter = Signal(range(self.res.height + self.res.v.overscan))
+        # the counters can start anywhere in the frame. on hardware
+        # this doesn't matter, but simulations can begin right before
+        # the part of the frame they care about instead of clocking
+        # through sync and porches first
+        if not 0 <= start_pixel < self.res.h.fullscan:
+            raise ValueError(f'start_pixel {start_pixel} is outside the {self.res.h.fullscan} pixel line')
+        if not 0 <= start_line < self.res.v.fullscan:
+            raise ValueError(f'start_line {start_line} is outside the {self.res.v.fullscan} line frame')
+        self.start_line = start_line
+        self.start_pixel = start_pixel
+
+        self.scan_counter = Signal(range(self.res.width + self.res.h.overscan), reset=start_pixel)
+        self.line_counter = Signal(range(self.res.height + self.res.v.overscan), reset=start_line)
         self.x_pos = Signal(range(self.res.width))
         self.y_pos = Signal(range(self.res.height))
         self.new_frame = Signal()
         self.new_line = Signal()
 
+        # for simulation: when `jump` is high the counters load
+        # `jump_line`/`jump_pixel` on the next clock instead of
+        # counting. see pixtolic.sim.fastforward
+        self.fast_forward = fast_forward
+        self.jump = Signal()
+        self.jump_line = Signal.like(self.line_counter)
+        self.jump_pixel = Signal.like(self.scan_counter)
+
     def elaborate(self, platform):
         m = Module()
 
-        with m.If(self.scan_counter == self.res.width + self.res.h.overscan - 1):
-            m.d.pixel += self.scan_counter.eq(0)
-            with m.If(self.line_counter == self.res.height + self.res.v.overscan - 1):
+        if self.fast_forward:
+            with m.If(self.jump):
                 m.d.pixel += [
-                    self.line_counter.eq(0),
+                    self.line_counter.eq(self.jump_line),
+                    self.scan_counter.eq(self.jump_pixel),
                 ]
             with m.Else():
-                m.d.pixel += [
-                    self.line_counter.eq(self.line_counter + 1),
-                ]
-        with m.Else():
-            m.d.pixel += [
-                self.scan_counter.eq(self.scan_counter + 1),
-            ]
+                self.count(m)
+        else:
+            self.count(m)
 
         m.d.comb += [
             self.active.eq(reduce(
@@ -67,3 +82,31 @@ class VgaTiming(Elaboratable):
             m.d.comb += self.y_pos.eq(0)
 
         return m
+
+    def count(self, m):
+        with m.If(self.scan_counter == self.res.width + self.res.h.overscan - 1):
+            m.d.pixel += self.scan_counter.eq(0)
+            with m.If(self.line_counter == self.res.height + self.res.v.overscan - 1):
+                m.d.pixel += [
+                    self.line_counter.eq(0),
+                ]
+            with m.Else():
+                m.d.pixel += [
+                    self.line_counter.eq(self.line_counter + 1),
+                ]
+        with m.Else():
+            m.d.pixel += [
+                self.scan_counter.eq(self.scan_counter + 1),
+            ]
+
+    @classmethod
+    def warm(cls, resolution, lines_before=0, fast_forward=False):
+        """Timing that starts on the clock where `new_frame` fires,
+        i.e. just before the first visible pixel, or `lines_before`
+        lines ahead of that."""
+        return cls(
+            resolution,
+            start_line=resolution.v.prescan - lines_before,
+            start_pixel=resolution.h.prescan - 1,
+            fast_forward=fast_forward,
+        )
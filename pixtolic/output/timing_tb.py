@@ -1,10 +1,11 @@
+import sys
+
 from nmigen import *
-from nmigen.sim.pysim import *
 
 from pixtolic.config.resolutions import resolutions, ResolutionName
 from pixtolic.output.timing import VgaTiming
-from pixtolic.patterns import TestPattern
-from pixtolic.output.vga import vga_layout
+from pixtolic.sources.patterns import TestPattern
+from pixtolic.sim.bench import Bench
 
 
 class Testbench(Elaboratable):
@@ -14,24 +15,17 @@ class Testbench(Elaboratable):
 
     def elaborate(self, platform):
         m = Module()
-        
+
         m.submodules += self.timing
         m.submodules += self.pattern
 
         return m
 
-def vga_lines(dut):
-    for _ in range(800 * 600):
-        yield
+def bench(resolution, color_depth):
+    timing = VgaTiming.warm(resolution, fast_forward=True)
+    pattern = TestPattern(timing, color_depth)
+    return Bench(Testbench(timing, pattern), timing=timing, source=pattern)
 
 if __name__ == '__main__':
-    vga = Record(vga_layout(4))
-    timing = VgaTiming(resolutions[ResolutionName.VGA_640_480p_60hz])
-    dut = Testbench(timing, TestPattern(vga, timing, 4))
-    sim = Simulator(dut)
-    def proc():
-        yield from vga_lines(dut)
-    sim.add_clock(1e-6, domain='pixel')
-    sim.add_sync_process(proc, domain='pixel')
-    with sim.write_vcd('timing.vcd'):
-        sim.run()
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='timing_tb')
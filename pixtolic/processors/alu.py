@@ -33,6 +33,10 @@ class PixelOpcode(Enum):
     GTE = 8
     LT  = 9
     LTE = 10
+    SHL = 11
+    SHR = 12
+    MUL = 13
+    SELECT = 14
 
 REGISTER_COUNT = 4
 REGISTER_WIDTH = 32
@@ -48,10 +52,46 @@ pixel_instruction_layout = [
 
 class PixelALU(Elaboratable):
 
-    def __init__(self, pixel_depth):
+    """One pixel's worth of processor: picks two operands, applies the
+    opcode and writes the result to a register or the output.
+
+    With `pipeline=0` all of that happens in the clock the instruction
+    is presented. Longer pipelines take the operand fetch and the
+    write back out of the clock the result is computed in; the result
+    lands `latency` clocks later, and instructions can still use the
+    result of the one right before them:
+
+    1. the operands (including registers) are fetched into pipeline
+       registers, then the result is computed and written back the
+       clock after. The result written last clock is forwarded to the
+       instruction executing now, which fetched its operands before
+       it was written.
+    2. the same, except that the result goes into a register of its
+       own and is written back the clock after that. Results on their
+       way to the register file are also forwarded to the
+       instructions fetching their operands.
+
+    `stall` freezes the whole pipeline, while `enable` marks whether
+    the instruction being presented should write anything at all.
+
+    The shifts only use the low 5 bits of the right operand, MUL
+    multiplies the low 16 bits of each operand (one DSP block on the
+    UP5K), and SELECT writes the left operand if its destination is
+    currently nonzero and the right operand otherwise. See
+    `pixtolic.host.emulator.execute` for all of them in NumPy.
+
+    """
+
+    def __init__(self, pixel_depth, pipeline=0):
+        if pipeline not in (0, 1, 2):
+            raise ValueError(f'pipeline depth should be 0, 1 or 2, not {pipeline}')
         self.pixel_depth = pixel_depth
+        self.pipeline = self.latency = pipeline
 
-        self.instruction = Record(pixel_Binstruction_layout)
+        self.instruction = Record(pixel_instruction_layout)
+        # when low, the instruction doesn't write anything
+        self.enable = Signal(reset=1)
+        self.stall = Signal()
         self.x_pos = Signal(32)
         self.y_pos = Signal(32)
         self.frame = Signal(32)
@@ -59,6 +99,8 @@ class PixelALU(Elaboratable):
         self.left = Signal(REGISTER_WIDTH)
         self.right = Signal(REGISTER_WIDTH)
         self.result = Signal(REGISTER_WIDTH)
+        # SELECT's condition: whether the destination is nonzero
+        self.predicate = Signal()
         self.output = Signal(3 * self.pixel_depth)
         self.registers = Array(
             Signal(REGISTER_WIDTH) for _ in range(REGISTER_COUNT)
@@ -67,10 +109,120 @@ class PixelALU(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        self.pick_operand(m, 'left_op', 'left')
-        self.pick_operand(m, 'right_op', 'right')
+        if self.pipeline == 0:
+            self.pick_operand(m, self.instruction.left_op, self.left, self.instruction, self.registers)
+            self.pick_operand(m, self.instruction.right_op, self.right, self.instruction, self.registers)
+            m.d.comb += self.predicate.eq(self.pick_predicate(self.instruction.dest, self.registers, self.output))
+            self.execute(m, self.instruction.opcode)
+            self.write_back(m, self.instruction.dest, self.result, self.enable)
+
+        else:
+            # the result of the instruction executed last clock. with
+            # pipeline=1 it is already in the register file, but wasn't
+            # when the instruction behind it fetched its operands; with
+            # pipeline=2 it is written back this clock
+            writing = Record([('valid', 1), ('dest', len(self.instruction.dest)), ('result', REGISTER_WIDTH)])
+            if self.pipeline == 2:
+                # fetch, with whatever is about to be written back
+                # forwarded into the register reads
+                registers = Array(
+                    Mux(self.writes_register(writing, i), writing.result, register)
+                    for i, register in enumerate(self.registers)
+                )
+                output = Mux(
+                    self.writes_dest(writing, PixelDestination.OUTPUT.value),
+                    writing.result[:len(self.output)],
+                    self.output,
+                )
+            else:
+                registers, output = self.registers, self.output
+            left = Signal(REGISTER_WIDTH)
+            right = Signal(REGISTER_WIDTH)
+            self.pick_operand(m, self.instruction.left_op, left, self.instruction, registers)
+            self.pick_operand(m, self.instruction.right_op, right, self.instruction, registers)
+            predicate = self.pick_predicate(self.instruction.dest, registers, output)
+
+            fetched = Record([
+                ('valid', 1),
+                ('left_op', len(self.instruction.left_op)),
+                ('right_op', len(self.instruction.right_op)),
+                ('dest', len(self.instruction.dest)),
+                ('opcode', len(self.instruction.opcode)),
+                ('left', REGISTER_WIDTH),
+                ('right', REGISTER_WIDTH),
+                ('predicate', 1),
+            ])
+            with m.If(~self.stall):
+                m.d.pixel += [
+                    fetched.valid.eq(self.enable),
+                    fetched.left_op.eq(self.instruction.left_op),
+                    fetched.right_op.eq(self.instruction.right_op),
+                    fetched.dest.eq(self.instruction.dest),
+                    fetched.opcode.eq(self.instruction.opcode),
+                    fetched.left.eq(left),
+                    fetched.right.eq(right),
+                    fetched.predicate.eq(predicate),
+                ]
+
+            # execute, with the result of the instruction right before
+            # this one forwarded, since it wasn't written when this
+            # one fetched its operands
+            for sel, fetched_value, data in [
+                (fetched.left_op, fetched.left, self.left),
+                (fetched.right_op, fetched.right, self.right),
+            ]:
+                forward = (sel < REGISTER_COUNT) & self.writes_register(writing, sel[0:2])
+                m.d.comb += data.eq(Mux(forward, writing.result, fetched_value))
+            forwarded_result = Mux(
+                fetched.dest == PixelDestination.OUTPUT,
+                writing.result[:len(self.output)],
+                writing.result,
+            )
+            m.d.comb += self.predicate.eq(Mux(
+                self.writes_dest(writing, fetched.dest),
+                forwarded_result != 0,
+                fetched.predicate,
+            ))
+            self.execute(m, fetched.opcode)
+            with m.If(~self.stall):
+                m.d.pixel += [
+                    writing.valid.eq(fetched.valid),
+                    writing.dest.eq(fetched.dest),
+                    writing.result.eq(self.result),
+                ]
+
+            if self.pipeline == 2:
+                self.write_back(m, writing.dest, writing.result, writing.valid)
+            else:
+                self.write_back(m, fetched.dest, self.result, fetched.valid)
 
-        with m.Switch(self.instruction.opcode):
+        return m
+
+    def writes_register(self, writing, index):
+        # destinations past the last register land on it, the same
+        # way the Array index in write_back does
+        dest = Mux(writing.dest >= REGISTER_COUNT, REGISTER_COUNT - 1, writing.dest)
+        return (
+            writing.valid
+            & (writing.dest != PixelDestination.OUTPUT.value)
+            & (dest == index)
+        )
+
+    def writes_dest(self, writing, dest):
+        # whether `writing` is about to change what's in `dest`, which
+        # is either the output or a register
+        output = PixelDestination.OUTPUT.value
+        return writing.valid & Mux(
+            dest == output,
+            writing.dest == output,
+            self.writes_register(writing, Mux(dest >= REGISTER_COUNT, REGISTER_COUNT - 1, dest)),
+        )
+
+    def pick_predicate(self, dest, registers, output):
+        return Mux(dest == PixelDestination.OUTPUT, output != 0, registers[dest] != 0)
+
+    def execute(self, m, opcode):
+        with m.Switch(opcode):
             with m.Case(PixelOpcode.NOT):
                 m.d.comb += self.result.eq(~self.left)
             with m.Case(PixelOpcode.AND):
@@ -93,28 +245,35 @@ class PixelALU(Elaboratable):
                 m.d.comb += self.result.eq(self.left < self.right)
             with m.Case(PixelOpcode.LTE):
                 m.d.comb += self.result.eq(self.left <= self.right)
+            with m.Case(PixelOpcode.SHL):
+                m.d.comb += self.result.eq(self.left << self.right[:5])
+            with m.Case(PixelOpcode.SHR):
+                m.d.comb += self.result.eq(self.left >> self.right[:5])
+            with m.Case(PixelOpcode.MUL):
+                m.d.comb += self.result.eq(self.left[:16] * self.right[:16])
+            with m.Case(PixelOpcode.SELECT):
+                m.d.comb += self.result.eq(Mux(self.predicate, self.left, self.right))
 
-        with m.If(self.instruction.dest == PixelDestination.OUTPUT):
-            m.d.pixel += self.output.eq(self.result)
-        with m.Else():
-            m.d.pixel += self.registers[self.instruction.dest].eq(self.result)
-
-        return m
+    def write_back(self, m, dest, result, valid):
+        with m.If(valid & ~self.stall):
+            with m.If(dest == PixelDestination.OUTPUT):
+                m.d.pixel += self.output.eq(result)
+            with m.Else():
+                m.d.pixel += self.registers[dest].eq(result)
 
-    def pick_operand(self, m, sel_attr, data_attr):
-        sel = getattr(self.instruction, sel_attr)
-        data = getattr(self, data_attr)
+    def pick_operand(self, m, sel, data, instruction, registers, inputs=None):
+        inputs = self if inputs is None else inputs
         with m.Switch(sel):
             with m.Case(PixelOperand.XPOS):
-                m.d.comb += data.eq(self.x_pos)
+                m.d.comb += data.eq(inputs.x_pos)
             with m.Case(PixelOperand.YPOS):
-                m.d.comb += data.eq(self.y_pos)
+                m.d.comb += data.eq(inputs.y_pos)
             with m.Case(PixelOperand.FRAME):
-                m.d.comb += data.eq(self.frame)
+                m.d.comb += data.eq(inputs.frame)
             with m.Case(PixelOperand.IMM):
-                m.d.comb += data.eq(self.instruction.immediate)
+                m.d.comb += data.eq(instruction.immediate)
             with m.Default():
-                m.d.comb += data.eq(self.registers[sel & 0x3])
+                m.d.comb += data.eq(registers[sel & 0x3])
 
     def slice_pixels(self, reg):
         yield reg[0:4]
@@ -0,0 +1,74 @@
+import argparse
+import re
+from statistics import median
+
+from nmigen import *
+from nmigen_boards.icebreaker import ICEBreakerPlatform
+
+from pixtolic.processors.alu import PixelALU, pixel_instruction_layout
+from pixtolic.util import layout_width
+
+
+class FmaxHarness(Elaboratable):
+
+    """A PixelALU on its own for nextpnr to time. Its inputs come from
+    an LFSR and its outputs are folded into an LED, so nothing gets
+    optimized away and the I/O pins stay out of the critical path."""
+
+    def __init__(self, pipeline, pixel_depth=4):
+        self.alu = PixelALU(pixel_depth, pipeline=pipeline)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        clk12 = platform.request('clk12')
+        m.domains.pixel = ClockDomain()
+        m.d.comb += ClockSignal('pixel').eq(clk12.i)
+
+        instruction_width = layout_width(pixel_instruction_layout)
+        lfsr = Signal(instruction_width + 3 * 32, reset=1)
+        m.d.pixel += lfsr.eq(Cat(lfsr[1:], lfsr[0] ^ lfsr[1] ^ lfsr[5] ^ lfsr[-1]))
+
+        m.submodules.alu = alu = self.alu
+        inputs = Cat(alu.instruction, alu.x_pos, alu.y_pos, alu.frame)
+        m.d.comb += inputs.eq(lfsr)
+
+        led = platform.request('led_r')
+        m.d.pixel += led.eq(Cat(alu.output, *alu.registers).xor())
+
+        return m
+
+
+def fmax(pipeline, seed):
+    platform = ICEBreakerPlatform()
+    name = f'alu_pipeline{pipeline}_seed{seed}'
+    products = platform.build(
+        FmaxHarness(pipeline),
+        name=name,
+        build_dir='build/fmax',
+        nextpnr_opts=f'--seed {seed}',
+        synth_opts='-dsp',
+    )
+    # nextpnr reports the frequency after placement and again after
+    # routing; the last one counts
+    report = products.get(f'{name}.tim', 't')
+    found = re.findall(r"Max frequency for clock '[^']+': ([\d.]+) MHz", report)
+    if not found:
+        raise RuntimeError(f'no Fmax in the nextpnr log for {name}')
+    return float(found[-1])
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.processors.alu_fmax',
+        description='place and route the PixelALU at each pipeline depth and report its Fmax',
+    )
+    p.add_argument('--seeds', type=int, default=3,
+                   help='nextpnr seeds to try per depth, the median is reported')
+    args = p.parse_args()
+
+    baseline = None
+    for pipeline in (0, 1, 2):
+        result = median(fmax(pipeline, seed) for seed in range(1, args.seeds + 1))
+        baseline = baseline or result
+        print(f'pipeline={pipeline}: {result:7.2f} MHz ({result / baseline:.2f}x)')
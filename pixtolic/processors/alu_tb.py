@@ -1,24 +1,37 @@
+from random import Random
+import sys
+
 from nmigen import *
-from nmigen.sim.pysim import *
+from nmigen.sim import Settle, Tick
 
-from pixtolic.processor.alu import (
+from pixtolic.processors.alu import (
     PixelOperand,
     PixelDestination,
     PixelOpcode,
     PixelALU,
     pixel_instruction_layout,
 )
-from pixtolic.config.resolutions import resolutions, ResolutionName
+from pixtolic.host.emulator import PixelEmulator
+from pixtolic.sim.bench import Bench
+from pixtolic.util import int_for
 
 def alu_instruction_tb(alu,
                        x_pos, y_pos, frame,
-                       expected_result, expected_output):
+                       expected_result, expected_output,
+                       golden=None):
     yield alu.x_pos.eq(x_pos)
     yield alu.y_pos.eq(y_pos)
     yield alu.frame.eq(frame)
-    yield Tick(domain='pixel')
     yield Settle()
     result = yield alu.result
+    if golden is not None:
+        instruction = yield Value.cast(alu.instruction)
+        expected_result = golden.step(instruction, x_pos, y_pos, frame).item()
+        expected_output = int(golden.output[0, 0])
+    # the output register only keeps 3 * pixel_depth bits
+    expected_output &= (1 << len(alu.output)) - 1
+    yield Tick(domain='pixel')
+    yield Settle()
     output = yield alu.output
     assert expected_result == result, f'expected ALU result to be {expected_result:08X}, got {result:08X}'
     assert expected_output == output, f'expected ALU output to be {expected_output:08X}, got {output:08X}'
@@ -45,20 +58,110 @@ def alu_tb(alu):
         x_pos=0x123,
         y_pos=0x345,
         frame=0,
-        expected_result=0xFFFFFFDE,
-        expected_output=0xFDE,
+        expected_result=0xFFFFFDDE,
+        expected_output=0xDDE,
     )
 
-if __name__ == '__main__':
-    dut = PixelALU(
-        pixel_depth=4,
-        resolution=resolutions[ResolutionName.VGA_640_480p_60hz],
-        frame_limit=8,
+EDGES = [0, 1, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF]
+
+def random_instruction(rng):
+    return int_for(
+        pixel_instruction_layout,
+        left_op=rng.choice(list(PixelOperand)).value,
+        right_op=rng.choice(list(PixelOperand)).value,
+        dest=rng.choice(list(PixelDestination)).value,
+        opcode=rng.choice(list(PixelOpcode)).value,
+        immediate=rng.choice(EDGES + [rng.getrandbits(32)]),
     )
-    sim = Simulator(dut)
+
+def alu_golden_tb(alu, count=500, seed=0):
+    # random instructions checked against the NumPy emulator, which
+    # tracks the register file alongside the gateware
+    rng = Random(seed)
+    golden = PixelEmulator(1, 1, alu.pixel_depth)
+    for i, register in enumerate(alu.registers):
+        golden.registers[i] = yield register
+    golden.output[...] = yield alu.output
+    for _ in range(count):
+        yield alu.instruction.eq(random_instruction(rng))
+        yield from alu_instruction_tb(
+            alu,
+            x_pos=rng.choice(EDGES + [rng.getrandbits(32)]),
+            y_pos=rng.choice(EDGES + [rng.getrandbits(32)]),
+            frame=rng.getrandbits(32),
+            expected_result=None,
+            expected_output=None,
+            golden=golden,
+        )
+
+def alu_pipeline_tb(alu, count=1000, seed=0):
+    # random instructions issued back to back, with the odd disabled
+    # instruction and stall, so that results have to be forwarded.
+    # after each clock, everything issued more than `latency` clocks
+    # ago has to be in the register file and output
+    rng = Random(seed)
+    # let whatever is in flight from before this started drain first
+    yield alu.enable.eq(0)
+    for _ in range(alu.latency + 1):
+        yield Tick(domain='pixel')
+    yield Settle()
+    golden = PixelEmulator(1, 1, alu.pixel_depth)
+    for i, register in enumerate(alu.registers):
+        golden.registers[i] = yield register
+    golden.output[...] = yield alu.output
+    states = [(golden.registers[:, 0, 0].tolist(), int(golden.output[0, 0]))]
+    for i in range(count + alu.latency):
+        stall = rng.random() < 0.1
+        enable = i < count and rng.random() < 0.9
+        instruction = random_instruction(rng)
+        x_pos = rng.choice(EDGES + [rng.getrandbits(32)])
+        y_pos = rng.choice(EDGES + [rng.getrandbits(32)])
+        frame = rng.getrandbits(32)
+        yield alu.stall.eq(stall)
+        yield alu.enable.eq(enable)
+        yield alu.instruction.eq(instruction)
+        yield alu.x_pos.eq(x_pos)
+        yield alu.y_pos.eq(y_pos)
+        yield alu.frame.eq(frame)
+        if not stall:
+            if enable:
+                golden.step(instruction, x_pos, y_pos, frame)
+            states.append((golden.registers[:, 0, 0].tolist(), int(golden.output[0, 0])))
+        yield Tick(domain='pixel')
+        yield Settle()
+
+        expected_registers, expected_output = states[max(len(states) - 1 - alu.latency, 0)]
+        registers = []
+        for register in alu.registers:
+            registers.append((yield register))
+        output = yield alu.output
+        assert registers == expected_registers, f'pipeline {alu.pipeline} clock {i}: expected registers {expected_registers}, got {registers}'
+        assert output == expected_output, f'pipeline {alu.pipeline} clock {i}: expected output {expected_output:08X}, got {output:08X}'
+
+class TestBench(Elaboratable):
+    def __init__(self, alus):
+        self.alus = alus
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += self.alus
+        return m
+
+def bench(resolution, color_depth):
+    alu = PixelALU(pixel_depth=color_depth)
+    pipelined = [PixelALU(pixel_depth=color_depth, pipeline=depth) for depth in (0, 1, 2)]
     def proc():
-        yield from alu_tb(dut)
-    sim.add_clock(1e-6, domain='pixel')
-    sim.add_sync_process(proc, domain='pixel')
-    with sim.write_vcd('alu.vcd'):
-        sim.run()
+        yield from alu_tb(alu)
+        yield from alu_golden_tb(alu)
+    def pipeline_proc(alu):
+        def proc():
+            yield from alu_pipeline_tb(alu)
+        return proc
+    return Bench(
+        TestBench([alu] + pipelined),
+        processes=[proc] + [pipeline_proc(alu) for alu in pipelined],
+    )
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='alu_tb')
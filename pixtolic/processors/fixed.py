@@ -0,0 +1,274 @@
+import argparse
+import re
+import sys
+
+from nmigen import *
+import numpy as np
+
+from pixtolic.config.resolutions import ResolutionName, resolutions
+from pixtolic.host.compiler import compile_program
+from pixtolic.host.emulator import PixelEmulator
+from pixtolic.output.timing import VgaTiming
+from pixtolic.processors.alu import (
+    PixelOperand,
+    PixelDestination,
+    PixelOpcode,
+    REGISTER_COUNT,
+    REGISTER_WIDTH,
+    pixel_instruction_layout,
+)
+from pixtolic.processors.ppu import PixelProcessor
+from pixtolic.sim.bench import Bench
+from pixtolic.util import fields_for
+
+
+class FixedProcessor(Elaboratable):
+
+    """A pixel program turned into logic instead of being run on
+    PixelALUs.
+
+    Each instruction of `program` becomes the one operation it names,
+    on the operands it names, with the registers as plain wires
+    between them, so there is no instruction memory, no operand muxes
+    and only the opcodes the program uses. The whole program runs for
+    every pixel as the scan reaches it, one pixel per clock, without
+    lanes or a FIFO; the program can't be changed without a rebuild.
+
+    Like the emulator, registers start at 0 for every pixel, so
+    programs should write a register before reading it. `pipeline`
+    splits the program into that many more stages to shorten the
+    critical path; the processor works far enough ahead of the scan
+    to make up for it, as long as that's less than the horizontal
+    blanking.
+
+    """
+
+    def __init__(self, timing, program, pixel_depth, pipeline=0):
+        self.timing = timing
+        self.program = program
+        self.pixel_depth = pixel_depth
+        self.pipeline = pipeline
+        # clocks from coordinates to pixel, including the output
+        # register
+        self.latency = pipeline + 1
+        if self.latency > timing.res.h.prescan:
+            raise ValueError(
+                f'{pipeline} pipeline stages are more than the horizontal '
+                f'blanking can hide'
+            )
+
+        self.red = Signal(pixel_depth)
+        self.green = Signal(pixel_depth)
+        self.blue = Signal(pixel_depth)
+        self.output = Signal(3 * pixel_depth)
+        # wraps to 0 at the top of the first frame
+        self.f_number = Signal(32, reset=2**32 - 1)
+
+    def elaborate(self, platform):
+        m = Module()
+        res = self.timing.res
+
+        # count frames at the top of the vertical sync, like the
+        # PixelProcessor does
+        with m.If((self.timing.line_counter == 0) & (self.timing.scan_counter == 0)):
+            m.d.pixel += self.f_number.eq(self.f_number + 1)
+
+        # the pixel `latency` clocks from now. only the visible ones
+        # matter, and they are always on the same line
+        x_pos = Signal(32)
+        y_pos = Signal(32)
+        m.d.comb += [
+            x_pos.eq(self.timing.scan_counter + self.latency - res.h.prescan),
+            y_pos.eq(self.timing.line_counter - res.v.prescan),
+        ]
+        values = {
+            PixelOperand.XPOS.value: x_pos,
+            PixelOperand.YPOS.value: y_pos,
+            PixelOperand.FRAME.value: self.f_number,
+        }
+        for i in range(REGISTER_COUNT):
+            values[PixelOperand.GP0.value + i] = C(0, REGISTER_WIDTH)
+        output = C(0, len(self.output))
+
+        stages = np.array_split(np.arange(len(self.program)), self.pipeline + 1)
+        for stage, indices in enumerate(stages):
+            if stage > 0:
+                # register everything that's still live
+                for sel, value in values.items():
+                    if isinstance(value, Const):
+                        continue
+                    registered = Signal(REGISTER_WIDTH, name=f'stage{stage}_op{sel}')
+                    m.d.pixel += registered.eq(value)
+                    values[sel] = registered
+                registered = Signal.like(self.output, name=f'stage{stage}_output')
+                m.d.pixel += registered.eq(output)
+                output = registered
+
+            for index in indices:
+                fields = fields_for(pixel_instruction_layout, self.program[index])
+                left = self.operand(values, fields, fields['left_op'])
+                right = self.operand(values, fields, fields['right_op'])
+                if fields['dest'] == PixelDestination.OUTPUT.value:
+                    target = None
+                    predicate = output != 0
+                else:
+                    target = PixelOperand.GP0.value + min(fields['dest'], REGISTER_COUNT - 1)
+                    predicate = values[target] != 0
+                result = Signal(REGISTER_WIDTH, name=f'i{index}_{self.mnemonic(fields["opcode"])}')
+                m.d.comb += result.eq(self.execute(fields['opcode'], left, right, predicate))
+                if target is None:
+                    output = result[:len(self.output)]
+                else:
+                    values[target] = result
+
+        m.d.pixel += self.output.eq(output)
+        with m.If(self.timing.active):
+            m.d.comb += [
+                self.red.eq(self.output[2 * self.pixel_depth:3 * self.pixel_depth]),
+                self.green.eq(self.output[self.pixel_depth:2 * self.pixel_depth]),
+                self.blue.eq(self.output[0:self.pixel_depth]),
+            ]
+
+        return m
+
+    @staticmethod
+    def mnemonic(opcode):
+        try:
+            return PixelOpcode(opcode).name.lower()
+        except ValueError:
+            return f'op{opcode}'
+
+    @staticmethod
+    def operand(values, fields, sel):
+        if sel == PixelOperand.IMM.value:
+            return C(fields['immediate'], REGISTER_WIDTH)
+        return values[sel]
+
+    @staticmethod
+    def execute(opcode, left, right, predicate):
+        # same as PixelALU.execute, for one opcode known up front
+        return {
+            PixelOpcode.NOT.value: lambda: ~left,
+            PixelOpcode.AND.value: lambda: left & right,
+            PixelOpcode.OR.value: lambda: left | right,
+            PixelOpcode.XOR.value: lambda: left ^ right,
+            PixelOpcode.ADD.value: lambda: left + right,
+            PixelOpcode.SUB.value: lambda: left - right,
+            PixelOpcode.EQ.value: lambda: left == right,
+            PixelOpcode.GT.value: lambda: left > right,
+            PixelOpcode.GTE.value: lambda: left >= right,
+            PixelOpcode.LT.value: lambda: left < right,
+            PixelOpcode.LTE.value: lambda: left <= right,
+            PixelOpcode.SHL.value: lambda: left << right[:5],
+            PixelOpcode.SHR.value: lambda: left >> right[:5],
+            PixelOpcode.MUL.value: lambda: left[:16] * right[:16],
+            PixelOpcode.SELECT.value: lambda: Mux(predicate, left, right),
+        }.get(opcode, lambda: C(0, REGISTER_WIDTH))()
+
+
+class TestBench(Elaboratable):
+    def __init__(self, processor, vga):
+        self.processor = processor
+        self.vga = vga
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [
+            self.processor,
+            self.vga,
+        ]
+        return m
+
+
+def bench(resolution, color_depth, program='d = x - y\nout = (d > 0) | (((x ^ y) & 8) == frame)'):
+    timing = VgaTiming(resolution)
+    processor = FixedProcessor(timing, compile_program(program), color_depth, pipeline=2)
+
+    def check(capture):
+        golden = PixelEmulator(resolution.width, resolution.height, color_depth)
+        for frame, captured in enumerate(capture.buffer):
+            golden.reset()
+            golden.run(processor.program, frame=frame)
+            mismatches = np.count_nonzero(captured != golden.output)
+            assert mismatches == 0, f'{mismatches} pixels of frame {frame} differ from the emulator'
+
+    return Bench(TestBench(processor, timing), timing=timing, source=processor, check=check)
+
+
+class Harness(Elaboratable):
+
+    """A processor and its timing, with the pixels folded into an LED
+    so none of it gets optimized away, for comparing builds."""
+
+    def __init__(self, make_processor, pixel_depth=4):
+        self.make_processor = make_processor
+        self.pixel_depth = pixel_depth
+
+    def elaborate(self, platform):
+        m = Module()
+
+        clk12 = platform.request('clk12')
+        m.domains.pixel = ClockDomain()
+        m.domains.sync = ClockDomain()
+        m.d.comb += [
+            ClockSignal('pixel').eq(clk12.i),
+            ClockSignal('sync').eq(clk12.i),
+        ]
+
+        m.submodules.timing = timing = VgaTiming(resolutions[ResolutionName.SVGA_800_600p_56hz])
+        m.submodules.processor = processor = self.make_processor(timing)
+        led = platform.request('led_r')
+        m.d.pixel += led.eq(Cat(processor.red, processor.green, processor.blue).xor())
+        return m
+
+
+def parse_log(name, log):
+    # (Fmax in MHz, {cell type: count}) from nextpnr's log. it reports
+    # the frequency after placement and again after routing; the last
+    # one counts
+    fmax = re.findall(r"Max frequency for clock '[^']+': ([\d.]+) MHz", log)
+    cells = dict(re.findall(r'(ICESTORM_\w+|SB_\w+):\s+(\d+)/', log))
+    if not fmax:
+        raise RuntimeError(f'no Fmax in the nextpnr log for {name}')
+    return float(fmax[-1]), {cell: int(count) for cell, count in cells.items()}
+
+
+def report(name, make_processor):
+    from nmigen_boards.icebreaker import ICEBreakerPlatform
+    products = ICEBreakerPlatform().build(
+        Harness(make_processor),
+        name=name,
+        build_dir='build/fixed',
+        synth_opts='-dsp',
+    )
+    return parse_log(name, products.get(f'{name}.tim', 't'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'report':
+        p = argparse.ArgumentParser(
+            prog='python -m pixtolic.processors.fixed report',
+            description='build a program both ways and compare resources and Fmax',
+        )
+        p.add_argument('program', nargs='?', default='out = (x - y) > 0')
+        p.add_argument('--lanes', type=int, default=2)
+        p.add_argument('--pipeline', type=int, default=0)
+        args = p.parse_args(sys.argv[2:])
+        words = compile_program(args.program)
+
+        results = {
+            f'interpreted ({args.lanes} lanes)': report('interpreted', lambda timing: PixelProcessor(
+                timing, num_pixels=args.lanes, pixel_depth=4, program=words, pipeline=args.pipeline,
+            )),
+            'fixed': report('fixed', lambda timing: FixedProcessor(
+                timing, words, pixel_depth=4, pipeline=args.pipeline,
+            )),
+        }
+        for name, (fmax, cells) in results.items():
+            print(
+                f'{name:24} {fmax:7.2f} MHz  {cells.get("ICESTORM_LC", 0):5} LCs  '
+                f'{cells.get("ICESTORM_RAM", 0):3} BRAMs  {cells.get("ICESTORM_DSP", 0):2} DSPs'
+            )
+    else:
+        from pixtolic.sim.cli import main
+        main(sys.argv[1:], bench='fixed')
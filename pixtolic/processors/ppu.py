@@ -1,137 +1,291 @@
+import sys
+
 from nmigen import *
-from nmigen.cli import main
-from nmigen.sim.pysim import Simulator
+from nmigen.lib.fifo import AsyncFIFO, SyncFIFOBuffered
+import numpy as np
 
 from pixtolic.config.resolutions import resolutions, ResolutionName
-from pixtolic.processor.alu import (
+from pixtolic.host.emulator import PixelEmulator
+from pixtolic.host.compiler import compile_program
+from pixtolic.processors.alu import (
     PixelALU,
-    PixelOperand,
-    PixelDestination,
-    PixelOpcode,
     pixel_instruction_layout,
     REGISTER_WIDTH,
 )
 from pixtolic.output.timing import VgaTiming
-from pixtolic.util import int_for
+from pixtolic.sim.bench import Bench
+from pixtolic.util import layout_width
 
 
 class PixelProcessor(Elaboratable):
 
-    def __init__(self, timing, num_pixels, pixel_width, pixel_depth):
+    """Run a pixel program on `num_pixels` ALUs side by side.
+
+    Each lane computes one pixel of a batch of `num_pixels` neighbours
+    on a line, and all lanes run the same instruction each clock, so a
+    batch takes `num_pixels` clocks and the program can be up to
+    `num_pixels` instructions long while still producing one pixel per
+    clock.
+
+    The processor runs ahead of the scan: finished batches go into a
+    FIFO (one line deep by default) and are shifted out a pixel at a
+    time on `red`/`green`/`blue` while the timing is in the visible
+    area. Everything is restarted at the top of each frame, and the
+    vertical blanking is long enough to fill the FIFO again, so the
+    timing should start at the top of a frame (not `VgaTiming.warm`),
+    or the first frame is garbage.
+
+    With `loadable`, the program can be rewritten while running through
+    `load_addr`/`load_data`/`load_valid` in the `sync` domain (see
+    `pixtolic.ui.loader`). The writes cross into the `pixel` domain
+    through a small FIFO, and `load_last` marks the last instruction of
+    a program. There are two program banks: uploads go into the one
+    that isn't running, and once a whole program is in, the banks swap
+    at the next `restart`, so no frame is computed with part of one
+    program and part of another, and nothing has to stop while a
+    program is coming in.
+
+    """
+
+    def __init__(self, timing, num_pixels, pixel_depth, program=None,
+                 fifo_depth=None, pipeline=0, loadable=False):
         self.timing = timing
+        # pipeline depth of the ALUs, see PixelALU
+        self.pipeline = pipeline
         self.num_pixels = num_pixels
-        self.pixel_width = pixel_width
-        self.output_width = self.num_pixels * self.pixel_width
         self.pixel_depth = pixel_depth
+        self.pixel_width = 3 * pixel_depth
+        self.output_width = self.num_pixels * self.pixel_width
+        if timing.res.width % num_pixels:
+            raise ValueError(f'{num_pixels} lanes do not divide a {timing.res.width} pixel line')
 
-        # inputs
-        self.new_frame = Signal()
-        self.active = Signal()
-        self.start_next_batch = Signal()
+        self.program = default_program() if program is None else program
+        if len(self.program) > num_pixels:
+            raise ValueError(
+                f'{len(self.program)} instructions do not fit in a batch '
+                f'of {num_pixels} pixels'
+            )
+        self.instruction_width = layout_width(pixel_instruction_layout)
+        self.max_instructions = self.instruction_depth = num_pixels
+        self.fifo_depth = fifo_depth or timing.res.width // num_pixels
+        if self.fifo_depth < 3:
+            # any less and the FIFO's own latency starves the output
+            raise ValueError('the FIFO has to be at least 3 batches deep')
 
         # outputs
+        self.red = Signal(pixel_depth)
+        self.green = Signal(pixel_depth)
+        self.blue = Signal(pixel_depth)
         self.result = Signal(self.output_width)
         self.result_ready = Signal()
 
-        self.instruction_width = 46
-        self.max_instructions = self.instruction_depth = 2
+        # program uploads, in the sync domain
+        self.loadable = loadable
+        self.load_addr = Signal(range(self.instruction_depth))
+        self.load_data = Signal(self.instruction_width)
+        self.load_last = Signal()
+        self.load_valid = Signal()
+        self.load_ready = Signal()
+        self.bank = Signal()
+        # the inactive bank holds a whole program, ready to swap in
+        self.pending = Signal()
+
+        self.program_length = Signal(range(self.instruction_depth + 1), reset=len(self.program))
+        self.pending_length = Signal.like(self.program_length)
         self.pc = Signal(range(self.instruction_depth))
         self.instruction = Signal(self.instruction_width)
+        self.x_coord = Signal(range(timing.res.width))
         self.y_coord = Signal(32)
-        self.f_number = Signal(32)
-        self.x_coord = [Signal(32) for _ in range(self.num_pixels)]
-        self.end_of_line = Signal()
-        
+        # wraps to 0 at the top of the first frame
+        self.f_number = Signal(32, reset=2**32 - 1)
+        self.restart = Signal()
+        self.done = Signal()
+
     def elaborate(self, platform):
         m = Module()
+        res = self.timing.res
 
-        for lane in range(self.num_pixels):
-            with m.If(self.timing.active):
-                with m.If(self.new_frame | (self.end_of_line & self.start_next_batch)):
-                    m.d.pixel += self.x_coord[lane].eq(lane)
-                with m.Elif(self.start_next_batch):
-                    m.d.pixel += self.x_coord[lane].eq(self.x_coord[lane] + self.num_pixels)
+        # the top of the vertical sync, where the next frame's pixels
+        # start being computed
+        m.d.comb += self.restart.eq(
+            (self.timing.line_counter == 0) & (self.timing.scan_counter == 0)
+        )
+
+        fifo = SyncFIFOBuffered(width=self.output_width, depth=self.fifo_depth)
+        m.submodules.fifo = ResetInserter({'pixel': self.restart})(
+            DomainRenamer('pixel')(fifo)
+        )
+
+        # batches. everything moves on unless a finished batch is
+        # waiting for room in the FIFO, and once the frame is done only
+        # disabled instructions go in, to flush out the last batch
+        advance = Signal()
+        fetch = Signal()
+        m.d.comb += [
+            advance.eq(~self.result_ready | fifo.w_rdy),
+            fetch.eq(advance & ~self.done),
+            fifo.w_en.eq(self.result_ready),
+            fifo.w_data.eq(self.result),
+        ]
 
-            alu = PixelALU(self.pixel_depth)
+        alus = []
+        for lane in range(self.num_pixels):
+            alu = PixelALU(self.pixel_depth, pipeline=self.pipeline)
             m.d.comb += [
                 alu.instruction.eq(self.instruction),
-                alu.x_pos.eq(self.x_coord[lane]),
+                alu.stall.eq(~advance),
+                alu.enable.eq(~self.done & (self.pc < self.program_length)),
+                alu.x_pos.eq(self.x_coord + lane),
                 alu.y_pos.eq(self.y_coord),
                 alu.frame.eq(self.f_number),
             ]
-            m.submodules += alu
-
-        max_instructions = self.num_pixels * 2
-        instruction = Record(pixel_instruction_layout)
-        instruction_mem = Memory(
-            width=self.instruction_width,
-            depth=self.instruction_depth,
-            init=[
-                int_for(
-                    instruction.layout,
-                    left_op=PixelOperand.XPOS.value,
-                    right_op=PixelOperand.YPOS.value,
-                    dest=PixelDestination.GP0.value,
-                    opcode=PixelOpcode.SUB.value,
-                    immediate=0,
-                ),
-                int_for(
-                    instruction.layout,
-                    left_op=PixelOperand.GP0.value,
-                    right_op=PixelOperand.IMM.value,
-                    dest=PixelDestination.OUTPUT.value,
-                    opcode=PixelOpcode.GT.value,
-                    immediate=0,
-                ),
-            ]
-        )
+            m.submodules[f'alu{lane}'] = alu
+            alus.append(alu)
+        m.d.comb += self.result.eq(Cat(alu.output for alu in alus))
+
+        # address the memory with the next pc, so that the instruction
+        # comes out of the read port together with pc
+        next_pc = Signal.like(self.pc)
+        m.d.pixel += self.pc.eq(next_pc)
+        if self.loadable:
+            # the bank is the top address bit
+            instruction_mem = Memory(
+                width=self.instruction_width,
+                depth=2 << len(self.pc),
+                init=self.program,
+            )
+            next_bank = self.load(m, instruction_mem)
+            read_addr = Cat(next_pc, next_bank)
+        else:
+            instruction_mem = Memory(
+                width=self.instruction_width,
+                depth=self.instruction_depth,
+                init=self.program,
+            )
+            read_addr = next_pc
         rd_port = instruction_mem.read_port(domain='pixel')
         m.submodules += rd_port
         m.d.comb += [
-            rd_port.addr.eq(self.pc),
+            rd_port.addr.eq(read_addr),
             self.instruction.eq(rd_port.data),
         ]
 
+        # follows the last instruction of each batch through the ALU
+        # pipeline, so the batch is pushed once it has been written
+        last_instruction = self.pc == self.instruction_depth - 1
+        batch_end = Signal(self.pipeline)
+        batch_ends = Cat(last_instruction & ~self.done, batch_end)
+        with m.If(self.restart):
+            m.d.comb += next_pc.eq(0)
+            m.d.pixel += [
+                self.x_coord.eq(0),
+                self.y_coord.eq(0),
+                self.f_number.eq(self.f_number + 1),
+                self.result_ready.eq(0),
+                batch_end.eq(0),
+                self.done.eq(0),
+            ]
+        with m.Else():
+            with m.If(advance):
+                m.d.pixel += [
+                    batch_end.eq(batch_ends[:self.pipeline]),
+                    self.result_ready.eq(batch_ends[self.pipeline]),
+                ]
+            with m.If(fetch & last_instruction):
+                m.d.comb += next_pc.eq(0)
+                with m.If(self.x_coord == res.width - self.num_pixels):
+                    m.d.pixel += [
+                        self.x_coord.eq(0),
+                        self.y_coord.eq(self.y_coord + 1),
+                    ]
+                    with m.If(self.y_coord == res.height - 1):
+                        m.d.pixel += self.done.eq(1)
+                with m.Else():
+                    m.d.pixel += self.x_coord.eq(self.x_coord + self.num_pixels)
+            with m.Elif(fetch):
+                m.d.comb += next_pc.eq(self.pc + 1)
+            with m.Else():
+                m.d.comb += next_pc.eq(self.pc)
+
+        # pixels
+        batch = Signal(self.output_width)
+        left_in_batch = Signal(range(self.num_pixels))
+        pixel = Signal(self.pixel_width)
+        with m.If(self.restart):
+            m.d.pixel += left_in_batch.eq(0)
+        with m.Elif(self.timing.active):
+            with m.If(left_in_batch == 0):
+                m.d.comb += fifo.r_en.eq(1)
+                with m.If(fifo.r_rdy):
+                    m.d.comb += pixel.eq(fifo.r_data)
+                    m.d.pixel += [
+                        batch.eq(fifo.r_data >> self.pixel_width),
+                        left_in_batch.eq(self.num_pixels - 1),
+                    ]
+            with m.Else():
+                m.d.comb += pixel.eq(batch)
+                m.d.pixel += [
+                    batch.eq(batch >> self.pixel_width),
+                    left_in_batch.eq(left_in_batch - 1),
+                ]
+
         m.d.comb += [
-            self.result_ready.eq(self.pc == self.max_instructions-1),
-            self.end_of_line.eq(self.x_coord[0] == 640 - self.num_pixels),
+            self.red.eq(pixel[2 * self.pixel_depth:3 * self.pixel_depth]),
+            self.green.eq(pixel[self.pixel_depth:2 * self.pixel_depth]),
+            self.blue.eq(pixel[0:self.pixel_depth]),
         ]
 
-        with m.If(
-            (self.timing.line_counter >= self.timing.res.v.prescan)
-            & (self.timing.scan_counter >= self.timing.res.h.prescan-1)
-        ):
-            with m.If(self.start_next_batch):
-                m.d.pixel += self.pc.eq(0)
-            with m.Elif(~self.result_ready):
-                m.d.pixel += self.pc.eq(self.pc + 1)
-
-        with m.If(self.new_frame):
-            self.f_number.eq(self.f_number + 1)
-        with m.Elif(self.active):
-            with m.If(self.end_of_line & self.start_next_batch):
-                self.y_coord.eq(self.y_coord + 1)
-
         return m
 
-def ppu_tb(dut):
-    # yield
-    # yield dut.ppu.new_frame.eq(1)
-    # yield
-    # yield dut.ppu.new_frame.eq(0)
-    # for _ in range(20):
-    #     yield
-    # yield ppu.new_frame.eq(1)
-    # # yield ppu.new_batch.eq(1)
-    # yield
-    # # yield ppu.new_frame.eq(0)
-    # # yield ppu.new_batch.eq(0)
-    # yield
-    # yield
-    # yield ppu.new_frame.eq(0)
-    # yield
-    for _ in range(800 * 40):
-        yield
+    def load(self, m, instruction_mem):
+        load_fifo = AsyncFIFO(
+            width=len(self.load_addr) + self.instruction_width + 1,
+            depth=4,
+            r_domain='pixel',
+            w_domain='sync',
+        )
+        m.submodules.load_fifo = load_fifo
+        m.d.comb += [
+            load_fifo.w_data.eq(Cat(self.load_addr, self.load_data, self.load_last)),
+            load_fifo.w_en.eq(self.load_valid),
+            self.load_ready.eq(load_fifo.w_rdy),
+        ]
+
+        addr = load_fifo.r_data[:len(self.load_addr)]
+        data = load_fifo.r_data[len(self.load_addr):-1]
+        last = load_fifo.r_data[-1]
+        wr_port = instruction_mem.write_port(domain='pixel')
+        m.submodules += wr_port
+
+        # writes go to the bank that isn't running, and wait while the
+        # banks swap
+        write = Signal()
+        m.d.comb += [
+            load_fifo.r_en.eq(~self.restart),
+            write.eq(load_fifo.r_rdy & ~self.restart),
+            wr_port.addr.eq(Cat(addr, ~self.bank)),
+            wr_port.data.eq(data),
+            wr_port.en.eq(write),
+        ]
+        with m.If(write):
+            m.d.pixel += [
+                self.pending.eq(last),
+                self.pending_length.eq(addr + 1),
+            ]
+
+        swap = self.restart & self.pending
+        next_bank = Signal()
+        m.d.comb += next_bank.eq(self.bank ^ swap)
+        m.d.pixel += self.bank.eq(next_bank)
+        with m.If(swap):
+            m.d.pixel += [
+                self.pending.eq(0),
+                self.program_length.eq(self.pending_length),
+            ]
+        return next_bank
+
+def default_program():
+    return compile_program('out = (x - y) > 0')
 
 class TestBench(Elaboratable):
     def __init__(self, ppu, vga):
@@ -145,59 +299,27 @@ class TestBench(Elaboratable):
             self.ppu,
             self.vga,
         ]
-        m.d.comb += [
-            self.ppu.start_next_batch.eq(self.vga.new_frame | (self.ppu.result_ready & self.vga.active)),
-            self.ppu.new_frame.eq(self.vga.new_frame),
-            self.ppu.active.eq(self.vga.active | self.vga.new_line),
-        ]
         return m
 
-if __name__ == '__main__':
-    res = resolutions[ResolutionName.VGA_640_480p_60hz]
-    # instruction = Record(pixel_instruction_layout)
-    # program_mem = Memory(
-    #     width=len(instruction),
-    #     depth=2,
-    #     init=[
-    #         int_for(
-    #             instruction.layout,
-    #             left_op=PixelOperand.XPOS.value,
-    #             right_op=PixelOperand.YPOS.value,
-    #             dest=PixelDestination.GP0.value,
-    #             opcode=PixelOpcode.SUB.value,
-    #             immediate=0,
-    #         ),
-    #         int_for(
-    #             instruction.layout,
-    #             left_op=PixelOperand.GP0.value,
-    #             right_op=PixelOperand.IMM.value,
-    #             dest=PixelDestination.OUTPUT.value,
-    #             opcode=PixelOpcode.GT.value,
-    #             immediate=0,
-    #         ),
-    #     ],
-    # )
-    timing = VgaTiming(res)
-    dut = TestBench(
-        PixelProcessor(
-            timing,
-            num_pixels=8,
-            pixel_width=12,
-            pixel_depth=4,
-            # resolution=res,
-            # pixel_depth=4,
-            # stride=4,
-            # instruction_depth=program_mem.depth,
-            # program_mem=program_mem,
-        ),
+def bench(resolution, color_depth, num_pixels=8):
+    # no fast forward: the processor fills its FIFO during blanking
+    timing = VgaTiming(resolution)
+    ppu = PixelProcessor(
         timing,
-        # PixelFifo(width=16, depth=16),
+        num_pixels=num_pixels,
+        pixel_depth=color_depth,
     )
 
-    sim = Simulator(dut)
-    def proc():
-        yield from ppu_tb(dut)
-    sim.add_clock(1e-6, domain='pixel')
-    sim.add_sync_process(proc, domain='pixel')
-    with sim.write_vcd('ppu.vcd'):
-        sim.run()
+    def check(capture):
+        golden = PixelEmulator(resolution.width, resolution.height, color_depth)
+        for frame, captured in enumerate(capture.buffer):
+            golden.reset()
+            golden.run(ppu.program, frame=frame)
+            mismatches = np.count_nonzero(captured != golden.output)
+            assert mismatches == 0, f'{mismatches} pixels of frame {frame} differ from the emulator'
+
+    return Bench(TestBench(ppu, timing), timing=timing, source=ppu, check=check)
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='ppu')
@@ -0,0 +1,99 @@
+from nmigen.sim import Simulator, Delay
+
+from pixtolic.sim.capture import FrameCapture
+
+
+BACKENDS = ('pysim', 'cxxsim')
+
+
+def simulator(dut, backend='pysim'):
+    # cxxsim compiles the design to C++ through yosys' cxxrtl backend
+    # and is much faster for long runs, but needs a recent yosys and
+    # an nmigen that ships the engine
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown simulation backend {backend!r}, expected one of {BACKENDS}')
+    try:
+        return Simulator(dut, engine=backend)
+    except (ImportError, TypeError) as e:
+        raise RuntimeError(
+            f'the {backend} backend is not available with this nmigen: {e}'
+        ) from e
+
+
+class Bench:
+
+    """Everything needed to simulate one design: the top-level
+    elaboratable, the clock domains it needs, any testbench processes
+    (generator functions) and, for video sources, the timing and
+    source to capture frames from. `check`, if given, is called with
+    the frame capture after a run and asserts that it looks right, and
+    `frames` is how many frames to capture unless told otherwise, so
+    that it gets to see everything it checks."""
+
+    def __init__(self, dut, timing=None, source=None, processes=(),
+                 domains=('pixel',), period=1e-6, check=None, frames=1):
+        self.dut = dut
+        self.timing = timing
+        self.source = source
+        self.processes = list(processes)
+        self.domains = domains
+        self.period = period
+        self.check = check
+        self.frames = frames
+
+    def lookup(self, name):
+        """Find a signal by a dotted path starting from 'dut',
+        'timing' or 'source' (or the source's class name, e.g.
+        'still.addr'), for picking signals to trace from the command
+        line."""
+        roots = {'dut': self.dut, 'timing': self.timing, 'source': self.source}
+        if self.source is not None:
+            roots[type(self.source).__name__.lower()] = self.source
+        root, *path = name.split('.')
+        obj = roots.get(root)
+        if obj is None:
+            raise ValueError(f'no {root!r} in this bench to look up {name!r} in')
+        for attr in path:
+            try:
+                obj = getattr(obj, attr)
+            except AttributeError:
+                raise ValueError(f'{name!r}: {type(obj).__name__} has no {attr!r}') from None
+        return obj
+
+    def run(self, backend='pysim', frames=None, cycles=None, vcd_file=None,
+            traces=()):
+        if frames is None:
+            frames = self.frames
+        sim = simulator(self.dut, backend)
+        for domain in self.domains:
+            sim.add_clock(self.period, domain=domain)
+        for process in self.processes:
+            sim.add_sync_process(process, domain=self.domains[0])
+
+        capture = None
+        if self.source is not None and frames:
+            capture = FrameCapture(
+                self.timing,
+                self.source,
+                frames=frames,
+                period=self.period,
+            )
+            sim.add_sync_process(capture.process, domain='pixel')
+        if cycles is not None:
+            def run_cycles():
+                yield Delay((cycles - 0.5) * self.period)
+                yield
+            sim.add_sync_process(run_cycles, domain=self.domains[0])
+        for trace in traces:
+            sim.add_sync_process(trace.process, domain=self.domains[0])
+
+        try:
+            if vcd_file is None:
+                sim.run()
+            else:
+                with sim.write_vcd(vcd_file):
+                    sim.run()
+        finally:
+            for trace in traces:
+                trace.close()
+        return capture
@@ -0,0 +1,231 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import platform as host_platform
+import resource
+import subprocess
+import sys
+from time import perf_counter
+
+from nmigen import *
+from nmigen.hdl.ir import Fragment
+from nmigen.sim import Passive
+
+from pixtolic.config.resolutions import resolutions, ResolutionName
+from pixtolic.host.testvec import gradient
+from pixtolic.output.timing import VgaTiming
+from pixtolic.processors.alu import PixelALU
+from pixtolic.sim import uart as sim_uart
+from pixtolic.sim.bench import BACKENDS, simulator
+from pixtolic.sources.patterns import TestPattern
+from pixtolic.sources.still import Still
+from pixtolic.ui.uart import UARTLoopback
+
+
+COLOR_DEPTH = 4
+PPU_LANES = (1, 2, 4, 8)
+
+
+class Harness(Elaboratable):
+    def __init__(self, *submodules):
+        self.submodules = submodules
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += self.submodules
+        return m
+
+
+class UARTHarness(Elaboratable):
+    # a UART echoing back bytes that `host` sends it one after another,
+    # so both the receiver and the transmitter are busy the whole run
+    def __init__(self):
+        self.serial = Record([('rx', 1), ('tx', 1)], fields={'rx': Signal(reset=1), 'tx': Signal(reset=1)})
+        self.uart = UARTLoopback(self.serial, clk_freq=12e6, baud_rate=115200)
+
+    def host(self):
+        yield Passive()
+        byte = 0
+        while True:
+            yield from sim_uart.send(self.serial, bytes([byte]), self.uart.divisor)
+            byte = (byte + 1) & 0xFF
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.uart = self.uart
+        return m
+
+
+def build(module, resolution_name=None, lanes=None):
+    # returns (design, clock domains to drive, testbench processes for
+    # the first of them)
+    if module == 'PixelALU':
+        return PixelALU(pixel_depth=COLOR_DEPTH), ('pixel',), ()
+    if module == 'UART':
+        harness = UARTHarness()
+        return harness, ('sync',), (harness.host,)
+
+    timing = VgaTiming(resolutions[ResolutionName[resolution_name]])
+    if module == 'VgaTiming':
+        return timing, ('pixel',), ()
+    if module == 'TestPattern':
+        return Harness(timing, TestPattern(timing, COLOR_DEPTH)), ('pixel',), ()
+    if module == 'Still':
+        still = Still(timing, COLOR_DEPTH, gradient(COLOR_DEPTH))
+        return Harness(timing, still), ('pixel',), ()
+    if module == 'PixelProcessor':
+        from pixtolic.host.compiler import compile_program
+        from pixtolic.processors.ppu import PixelProcessor, TestBench, default_program
+        program = default_program()
+        if len(program) > lanes:
+            # a batch of `lanes` pixels only has time for that many
+            # instructions
+            program = compile_program('out = x ^ y')
+        ppu = PixelProcessor(
+            timing,
+            num_pixels=lanes,
+            pixel_depth=COLOR_DEPTH,
+            program=program,
+        )
+        return TestBench(ppu, timing), ('pixel',), ()
+    raise ValueError(f'unknown module {module!r}')
+
+
+def benchmarks():
+    # (name, module, resolution, lanes)
+    yield 'PixelALU', 'PixelALU', None, None
+    yield 'UART', 'UART', None, None
+    for name in ResolutionName:
+        for module in ('VgaTiming', 'TestPattern', 'Still'):
+            yield f'{module}/{name.name}', module, name.name, None
+        for lanes in PPU_LANES:
+            yield f'PixelProcessor[{lanes}]/{name.name}', 'PixelProcessor', name.name, lanes
+
+
+def measure(job):
+    name, module, resolution_name, lanes, cycles, backend = job
+    period = 1e-6
+
+    start = perf_counter()
+    dut, domains, processes = build(module, resolution_name, lanes)
+    Fragment.get(dut, platform=None).prepare()
+    elaborated = perf_counter()
+    # the simulator elaborates again on its own, so this includes
+    # elaboration as well as compiling the design for the backend
+    sim = simulator(dut, backend)
+    for domain in domains:
+        sim.add_clock(period, domain=domain)
+    for process in processes:
+        sim.add_sync_process(process, domain=domains[0])
+    compiled = perf_counter()
+    sim.run_until(cycles * period, run_passive=True)
+    finished = perf_counter()
+
+    return {
+        'name': name,
+        'module': module,
+        'resolution': resolution_name,
+        'lanes': lanes,
+        'backend': backend,
+        'cycles': cycles,
+        'elaborate_s': elaborated - start,
+        'compile_s': compiled - elaborated,
+        'run_s': finished - compiled,
+        'cycles_per_s': cycles / (finished - compiled),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def smoke(jobs):
+    # build and elaborate every benchmark without simulating it, so a
+    # change that breaks one shows up without a full run
+    for name, module, resolution_name, lanes, *_ in jobs:
+        dut, *_ = build(module, resolution_name, lanes)
+        Fragment.get(dut, platform=None).prepare()
+        print(f'{name:48} builds', file=sys.stderr)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # print the speed of each benchmark relative to a previous run and
+    # return the names of the ones that got slower than `threshold`
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        ratio = result['cycles_per_s'] / old['cycles_per_s']
+        flag = ''
+        if ratio < 1 - threshold:
+            regressions.append(result['name'])
+            flag = '  <-- slower'
+        print(f'{result["name"]:48} {old["cycles_per_s"]:10.0f} -> {result["cycles_per_s"]:10.0f} cycles/s ({ratio:5.2f}x){flag}', file=sys.stderr)
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.sim.benchmark',
+        description='measure simulation throughput of the pixtolic modules',
+    )
+    p.add_argument('--cycles', type=int, default=20000)
+    p.add_argument('--backend', choices=BACKENDS, default='pysim')
+    p.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    p.add_argument('--output', '-o', help='write results as JSON here (default: stdout)')
+    p.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    p.add_argument('--threshold', type=float, default=0.2,
+                   help='relative slowdown counted as a regression when comparing')
+    p.add_argument('--smoke', action='store_true',
+                   help='only check that every benchmark builds, without running any')
+    args = p.parse_args()
+
+    jobs = [
+        (name, module, resolution_name, lanes, args.cycles, args.backend)
+        for name, module, resolution_name, lanes in benchmarks()
+        if args.filter in name
+    ]
+    if args.smoke:
+        smoke(jobs)
+        return
+    # one fresh process per benchmark, so that peak memory is per
+    # benchmark and one design's garbage doesn't slow down the next
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(measure, jobs):
+            print(f'{result["name"]:48} {result["cycles_per_s"]:10.0f} cycles/s', file=sys.stderr)
+            results.append(result)
+
+    report = {
+        'revision': git_revision(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': host_platform.python_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(f'{len(regressions)} benchmark(s) slower than before')
+
+
+if __name__ == '__main__':
+    main()
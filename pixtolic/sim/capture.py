@@ -0,0 +1,86 @@
+from os import path
+
+from nmigen import *
+import numpy as np
+
+from pixtolic.host.image import split_rgb, to_image
+from pixtolic.sim.fastforward import skip_blanking, sleep
+
+
+class FrameCapture:
+
+    """Grab whole frames out of a simulation as images.
+
+    Attach this to anything with `red`/`green`/`blue` outputs that is
+    driven by a `VgaTiming`. The capture process works out where the
+    scan is from the timing counters and sleeps through the blanking
+    intervals (or skips them entirely if the timing was built with
+    `fast_forward`), only waking up on visible pixels, which it writes
+    straight into a preallocated NumPy buffer. No waveform is needed
+    to look at a frame.
+
+    """
+
+    def __init__(self, timing, source, frames=1, period=1e-6):
+        self.timing = timing
+        self.source = source
+        self.frames = frames
+        self.period = period
+        self.color_depth = len(source.red)
+        self.pixel = Cat(source.blue, source.green, source.red)
+        self.buffer = np.zeros(
+            (frames, timing.res.height, timing.res.width),
+            dtype='uint32',
+        )
+
+    def process(self):
+        res = self.timing.res
+        line_length = res.width + res.h.overscan
+        frame_length = line_length * (res.height + res.v.overscan)
+        first_pixel = res.v.prescan * line_length + res.h.prescan
+
+        line = yield self.timing.line_counter
+        scan = yield self.timing.scan_counter
+        position = line * line_length + scan
+
+        on_pixel = False
+        for frame in self.buffer:
+            if not self.timing.fast_forward:
+                yield from self.skip((first_pixel - position) % frame_length)
+            for y, row in enumerate(frame):
+                if self.timing.fast_forward:
+                    # don't simulate the blanking at all
+                    if on_pixel:
+                        yield
+                    yield from skip_blanking(self.timing)
+                    yield
+                elif y > 0:
+                    yield from self.skip(line_length - res.width + 1)
+                for x in range(res.width):
+                    if x > 0:
+                        yield
+                    row[x] = yield self.pixel
+                on_pixel = True
+            position = (first_pixel + (res.height - 1) * line_length + res.width - 1) % frame_length
+
+    def skip(self, cycles):
+        yield from sleep(cycles, self.period)
+
+    def rgb(self):
+        return split_rgb(self.buffer, self.color_depth)
+
+    def images(self):
+        return [to_image(frame, self.color_depth) for frame in self.rgb()]
+
+    def save(self, fname):
+        # with several frames, number them: still.png -> still_0.png ...
+        images = self.images()
+        if len(images) == 1:
+            images[0].save(fname)
+            return [fname]
+        root, ext = path.splitext(fname)
+        fnames = [f'{root}_{n}{ext}' for n in range(len(images))]
+        for image, name in zip(images, fnames):
+            image.save(name)
+        return fnames
+
@@ -0,0 +1,141 @@
+import argparse
+from importlib import import_module
+
+import numpy as np
+
+from pixtolic.config.resolutions import resolutions, ResolutionName
+from pixtolic.sim.bench import BACKENDS
+from pixtolic.sim.trace import Trace
+
+
+# each module provides bench(resolution, color_depth) -> Bench, or
+# another function of the same arguments named after a ':'
+BENCHES = {
+    'still': 'pixtolic.sources.still',
+    'indexed': 'pixtolic.sources.indexed',
+    'indexed64': 'pixtolic.sources.indexed:bench64',
+    'scaler': 'pixtolic.sources.scaler',
+    'tiles': 'pixtolic.sources.tiles',
+    'framebuffer': 'pixtolic.sources.framebuffer',
+    'flash': 'pixtolic.sources.flash',
+    'ppu': 'pixtolic.processors.ppu',
+    'fixed': 'pixtolic.processors.fixed',
+    'alu_tb': 'pixtolic.processors.alu_tb',
+    'timing_tb': 'pixtolic.output.timing_tb',
+    'loader': 'pixtolic.ui.loader',
+    'packet': 'pixtolic.ui.packet',
+    'image_loader': 'pixtolic.ui.image_loader',
+    'sprite_loader': 'pixtolic.ui.sprite_loader',
+}
+
+
+def get_bench(name, resolution, color_depth):
+    module, _, function = BENCHES[name].partition(':')
+    return getattr(import_module(module), function or 'bench')(resolution, color_depth)
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.sim',
+        description='simulate a pixtolic testbench',
+    )
+    p.add_argument('bench', choices=sorted(BENCHES))
+    p.add_argument('--backend', choices=BACKENDS, default='pysim')
+    p.add_argument(
+        '--resolution',
+        choices=[name.name for name in ResolutionName],
+        default=ResolutionName.VGA_640_480p_60hz.name,
+    )
+    p.add_argument('--color-depth', type=int, default=4)
+    p.add_argument('--frames', type=int,
+                   help='frames to capture, for benches with a video source '
+                        '(default: as many as the bench checks)')
+    p.add_argument('--cycles', type=int,
+                   help='run for at least this many pixel clocks')
+    p.add_argument('--png', help='where to save captured frames (default: <bench>.png)')
+    p.add_argument('--vcd', help='also write a waveform to this file')
+    trace = p.add_argument_group(
+        'tracing',
+        'record only some signals over part of the run instead of '
+        'everything, to the --vcd file (default: <bench>.vcd)',
+    )
+    trace.add_argument('--trace', action='append', metavar='SIGNAL',
+                       help="signal to record, e.g. timing.hsync or still.addr (repeatable)")
+    trace.add_argument('--trace-start', type=int, default=0, metavar='CYCLE',
+                       help='start recording this many clocks in')
+    trace.add_argument('--trace-cycles', type=int, metavar='N',
+                       help='stop recording after this many clocks')
+    trace.add_argument('--trace-lines', metavar='FIRST[:COUNT]',
+                       help='record these visible lines instead of a clock range')
+    trace.add_argument('--trigger', metavar='SIGNAL',
+                       help='start recording once this signal is high, e.g. timing.new_frame')
+    p.add_argument('--cross-check', action='store_true',
+                   help='run on both backends and compare the captured frames')
+    return p
+
+
+def traces(args, bench, vcd_file):
+    if not args.trace:
+        return []
+    try:
+        signals = {name: bench.lookup(name) for name in args.trace}
+        trigger = None if args.trigger is None else bench.lookup(args.trigger)
+    except ValueError as e:
+        raise SystemExit(e)
+    if args.trace_lines is not None:
+        if trigger is not None:
+            raise SystemExit('--trace-lines already picks where to start, so it can\'t have a --trigger')
+        first, _, count = args.trace_lines.partition(':')
+        try:
+            return [Trace.lines(vcd_file, signals, bench.timing, int(first), int(count or 1),
+                                period=bench.period)]
+        except ValueError as e:
+            raise SystemExit(e)
+    return [Trace(vcd_file, signals, start=args.trace_start, cycles=args.trace_cycles,
+                  trigger=trigger, period=bench.period)]
+
+
+def run(args):
+    res = resolutions[ResolutionName[args.resolution]]
+    backends = BACKENDS if args.cross_check else [args.backend]
+
+    captures = {}
+    for backend in backends:
+        bench = get_bench(args.bench, res, args.color_depth)
+        vcd_file = args.vcd
+        if args.trace and vcd_file is None:
+            vcd_file = f'{args.bench}.vcd'
+        if vcd_file is not None and len(backends) > 1:
+            vcd_file = vcd_file.replace('.vcd', f'-{backend}.vcd')
+        bench_traces = traces(args, bench, vcd_file)
+        captures[backend] = capture = bench.run(
+            backend=backend,
+            frames=args.frames,
+            cycles=args.cycles,
+            vcd_file=None if bench_traces else vcd_file,
+            traces=bench_traces,
+        )
+        if capture is not None:
+            png = args.png or f'{args.bench}.png'
+            if len(backends) > 1:
+                png = png.replace('.png', f'-{backend}.png')
+            for fname in capture.save(png):
+                print('wrote', fname)
+            if bench.check is not None:
+                bench.check(capture)
+                print('check passed')
+
+    if args.cross_check and captures[backends[0]] is not None:
+        buffers = [captures[backend].buffer for backend in backends]
+        mismatches = np.count_nonzero(buffers[0] != buffers[1])
+        if mismatches:
+            raise SystemExit(f'{mismatches} pixels differ between {" and ".join(backends)}')
+        print('captured frames match')
+
+
+def main(argv=None, bench=None):
+    # testbench modules pass their own name as `bench` so that their
+    # __main__ blocks take the same options
+    if bench is not None:
+        argv = [bench] + list(argv or [])
+    run(parser().parse_args(argv))
@@ -0,0 +1,90 @@
+# testbench helpers that move a running VgaTiming around. the timing
+# has to be built with fast_forward=True, which gives it a `jump`
+# input that loads the counters on the next clock.
+#
+# a source that only reacts to the counters and the new_line /
+# new_frame strobes in the visible area (Still, IndexedStill, Scaler)
+# can't tell the blanking was skipped, as long as a jump never passes
+# over a strobe (skip_blanking stops at each one). sources that work
+# during the blanking can: FlashStream reads the flash from the top of
+# the vertical blanking, TileEngine copies its sprite table at line 0
+# and fetches sprite rows in the horizontal blanking, PixelProcessor
+# fills its line FIFO in the vertical blanking and FixedProcessor
+# counts frames at line 0 and works ahead of the scan into the
+# horizontal blanking. their benches run a cold VgaTiming instead.
+
+from nmigen.sim import Delay
+
+
+def sleep(cycles, period):
+    # wake up again `cycles` clocks from now. rather than resuming the
+    # process on every edge in between, sleep until half a period
+    # before the target edge and then wait for it. this works on any
+    # design, but unlike jump_to the simulator still runs every clock
+    if cycles == 0:
+        return
+    if cycles > 1:
+        yield Delay((cycles - 0.5) * period)
+    yield
+
+
+def jump_to(timing, line, pixel):
+    # inputs written now are sampled on the clock after this one, so
+    # the counters read back as line/pixel two clocks from now
+    assert timing.fast_forward, 'VgaTiming needs fast_forward=True to jump'
+    yield timing.jump_line.eq(line)
+    yield timing.jump_pixel.eq(pixel)
+    yield timing.jump.eq(1)
+    yield
+    yield timing.jump.eq(0)
+    yield
+
+
+def next_strobe(res, line, pixel):
+    # position of the next clock where new_line fires. that is one
+    # clock before the first pixel of each line from the top of the
+    # visible area to the end of the frame (so the front porch lines
+    # get one too), and new_frame fires alongside the first one
+    if pixel >= res.h.prescan - 1:
+        line += 1
+    if line >= res.v.fullscan:
+        line = 0
+    if line < res.v.prescan:
+        line = res.v.prescan
+    return line, res.h.prescan - 1
+
+
+def is_visible(res, line, pixel):
+    # true from the new_line strobe to the end of a visible line
+    return (
+        res.v.prescan <= line < res.v.prescan + res.height
+        and res.h.prescan - 1 <= pixel < res.h.prescan + res.width
+    )
+
+
+def skip_blanking(timing):
+    """If the scan is in a blanking interval, jump ahead to just before
+    the next visible pixel: when this returns, the current clock is
+    the one where new_line fires and the next one is visible. Returns
+    the number of clocks that were skipped."""
+    res = timing.res
+    line_length = res.h.fullscan
+    frame_length = line_length * res.v.fullscan
+
+    skipped = 0
+    line = yield timing.line_counter
+    pixel = yield timing.scan_counter
+    while not is_visible(res, line, pixel):
+        target_line, target_pixel = next_strobe(res, line, pixel)
+        distance = (
+            (target_line * line_length + target_pixel)
+            - (line * line_length + pixel)
+        ) % frame_length
+        if distance > 2:
+            yield from jump_to(timing, target_line, target_pixel)
+            skipped += distance - 2
+        else:
+            for _ in range(distance):
+                yield
+        line, pixel = target_line, target_pixel
+    return skipped
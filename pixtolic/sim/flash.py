@@ -0,0 +1,74 @@
+# a behavioural model of the board's SPI flash, for a testbench
+# process in the domain of whatever reads it (see
+# pixtolic.sources.flash). `pins` has `cs`, `sck`, `dq_o`, `dq_oe` and
+# `dq_i`, as the reader drives and sees them. `contents` is what is
+# stored from `offset` on; everything else reads as 0xff.
+#
+# the pins go through the board's I/O cells the way pixtolic.top
+# requests them: `cs`, `dq_o` and `dq_oe` through an output register
+# each, and `sck` high means a clock pulse in the second half of a
+# cycle from the DDR register, which has a register of its own in
+# front of it. so everything reaches the flash OUTPUT_LATENCY clocks
+# after it is set, all together. the flash puts out the next nibble
+# after the pulse's falling edge, at the end of that clock, and it
+# comes in through an input register, so it is on `dq_i`
+# READ_LATENCY clocks after the pulse that asked for it.
+#
+# only what a FlashStream sends is understood: release from power-down
+# (0xab) and quad output fast read (0x6b: a command byte and 3 address
+# bytes on IO0, 8 dummy clocks, then a nibble per clock on IO0-3, high
+# nibble first, until cs goes high). the first nibble comes out after
+# the last dummy clock.
+
+from collections import deque
+
+from nmigen.sim import Passive, Settle
+
+
+RELEASE_POWER_DOWN = 0xab
+QUAD_OUTPUT_FAST_READ = 0x6b
+DUMMY_CLOCKS = 8
+OUTPUT_LATENCY = 1
+READ_LATENCY = OUTPUT_LATENCY + 2
+
+
+def flash(pins, contents, offset=0):
+    def read(addr):
+        if offset <= addr < offset + len(contents):
+            return contents[addr - offset]
+        return 0xff
+
+    yield Passive()
+    # the pins as the flash sees them now, oldest first
+    seen = deque([(0, 0, 0, 0)] * OUTPUT_LATENCY)
+    # nibbles on their way back, with the clock they get to dq_i
+    returning = deque()
+    clock = 0
+    bits = 0
+    count = 0
+    while True:
+        yield Settle()
+        seen.append(((yield pins.cs), (yield pins.sck), (yield pins.dq_o), (yield pins.dq_oe)))
+        cs, sck, dq_o, dq_oe = seen.popleft()
+        if not cs:
+            bits = 0
+            count = 0
+        else:
+            if count >= 32 + DUMMY_CLOCKS:
+                assert not dq_oe, 'driving the data lines while the flash is'
+            if sck:
+                if count < 32:
+                    # command and address, a bit a clock on IO0
+                    bits = bits << 1 | (dq_o & 1)
+                    if count == 7 and bits not in (RELEASE_POWER_DOWN, QUAD_OUTPUT_FAST_READ):
+                        raise AssertionError(f'the flash model doesn\'t know command {bits:#04x}')
+                if count >= 32 + DUMMY_CLOCKS - 1:
+                    assert bits >> 24 == QUAD_OUTPUT_FAST_READ, 'clocking data out of the flash without a read'
+                    nibble = count - (32 + DUMMY_CLOCKS - 1)
+                    byte = read((bits & 0xffffff) + nibble // 2)
+                    returning.append((clock + 2, byte >> 4 if nibble % 2 == 0 else byte & 0xf))
+                count += 1
+        while returning and returning[0][0] == clock:
+            yield pins.dq_i.eq(returning.popleft()[1])
+        yield
+        clock += 1
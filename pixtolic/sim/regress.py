@@ -0,0 +1,134 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import os
+import sys
+from time import perf_counter
+import traceback
+
+from pixtolic.config.resolutions import resolutions, ResolutionName
+from pixtolic.sim.bench import BACKENDS
+from pixtolic.sim.benchmark import git_revision
+from pixtolic.sim.cli import BENCHES, get_bench
+
+
+COLOR_DEPTHS = (1, 2, 3, 4)
+
+
+def matrix(benches, resolution_names, color_depths):
+    # (name, bench, resolution, color depth), always in the same order
+    # so that every machine agrees on what is in each shard
+    for bench in benches:
+        for name in resolution_names:
+            for color_depth in color_depths:
+                yield f'{bench}/{name}/{color_depth}bit', bench, name, color_depth
+
+
+def shard(jobs, spec):
+    # 'i/n' -> every n-th job starting from the i-th, counting from 1
+    index, _, count = spec.partition('/')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f'shard {spec!r} should be i/n with 1 <= i <= n')
+    return jobs[index - 1::count]
+
+
+def run_job(job):
+    name, bench_name, resolution_name, color_depth, frames, backend = job
+    start = perf_counter()
+    try:
+        bench = get_bench(bench_name, resolutions[ResolutionName[resolution_name]], color_depth)
+        if frames is None:
+            frames = bench.frames
+        capture = bench.run(backend=backend, frames=frames)
+        if capture is not None and bench.check is not None:
+            bench.check(capture)
+    except Exception:
+        passed, error = False, traceback.format_exc()
+    else:
+        passed, error = True, None
+
+    return {
+        'name': name,
+        'bench': bench_name,
+        'resolution': resolution_name,
+        'color_depth': color_depth,
+        'backend': backend,
+        'frames': frames,
+        'passed': passed,
+        'seconds': perf_counter() - start,
+        'error': error,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(
+        prog='python -m pixtolic.sim.regress',
+        description='simulate every testbench at every resolution and color depth',
+    )
+    p.add_argument('--bench', action='append', choices=sorted(BENCHES),
+                   help='only run these benches (default: all of them)')
+    p.add_argument('--resolution', action='append',
+                   choices=[name.name for name in ResolutionName],
+                   help='only run these resolutions (default: all of them)')
+    p.add_argument('--color-depth', action='append', type=int,
+                   help=f'only run these color depths (default: {COLOR_DEPTHS})')
+    p.add_argument('--frames', type=int,
+                   help='frames to capture (default: as many as each bench checks)')
+    p.add_argument('--backend', choices=BACKENDS, default='pysim')
+    p.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                   help='simulations to run at once (default: one per core)')
+    p.add_argument('--shard', metavar='I/N',
+                   help='only run the I-th of N equal slices of the matrix, to split it across machines')
+    p.add_argument('--output', '-o', help='write results as JSON here (default: stdout)')
+    args = p.parse_args()
+
+    jobs = [
+        (name, bench, resolution_name, color_depth, args.frames, args.backend)
+        for name, bench, resolution_name, color_depth in matrix(
+            args.bench or sorted(BENCHES),
+            args.resolution or [name.name for name in ResolutionName],
+            args.color_depth or COLOR_DEPTHS,
+        )
+    ]
+    if args.shard:
+        try:
+            jobs = shard(jobs, args.shard)
+        except ValueError as e:
+            p.error(e)
+
+    # spawn rather than fork so each simulation starts from a clean
+    # interpreter, same as the benchmarks
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    with ctx.Pool(args.jobs, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_job, jobs):
+            status = 'pass' if result['passed'] else 'FAIL'
+            print(f'{status} {result["name"]:48} {result["seconds"]:8.1f}s', file=sys.stderr)
+            results.append(result)
+    results.sort(key=lambda result: result['name'])
+
+    failures = [result for result in results if not result['passed']]
+    for result in failures:
+        print(f'\n{result["name"]}:\n{result["error"]}', file=sys.stderr)
+
+    report = {
+        'revision': git_revision(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'shard': args.shard,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    print(f'{len(results) - len(failures)} passed, {len(failures)} failed', file=sys.stderr)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from nmigen import *
+from nmigen.sim import Passive
+from vcd import VCDWriter
+
+from pixtolic.sim.fastforward import sleep
+
+
+class Trace:
+
+    """Write a waveform of just a few signals over part of a simulation.
+
+    `Simulator.write_vcd` records every signal for the whole run, which
+    for a full frame is a huge file and most of the run time. A `Trace`
+    instead samples the given `signals` once per clock, starting
+    `start` clocks into the simulation (and then at the first clock
+    where `trigger` is high, if there is one) and stopping after
+    `cycles` clocks or at the first clock where `stop` is high, and
+    only writes out the values that changed.
+
+    `signals` is a list of signals or a dict of {name: value}; dotted
+    names like 'timing.hsync' end up in nested scopes in the viewer.
+    The trace is passive, so it never keeps the simulation running;
+    call `close()` once the simulation is done.
+
+    """
+
+    def __init__(self, vcd_file, signals, start=0, cycles=None, trigger=None,
+                 stop=None, period=1e-6):
+        if not isinstance(signals, dict):
+            signals = {signal.name: signal for signal in signals}
+        self.signals = {name: Value.cast(value) for name, value in signals.items()}
+        self.start = start
+        self.cycles = cycles
+        self.trigger = trigger
+        self.stop = stop
+        self.period = period
+
+        self.file = open(vcd_file, 'w')
+        self.writer = VCDWriter(self.file, timescale='1 ns')
+        self.vars = []
+        for name, value in self.signals.items():
+            scope, _, leaf = name.rpartition('.')
+            self.vars.append(self.writer.register_var(
+                scope or 'top', leaf, 'wire', size=len(value)
+            ))
+
+    @classmethod
+    def lines(cls, vcd_file, signals, timing, first, count=1, **kwargs):
+        """Trace `count` visible lines starting at visible line `first`,
+        including the horizontal blanking before each of them. Goes by
+        `timing`'s line counter rather than counting clocks, so it
+        finds the lines wherever the timing starts and even if the
+        blanking is being skipped with fast_forward."""
+        res = timing.res
+        if not 0 <= first < res.height:
+            raise ValueError(f'line {first} is outside the {res.height} visible lines')
+        last = min(first + count, res.height)
+        return cls(
+            vcd_file,
+            signals,
+            trigger=timing.line_counter == res.v.prescan + first,
+            stop=timing.line_counter == res.v.prescan + last,
+            **kwargs,
+        )
+
+    def process(self):
+        yield Passive()
+        yield from sleep(self.start, self.period)
+        cycle = self.start
+        if self.trigger is not None:
+            while not (yield self.trigger):
+                yield
+                cycle += 1
+
+        values = [None] * len(self.vars)
+        sampled = 0
+        while self.cycles is None or sampled < self.cycles:
+            if self.stop is not None and (yield self.stop):
+                break
+            timestamp = round(cycle * self.period * 1e9)
+            for i, (var, value) in enumerate(zip(self.vars, self.signals.values())):
+                sample = yield value
+                if sample != values[i]:
+                    self.writer.change(var, timestamp, sample)
+                    values[i] = sample
+            yield
+            cycle += 1
+            sampled += 1
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
@@ -0,0 +1,36 @@
+# the host end of a simulated UART, for testbench processes running
+# in the UART's domain. `serial` is the record passed to the UART
+# (rx/tx), and `divisor` its clocks per bit.
+
+
+def send(serial, data, divisor):
+    # 8N1, least significant bit first
+    for byte in data:
+        bits = [0] + [(byte >> i) & 1 for i in range(8)] + [1]
+        for bit in bits:
+            yield serial.rx.eq(bit)
+            for _ in range(divisor):
+                yield
+
+
+def receive(serial, divisor, count=1, timeout=None):
+    # returns `count` bytes, or as many as arrived before `timeout`
+    # clocks passed without a start bit
+    data = []
+    while len(data) < count:
+        waited = 0
+        while (yield serial.tx):
+            if timeout is not None and waited >= timeout:
+                return bytes(data)
+            waited += 1
+            yield
+        # sample in the middle of each bit
+        for _ in range(divisor + divisor // 2):
+            yield
+        byte = 0
+        for i in range(8):
+            byte |= (yield serial.tx) << i
+            for _ in range(divisor):
+                yield
+        data.append(byte)
+    return bytes(data)
@@ -0,0 +1,375 @@
+from math import gcd
+import sys
+
+from nmigen import *
+import numpy as np
+
+from pixtolic.host.flash import FLASH_OFFSET, FLASH_SIZE, flash_image, frame_bytes
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sim.bench import Bench
+from pixtolic.sim.flash import (
+    DUMMY_CLOCKS,
+    QUAD_OUTPUT_FAST_READ,
+    READ_LATENCY,
+    RELEASE_POWER_DOWN,
+    flash,
+)
+
+
+class FlashStream(Elaboratable):
+
+    """Images of `width` x `height` pixels (or `frames` of an
+    animation, each shown for `hold` frames) read from the SPI flash as
+    they are shown, so they take two lines of block RAM instead of a
+    whole image. Each pixel is shown `scale` times across and down.
+    pixtolic.host.flash packs the images to write at `offset`.
+
+    Every frame is one quad output fast read, started at the top of
+    the vertical blanking and read into two line buffers, one being
+    shown while the next line goes into the other. The flash's clock
+    stops while both are full. Everything runs in the `pixel` domain,
+    and `sck` high means one clock pulse, which on the board goes out
+    through a DDR pin, so a nibble comes in on every pixel clock.
+    That's 4 bits a pixel clock against the 12 of a full 800x600
+    frame, so a line of pixels has to be read in the time `scale` lines
+    are shown. The flash needs its QE (quad enable) bit set.
+
+    Pixels are packed with no gaps between them, so unless they're 12
+    bits one can start partway through a nibble. They're read in
+    groups of as many pixels as fill a whole number of nibbles (4
+    pixels of 3 or 9 bits, 2 of 6 bits, 1 of 12), one group to a
+    word of the line buffers, so `width` has to be a multiple of
+    `group`.
+
+    On the board every pin goes through a register in its I/O cell, so
+    the nibble a pulse on `sck` clocks out of the flash is only on
+    `dq_i` READ_LATENCY clocks later (see pixtolic.sim.flash). Pulses
+    are counted as they go out, to know when to stop, and nibbles as
+    they come in, to know where they go.
+
+    """
+
+    # release from power-down takes 3 us
+    WAKE_TIME = 3e-6
+
+    def __init__(self, timing, color_depth, width, height, scale=1,
+                 frames=1, hold=1, offset=FLASH_OFFSET):
+        self.timing = timing
+        self.color_depth = color_depth
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.frames = frames
+        self.hold = hold
+        self.offset = offset
+        self.frame_bytes = frame_bytes(width, height, color_depth)
+        word_width = 3 * color_depth
+        # pixels in a group, always a power of two
+        self.group = 4 // gcd(word_width, 4)
+        # and the nibbles they take
+        self.nibbles = self.group * word_width // 4
+        if width % self.group:
+            raise ValueError(
+                f'{width} pixels of {word_width} bits aren\'t a whole number of '
+                f'{self.group}-pixel groups'
+            )
+        self.groups = width // self.group
+        res = timing.res
+        line_clocks = self.groups * self.nibbles + READ_LATENCY
+        if line_clocks > scale * res.h.fullscan:
+            raise ValueError(
+                f'a line of {width} pixels takes {line_clocks} clocks to read, longer than '
+                f'{scale} line(s) of {res.h.fullscan} take to show'
+            )
+        if offset + frames * self.frame_bytes > FLASH_SIZE:
+            raise ValueError(f'{frames} frames at {offset:#x} don\'t fit in the flash')
+
+        self.x = Signal(range(self.width + 1))
+        self.y = Signal(range(self.height + 1))
+        self.red = Signal(self.color_depth)
+        self.green = Signal(self.color_depth)
+        self.blue = Signal(self.color_depth)
+
+        # to the flash
+        self.cs = Signal()
+        self.sck = Signal()
+        self.dq_o = Signal(4)
+        self.dq_oe = Signal()
+        self.dq_i = Signal(4)
+
+    def abort(self, m, start, count):
+        # a new frame starts the read over, wherever it got to
+        with m.If(start):
+            m.d.pixel += count.eq(0)
+            m.next = 'IDLE'
+
+    def elaborate(self, platform):
+        m = Module()
+        timing = self.timing
+        width, height, scale = self.width, self.height, self.scale
+        groups = self.groups
+        word_width = 3 * self.color_depth
+        group_width = self.group * word_width
+
+        lines = Memory(width=group_width, depth=2 * groups)
+        m.submodules.rd_port = rd_port = lines.read_port(domain='pixel')
+        m.submodules.wr_port = wr_port = lines.write_port(domain='pixel')
+
+        # starting a frame: which animation frame, and where it is
+        start = Signal()
+        m.d.comb += start.eq((timing.line_counter == 0) & (timing.scan_counter == 0))
+        frame = Signal(range(self.frames))
+        held = Signal(range(self.hold))
+        frame_addr = Signal(24, reset=self.offset)
+        with m.If(start):
+            with m.If(held == self.hold - 1):
+                m.d.pixel += held.eq(0)
+                with m.If(frame == self.frames - 1):
+                    m.d.pixel += [
+                        frame.eq(0),
+                        frame_addr.eq(self.offset),
+                    ]
+                with m.Else():
+                    m.d.pixel += [
+                        frame.eq(frame + 1),
+                        frame_addr.eq(frame_addr + self.frame_bytes),
+                    ]
+            with m.Else():
+                m.d.pixel += held.eq(held + 1)
+
+        # filling the line buffers: line n goes in buffer n % 2, and
+        # `ahead` lines have been asked for and not shown yet
+        asked = Signal(range(groups * self.nibbles))
+        asked_y = Signal(range(height + 1))
+        ahead = Signal(range(3))
+        ask = Signal()
+        line_asked = Signal()
+        room = Signal()
+        released = Signal()
+        m.d.comb += room.eq((asked_y < height) & (ahead < 2))
+        m.d.pixel += ahead.eq(ahead - released + line_asked)
+        with m.If(ask):
+            with m.If(asked == groups * self.nibbles - 1):
+                m.d.pixel += [
+                    asked.eq(0),
+                    asked_y.eq(asked_y + 1),
+                ]
+                m.d.comb += line_asked.eq(1)
+            with m.Else():
+                m.d.pixel += asked.eq(asked + 1)
+
+        # and the nibbles as they come back
+        arriving = Signal(READ_LATENCY)
+        m.d.pixel += arriving.eq(Cat(ask, arriving))
+        fill_x = Signal(range(groups))
+        fill_y = Signal(range(height))
+        nibble = Signal(range(self.nibbles))
+        bits = Signal(group_width)
+        with m.If(arriving[-1]):
+            word = Cat(self.dq_i, bits)[:group_width]
+            m.d.pixel += [
+                bits.eq(word),
+                nibble.eq(nibble + 1),
+            ]
+            with m.If(nibble == self.nibbles - 1):
+                m.d.pixel += [
+                    nibble.eq(0),
+                    fill_x.eq(fill_x + 1),
+                ]
+                m.d.comb += [
+                    wr_port.addr.eq(Mux(fill_y[0], groups + fill_x, fill_x)),
+                    wr_port.data.eq(word),
+                    wr_port.en.eq(1),
+                ]
+                with m.If(fill_x == groups - 1):
+                    m.d.pixel += [
+                        fill_x.eq(0),
+                        fill_y.eq(fill_y + 1),
+                    ]
+
+        # the flash: wake it up, then one read per frame
+        wake_clocks = int(np.ceil(self.WAKE_TIME * timing.res.pixclk_freq))
+        wait = Signal(range(wake_clocks + 1))
+        restart = Signal()
+        shift = Signal(32)
+        count = Signal(range(32))
+        m.d.comb += self.dq_o.eq(Cat(shift[-1], Const(0b110, 3)))
+        with m.FSM(domain='pixel'):
+            with m.State('WAKE'):
+                m.d.comb += [
+                    self.cs.eq(1),
+                    self.sck.eq(1),
+                    self.dq_oe.eq(1),
+                    self.dq_o[0].eq(Const(RELEASE_POWER_DOWN, 8).bit_select(7 - count, 1)),
+                ]
+                m.d.pixel += count.eq(count + 1)
+                with m.If(count == 7):
+                    m.d.pixel += [
+                        count.eq(0),
+                        wait.eq(wake_clocks),
+                    ]
+                    m.next = 'IDLE'
+
+            with m.State('IDLE'):
+                with m.If(wait != 0):
+                    m.d.pixel += wait.eq(wait - 1)
+                with m.Elif(restart & ~start):
+                    m.d.pixel += restart.eq(0)
+                    m.next = 'COMMAND'
+
+            with m.State('COMMAND'):
+                m.d.comb += [
+                    self.cs.eq(1),
+                    self.sck.eq(1),
+                    self.dq_oe.eq(1),
+                ]
+                m.d.pixel += [
+                    shift.eq(shift << 1),
+                    count.eq(count + 1),
+                ]
+                with m.If(count == 31):
+                    m.d.pixel += count.eq(0)
+                    m.next = 'DUMMY'
+                self.abort(m, start, count)
+
+            with m.State('DUMMY'):
+                m.d.comb += [
+                    self.cs.eq(1),
+                    self.sck.eq(1),
+                ]
+                m.d.pixel += count.eq(count + 1)
+                # the last one asks for the first nibble, so it's sent
+                # from STREAM
+                with m.If(count == DUMMY_CLOCKS - 2):
+                    m.d.pixel += count.eq(0)
+                    m.next = 'STREAM'
+                self.abort(m, start, count)
+
+            with m.State('STREAM'):
+                m.d.comb += [
+                    self.cs.eq(1),
+                    self.sck.eq(room),
+                    ask.eq(room),
+                ]
+                self.abort(m, start, count)
+
+        with m.If(start):
+            m.d.pixel += [
+                restart.eq(1),
+                shift.eq(Cat(frame_addr, Const(QUAD_OUTPUT_FAST_READ, 8))),
+                asked.eq(0),
+                asked_y.eq(0),
+                ahead.eq(0),
+                arriving.eq(0),
+                fill_x.eq(0),
+                fill_y.eq(0),
+                nibble.eq(0),
+            ]
+
+        # showing the lines, the same way a Still does but with each
+        # pixel repeated
+        x_repeat = Signal(range(scale))
+        y_repeat = Signal(range(scale))
+        inside = Signal()
+        lane_bits = self.group.bit_length() - 1
+        group_x = self.x[lane_bits:]
+        m.d.comb += rd_port.addr.eq(Mux(self.y[0], groups + group_x, group_x))
+        # lines up with the memory read
+        m.d.pixel += inside.eq((self.x < width) & (self.y < height))
+
+        word = rd_port.data
+        if self.group > 1:
+            # the first pixel of a group came in first, so it's in the
+            # top bits
+            lane = Signal(lane_bits)
+            m.d.pixel += lane.eq(~self.x[:lane_bits])
+            word = word.word_select(lane, word_width)
+        with m.If(timing.active & inside):
+            m.d.comb += [
+                self.red.eq(word[2*self.color_depth:3*self.color_depth]),
+                self.green.eq(word[self.color_depth:2*self.color_depth]),
+                self.blue.eq(word[0:self.color_depth]),
+            ]
+
+        with m.If(timing.new_frame):
+            m.d.pixel += [
+                self.x.eq(0),
+                self.y.eq(0),
+                x_repeat.eq(0),
+                y_repeat.eq(0),
+            ]
+        with m.Elif(timing.new_line):
+            m.d.pixel += [
+                self.x.eq(0),
+                x_repeat.eq(0),
+            ]
+            with m.If(y_repeat == scale - 1):
+                m.d.pixel += y_repeat.eq(0)
+                with m.If(self.y < height):
+                    # done with this line, so its buffer can be refilled
+                    m.d.pixel += self.y.eq(self.y + 1)
+                    m.d.comb += released.eq(1)
+            with m.Else():
+                m.d.pixel += y_repeat.eq(y_repeat + 1)
+        with m.Elif(timing.active):
+            with m.If(x_repeat == scale - 1):
+                m.d.pixel += x_repeat.eq(0)
+                with m.If(self.x < width):
+                    m.d.pixel += self.x.eq(self.x + 1)
+            with m.Else():
+                m.d.pixel += x_repeat.eq(x_repeat + 1)
+
+        return m
+
+
+class TestBench(Elaboratable):
+    def __init__(self, timing, stream):
+        self.timing = timing
+        self.stream = stream
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [
+            self.timing,
+            self.stream,
+        ]
+        return m
+
+
+def bench(resolution, color_depth, scale=2, frames=2):
+    # `frames` of noise filling the screen at 1/`scale` size, read from
+    # the flash model one after the other. the timing starts at the
+    # top of the frame so there's a whole vertical blanking to start
+    # reading in
+    timing = VgaTiming(resolution)
+    width, height = resolution.width // scale, resolution.height // scale
+    stream = FlashStream(timing, color_depth, width, height, scale=scale, frames=frames)
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 2 ** (3 * color_depth), width * height) for _ in range(frames)]
+    contents = flash_image(images, color_depth)
+
+    def model():
+        yield from flash(stream, contents, stream.offset)
+
+    def check(capture):
+        for number, captured in enumerate(capture.buffer):
+            image = images[number % frames].reshape(height, width)
+            expected = np.zeros((resolution.height, resolution.width), dtype='uint32')
+            expected[:height * scale, :width * scale] = image.repeat(scale, axis=0).repeat(scale, axis=1)
+            # one clock behind, like the Still
+            mismatches = np.count_nonzero(captured[:, 1:] != expected[:, :-1])
+            assert mismatches == 0, f'{mismatches} pixels of frame {number} differ from image {number % frames}'
+
+    return Bench(
+        TestBench(timing, stream),
+        timing=timing,
+        source=stream,
+        processes=[model],
+        check=check,
+        frames=frames,
+    )
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='flash')
@@ -0,0 +1,207 @@
+import sys
+
+from nmigen import *
+from nmigen.lib.cdc import FFSynchronizer
+from nmigen.lib.fifo import AsyncFIFO
+from nmigen.sim import Settle
+from nmigen.utils import bits_for
+import numpy as np
+
+from pixtolic.device.iCE40 import iCE40SPRAM
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sources.scaler import Scaler
+from pixtolic.sim.bench import Bench
+
+
+class Framebuffer(Elaboratable):
+
+    """An image of `width` x `height` pixels in the UP5K's SPRAM instead
+    of block RAM, with room for up to 32768 of them (200x150, say,
+    where a Still fits 100x75), shown the same way a Still is.
+
+    There are two buffers, each in two of the four SPRAMs: one is
+    shown while the other is drawn into, through `write_addr`,
+    `write_data` and `write_en` in the `sync` domain. `show` says that
+    everything written so far should be shown, and the buffers swap at
+    the next `new_frame`; writes after it wait until then, so a frame
+    is never shown half drawn. `swapped` changes when the buffers have
+    swapped. Until the first swap the screen is black.
+
+    After a swap, the buffer being drawn into holds the image from
+    before it, not the one now shown, so anything that draws only what
+    changed has to draw it against the frame before last.
+
+    """
+
+    BUFFER_DEPTH = 2 * iCE40SPRAM.DEPTH
+
+    def __init__(self, timing, color_depth, width, height, fifo_depth=4, scale=1):
+        if 3 * color_depth > iCE40SPRAM.WIDTH:
+            raise ValueError(f'{3 * color_depth}-bit pixels don\'t fit in SPRAM words')
+        if width * height > self.BUFFER_DEPTH:
+            raise ValueError(
+                f'{width}x{height} is more than the {self.BUFFER_DEPTH} pixels a buffer holds'
+            )
+        self.timing = timing
+        self.color_depth = color_depth
+        self.width = width
+        self.height = height
+        self.pixcount = width * height
+        self.fifo_depth = fifo_depth
+
+        self.scaler = Scaler(timing, width, height, scale)
+        self.x = self.scaler.x
+        self.y = self.scaler.y
+        self.red = Signal(self.color_depth)
+        self.green = Signal(self.color_depth)
+        self.blue = Signal(self.color_depth)
+        self.addr = Signal(range(self.BUFFER_DEPTH))
+
+        # the buffer being shown, in the pixel domain
+        self.front = Signal()
+        # shown since the buffers last swapped, waiting for new_frame
+        self.pending = Signal()
+
+        # drawing, in the sync domain
+        self.write_addr = Signal(range(self.BUFFER_DEPTH))
+        self.write_data = Signal(3 * self.color_depth)
+        self.write_en = Signal()
+        self.show = Signal()
+        self.write_ready = Signal()
+        self.swapped = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # the writes cross into the pixel domain, where the SPRAMs are
+        m.submodules.write_fifo = fifo = AsyncFIFO(
+            width=len(self.write_addr) + len(self.write_data) + 2,
+            depth=self.fifo_depth,
+            r_domain='pixel',
+            w_domain='sync',
+        )
+        m.d.comb += [
+            fifo.w_data.eq(Cat(self.write_addr, self.write_data, self.write_en, self.show)),
+            fifo.w_en.eq(self.write_en | self.show),
+            self.write_ready.eq(fifo.w_rdy),
+        ]
+        addr = fifo.r_data[:len(self.write_addr)]
+        data = fifo.r_data[len(self.write_addr):-2]
+        write = Signal()
+        m.d.comb += [
+            fifo.r_en.eq(~self.pending),
+            write.eq(fifo.r_rdy & ~self.pending & fifo.r_data[-2]),
+        ]
+        with m.If(fifo.r_rdy & ~self.pending & fifo.r_data[-1]):
+            m.d.pixel += self.pending.eq(1)
+        with m.If(self.timing.new_frame & self.pending):
+            m.d.pixel += [
+                self.front.eq(~self.front),
+                self.pending.eq(0),
+            ]
+        m.submodules += FFSynchronizer(self.front, self.swapped, o_domain='sync')
+
+        # SPRAM 2 * buffer + half holds that half of that buffer, if
+        # the image reaches into it
+        half_bits = bits_for(iCE40SPRAM.DEPTH - 1)
+        read_block = Signal(2)
+        m.d.pixel += read_block.eq(Cat(self.addr[half_bits:], self.front))
+        word = Signal(iCE40SPRAM.WIDTH)
+        for block in range(4):
+            buffer, half = divmod(block, 2)
+            used = min(self.pixcount - half * iCE40SPRAM.DEPTH, iCE40SPRAM.DEPTH)
+            if used <= 0:
+                continue
+            spram = iCE40SPRAM(domain='pixel', depth=used)
+            m.submodules[f'spram{block}'] = spram
+            with m.If(self.front == buffer):
+                m.d.comb += spram.addr.eq(self.addr)
+            with m.Else():
+                m.d.comb += [
+                    spram.addr.eq(addr),
+                    spram.data_in.eq(data),
+                    spram.write_en.eq(write & (addr[half_bits:] == half)),
+                ]
+            with m.If(read_block == block):
+                m.d.comb += word.eq(spram.data_out)
+
+        m.submodules.scaler = self.scaler
+        m.d.comb += self.addr.eq(self.scaler.addr)
+
+        with m.If(self.timing.active):
+            m.d.comb += [
+                self.red.eq(word[2*self.color_depth:3*self.color_depth]),
+                self.green.eq(word[self.color_depth:2*self.color_depth]),
+                self.blue.eq(word[0:self.color_depth]),
+            ]
+
+        return m
+
+
+class TestBench(Elaboratable):
+    def __init__(self, timing, framebuffer):
+        self.timing = timing
+        self.framebuffer = framebuffer
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [
+            self.timing,
+            self.framebuffer,
+        ]
+        return m
+
+
+def bench(resolution, color_depth, width=40, height=30):
+    # draws one image and shows it before the first frame, then draws
+    # a second one straight away, which has to wait for the swap and
+    # then go into the buffer that isn't shown. frame 0 should be all
+    # the first image, and any after it the second
+    pixels = width * height
+    timing = VgaTiming.warm(resolution, lines_before=-(-3 * pixels // resolution.h.fullscan))
+    framebuffer = Framebuffer(timing, color_depth, width, height)
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 2 ** (3 * color_depth), (height, width)) for _ in range(2)]
+
+    def write(**values):
+        # hold `values` until the framebuffer takes them
+        for name, value in values.items():
+            yield getattr(framebuffer, name).eq(value)
+        while True:
+            yield Settle()
+            ready = yield framebuffer.write_ready
+            yield
+            if ready:
+                break
+        for name in values:
+            yield getattr(framebuffer, name).eq(0)
+
+    def draw():
+        for image in images:
+            for addr, word in enumerate(image.flatten()):
+                yield from write(write_addr=addr, write_data=int(word), write_en=1)
+            yield from write(show=1)
+
+    def check(capture):
+        for number, captured in enumerate(capture.buffer):
+            image = images[min(number, 1)]
+            tiles = (-(-resolution.height // height), -(-resolution.width // width))
+            expected = np.tile(image, tiles)[:resolution.height, :resolution.width]
+            # one clock behind, like the Still
+            mismatches = np.count_nonzero(captured[:, 1:] != expected[:, :-1])
+            assert mismatches == 0, f'{mismatches} pixels of frame {number} differ from image {min(number, 1)}'
+
+    return Bench(
+        TestBench(timing, framebuffer),
+        timing=timing,
+        source=framebuffer,
+        processes=[draw],
+        domains=('sync', 'pixel'),
+        check=check,
+        frames=2,
+    )
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='framebuffer')
@@ -0,0 +1,77 @@
+from os import path
+import sys
+
+from nmigen import *
+from nmigen.utils import bits_for
+import numpy as np
+from PIL import Image
+
+from pixtolic.host.palette import quantize
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sim.bench import Bench
+from pixtolic.sources.still import Still, TestBench
+
+
+IMAGE = path.join(
+    path.dirname(__file__),
+    '../../resources/RGB_12bits_parrot.png',
+)
+
+
+class IndexedStill(Still):
+
+    """A Still that keeps the index of a palette entry for each pixel
+    instead of its color, so with 16 or 64 colors an image takes a
+    third or half the block RAM. The palette is built for the image
+    (see pixtolic.host.palette) and is small enough to be logic instead
+    of block RAM, so the colors come out on the same clock as a
+    Still's."""
+
+    def __init__(self, timing, color_depth, image, colors=16, init=None, scale=1):
+        self.colors = colors
+        self.palette, self.indices = quantize(image, color_depth, colors)
+        super().__init__(timing, color_depth, image, init=init, scale=scale)
+
+    @property
+    def word_width(self):
+        return bits_for(self.colors - 1)
+
+    def image_words(self, image):
+        return self.indices
+
+    def color(self, m, word):
+        palette = Memory(width=3 * self.color_depth, depth=self.colors, init=self.palette)
+        port = palette.read_port(domain='comb')
+        m.submodules += port
+        m.d.comb += port.addr.eq(word)
+        return port.data
+
+
+def bench(resolution, color_depth, colors=16):
+    timing = VgaTiming.warm(resolution, fast_forward=True)
+    still = IndexedStill(
+        timing,
+        color_depth=color_depth,
+        image=Image.open(IMAGE).resize((40, 30)),
+        colors=colors,
+    )
+
+    def check(capture):
+        # like the Still bench, but with the colors from the palette
+        image = np.array(still.palette, dtype='uint32')[still.indices].reshape(still.height, still.width)
+        tiles = (-(-resolution.height // still.height), -(-resolution.width // still.width))
+        expected = np.tile(image, tiles)[:resolution.height, :resolution.width]
+        mismatches = np.count_nonzero(capture.buffer[:, :, 1:] != expected[:, :-1])
+        assert mismatches == 0, f'{mismatches} pixels differ from the image'
+
+    return Bench(TestBench(timing, still), timing=timing, source=still, check=check)
+
+
+def bench64(resolution, color_depth):
+    # the same with 64 colors, so 6-bit indices
+    return bench(resolution, color_depth, colors=64)
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='indexed')
@@ -0,0 +1,146 @@
+from fractions import Fraction
+import sys
+
+from nmigen import *
+import numpy as np
+
+from pixtolic.host.testvec import gradient
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sim.bench import Bench
+
+
+def scale_factors(scale):
+    # `scale` is one factor for both ways or (across, down), each an
+    # int or a Fraction
+    across, down = scale if isinstance(scale, tuple) else (scale, scale)
+    factors = Fraction(across), Fraction(down)
+    if min(factors) < 1:
+        raise ValueError(f'can only scale images up, not by {min(factors)}')
+    return factors
+
+
+def source_index(i, factor, size):
+    # the pixel of `size` that a Scaler shows at output pixel `i`
+    return (i * factor.denominator // factor.numerator) % size
+
+
+class Scaler(Elaboratable):
+
+    """Walks an image of `width` x `height` pixels in step with
+    `timing`, showing each pixel `scale` times across and down, where a
+    scale can be a Fraction, and repeating the image if it still
+    doesn't fill the screen. `addr` is the address of the pixel (row by
+    row) to read for the next clock.
+
+    A scale of p/q moves on a pixel whenever q output pixels have added
+    up to p, like a line-drawing DDA, and the address is kept up to
+    date with adders as the scan goes along rather than multiplying
+    `y` by the width every clock, so there's no multiplier in the way.
+    A line that's shown more than once just starts again from the same
+    address.
+
+    """
+
+    def __init__(self, timing, width, height, scale=1):
+        self.timing = timing
+        self.width = width
+        self.height = height
+        self.scale_x, self.scale_y = scale_factors(scale)
+
+        self.x = Signal(range(self.width))
+        self.y = Signal(range(self.height))
+        self.addr = Signal(range(self.width * self.height))
+        # address of the start of row `y`
+        self.row = Signal(range(self.width * self.height))
+
+    def elaborate(self, platform):
+        m = Module()
+        timing = self.timing
+        across, down = self.scale_x, self.scale_y
+
+        # how far into the current pixel the scan is, out of the
+        # factor's numerator
+        x_part = Signal(range(across.numerator))
+        y_part = Signal(range(down.numerator))
+
+        with m.If(timing.new_frame):
+            m.d.pixel += [
+                self.x.eq(0),
+                self.y.eq(0),
+                x_part.eq(0),
+                y_part.eq(0),
+                self.row.eq(0),
+                self.addr.eq(0),
+            ]
+        with m.Elif(timing.new_line):
+            m.d.pixel += [
+                self.x.eq(0),
+                x_part.eq(0),
+            ]
+            with m.If(y_part + down.denominator >= down.numerator):
+                m.d.pixel += y_part.eq(y_part + down.denominator - down.numerator)
+                with m.If(self.y == self.height - 1):
+                    m.d.pixel += [
+                        self.y.eq(0),
+                        self.row.eq(0),
+                        self.addr.eq(0),
+                    ]
+                with m.Else():
+                    m.d.pixel += [
+                        self.y.eq(self.y + 1),
+                        self.row.eq(self.row + self.width),
+                        self.addr.eq(self.row + self.width),
+                    ]
+            with m.Else():
+                # the same line again
+                m.d.pixel += [
+                    y_part.eq(y_part + down.denominator),
+                    self.addr.eq(self.row),
+                ]
+        with m.Elif(timing.active):
+            with m.If(x_part + across.denominator >= across.numerator):
+                m.d.pixel += x_part.eq(x_part + across.denominator - across.numerator)
+                with m.If(self.x == self.width - 1):
+                    m.d.pixel += [
+                        self.x.eq(0),
+                        self.addr.eq(self.row),
+                    ]
+                with m.Else():
+                    m.d.pixel += [
+                        self.x.eq(self.x + 1),
+                        self.addr.eq(self.addr + 1),
+                    ]
+            with m.Else():
+                m.d.pixel += x_part.eq(x_part + across.denominator)
+
+        return m
+
+
+def bench(resolution, color_depth, scale=(Fraction(5, 2), 3)):
+    from pixtolic.sources.still import Still, TestBench
+
+    timing = VgaTiming.warm(resolution, fast_forward=True)
+    still = Still(
+        timing,
+        color_depth=color_depth,
+        image=gradient(color_depth=color_depth),
+        scale=scale,
+    )
+    across, down = scale_factors(scale)
+
+    def check(capture):
+        # every screen pixel comes from the image pixel the DDA picks,
+        # one clock late like the Still's
+        image = np.array(still.init, dtype='uint32').reshape(still.height, still.width)
+        rows = source_index(np.arange(resolution.height), down, still.height)
+        columns = source_index(np.arange(resolution.width), across, still.width)
+        expected = image[rows][:, columns]
+        mismatches = np.count_nonzero(capture.buffer[:, :, 1:] != expected[:, :-1])
+        assert mismatches == 0, f'{mismatches} pixels differ from the scaled image'
+
+    return Bench(TestBench(timing, still), timing=timing, source=still, check=check)
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='scaler')
@@ -1,63 +1,100 @@
 from os import path
+import sys
 
 from nmigen import *
-from nmigen.sim.pysim import Simulator
 import numpy as np
 from PIL import Image
 
 from pixtolic.output.timing import VgaTiming
 from pixtolic.config.resolutions import resolutions, ResolutionName
 from pixtolic.host.testvec import gradient
+from pixtolic.sources.scaler import Scaler
+from pixtolic.sim.bench import Bench
+
+def image_words(image, color_depth):
+    # one memory word per pixel, red in the top bits
+    # needs uint32 to accomodate shifts
+    arr = np.array(image.convert('RGB'), dtype='uint32') >> (8 - color_depth)
+    rgb = (
+          arr[:,:,0] << (color_depth * 2)
+        | arr[:,:,1] << (color_depth * 1)
+        | arr[:,:,2] << (color_depth * 0)
+    )
+    return rgb.flatten().tolist()
 
 class Still(Elaboratable):
     
-    def __init__(self, timing, color_depth, image):
+    def __init__(self, timing, color_depth, image, init=None, writable=False, scale=1):
         self.timing = timing
         self.color_depth = color_depth
 
-        # needs uint32 to accomodate shifts
-        arr = np.array(image, dtype='uint32') // 16
-        self.init = self.to_rgb12(arr)
+        # `init` replaces the image contents (but not its size), e.g.
+        # with a placeholder to patch the image into later
+        self.init = self.image_words(image) if init is None else init
         self.width = image.width
         self.height = image.height
         self.pixcount = self.width * self.height
         
         self.memory = Memory(
-            width=self.color_depth * 3,
+            width=self.word_width,
             depth=self.pixcount,
             init=self.init,
         )
 
-        self.x = Signal(range(self.width))
-        self.y = Signal(range(self.height))
+        # each pixel is shown `scale` times across and down (see
+        # pixtolic.sources.scaler)
+        self.scaler = Scaler(timing, self.width, self.height, scale)
+        self.x = self.scaler.x
+        self.y = self.scaler.y
+        self.addr = self.scaler.addr
         self.red = Signal(self.color_depth)
         self.green = Signal(self.color_depth)
         self.blue = Signal(self.color_depth)
-        self.addr = Signal(range(self.pixcount))
 
-    def to_rgb12(self, arr):
-        rgb12 = (
-              arr[:,:,0] << (self.color_depth * 2)
-            | arr[:,:,1] << (self.color_depth * 1)
-            | arr[:,:,2] << (self.color_depth * 0)
-        )
-        return rgb12.flatten().tolist()
+        # with `writable`, pixels can be replaced while the image is
+        # showing through these, in the sync domain (see
+        # pixtolic.ui.image_loader)
+        self.writable = writable
+        self.write_addr = Signal(range(self.pixcount))
+        self.write_data = Signal(self.word_width)
+        self.write_en = Signal()
+        # writes always go straight in
+        self.write_ready = Const(1)
+
+    @property
+    def word_width(self):
+        # bits per pixel in memory
+        return self.color_depth * 3
+
+    def image_words(self, image):
+        return image_words(image, self.color_depth)
+
+    def color(self, m, word):
+        # the pixel's color (red in the top bits) from its memory word
+        return word
 
     def elaborate(self, platform):
         m = Module()
         
         rd_port = self.memory.read_port(domain='pixel')
         m.submodules += rd_port
-        m.d.comb += [
-            rd_port.addr.eq(self.addr),
-            self.addr.eq(self.y * self.width + self.x), 
-        ]
+        if self.writable:
+            wr_port = self.memory.write_port(domain='sync')
+            m.submodules += wr_port
+            m.d.comb += [
+                wr_port.addr.eq(self.write_addr),
+                wr_port.data.eq(self.write_data),
+                wr_port.en.eq(self.write_en),
+            ]
+        m.submodules.scaler = self.scaler
+        m.d.comb += rd_port.addr.eq(self.addr)
 
+        color = self.color(m, rd_port.data)
         with m.If(self.timing.active):
             m.d.comb += [
-                self.red.eq(rd_port.data[8:12]),
-                self.green.eq(rd_port.data[4:8]),
-                self.blue.eq(rd_port.data[0:4]),
+                self.red.eq(color[2*self.color_depth:3*self.color_depth]),
+                self.green.eq(color[self.color_depth:2*self.color_depth]),
+                self.blue.eq(color[0:self.color_depth]),
             ]
         with m.Else():
             m.d.comb += [
@@ -65,23 +102,6 @@ class Still(Elaboratable):
                 self.green.eq(0),
                 self.blue.eq(0),
             ]
-                
-        with m.If(self.timing.new_frame):
-            m.d.pixel += [
-                self.x.eq(0),
-                self.y.eq(0),
-            ]
-        with m.Elif(self.timing.new_line):
-            m.d.pixel += self.x.eq(0)
-            with m.If(self.y == self.height - 1):
-                m.d.pixel += self.y.eq(0)
-            with m.Else():
-                m.d.pixel += self.y.eq(self.y + 1)
-        with m.Elif(self.timing.active):
-            with m.If(self.x == self.width - 1):
-                m.d.pixel += self.x.eq(0)
-            with m.Else():
-                m.d.pixel += self.x.eq(self.x + 1)
 
         return m
 
@@ -100,20 +120,26 @@ class TestBench(Elaboratable):
 
         return m
 
-if __name__ == '__main__':
-    color_depth = 4
-    image = gradient(color_depth=color_depth)
-    timing = VgaTiming(resolutions[ResolutionName.VGA_640_480p_60hz])
-    dut = TestBench(
+def bench(resolution, color_depth):
+    timing = VgaTiming.warm(resolution, fast_forward=True)
+    still = Still(
         timing,
-        Still(timing, color_depth=color_depth, image=image),
+        color_depth=color_depth,
+        image=gradient(color_depth=color_depth),
     )
 
-    sim = Simulator(dut)
-    def proc():
-        for _ in range(800 * 40):
-            yield
-    sim.add_clock(1e-6, domain='pixel')
-    sim.add_sync_process(proc, domain='pixel')
-    with sim.write_vcd('still.vcd'):
-        sim.run()
+    def check(capture):
+        # the image repeats across the screen. the memory read takes a
+        # clock, so every pixel shows up one to the right and the
+        # first column shows whatever was addressed during blanking
+        image = np.array(still.init, dtype='uint32').reshape(still.height, still.width)
+        tiles = (-(-resolution.height // still.height), -(-resolution.width // still.width))
+        expected = np.tile(image, tiles)[:resolution.height, :resolution.width]
+        mismatches = np.count_nonzero(capture.buffer[:, :, 1:] != expected[:, :-1])
+        assert mismatches == 0, f'{mismatches} pixels differ from the image'
+
+    return Bench(TestBench(timing, still), timing=timing, source=still, check=check)
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='still')
@@ -0,0 +1,267 @@
+import sys
+
+from nmigen import *
+from nmigen.utils import bits_for
+import numpy as np
+
+from pixtolic.host.tiles import TILE, ball, render
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sim.bench import Bench
+from pixtolic.sources.scaler import Scaler
+
+
+class TileEngine(Elaboratable):
+
+    """A scene built out of 8x8 tiles, with sprites over it, like an
+    old games console. `tiles` (n, 8, 8) are indices into `palette`,
+    `tilemap` (rows, cols) says which tile goes in each cell, and the
+    scene, 8 * cols x 8 * rows pixels, is shown `scale` times across and
+    down, repeating if it doesn't fill the screen. Only the map and the
+    tiles take block RAM, so a whole screen costs a few kilobytes.
+
+    Up to `max_sprites` sprites, each one of the tiles at an (x, y) in
+    the scene, are drawn over the background, the first one on top and
+    with palette entry 0 transparent. Their positions come from a table
+    that is copied at the top of each frame, so moving one never tears
+    it; with `writable`, entries (see `sprite_entry`) can be written in
+    the `sync` domain through `write_addr`, `write_data` and
+    `write_en` (see pixtolic.ui.sprite_loader). While the screen is
+    blanked between lines, the row of each sprite on the next line is
+    read from the tiles into a register, so sprites take no block RAM
+    of their own. Coordinates wrap around, so a sprite can hang off the
+    top or left of the scene.
+
+    Each pixel comes out two clocks late, one more than a Still's.
+
+    """
+
+    def __init__(self, timing, color_depth, palette, tiles, tilemap, sprites=(),
+                 max_sprites=8, scale=1, writable=False):
+        self.timing = timing
+        self.color_depth = color_depth
+        self.palette = list(palette)
+        self.tiles = np.asarray(tiles)
+        self.tilemap = np.asarray(tilemap)
+        self.max_sprites = max_sprites
+        self.scale = scale
+        self.writable = writable
+        self.rows, self.cols = self.tilemap.shape
+        self.width = TILE * self.cols
+        self.height = TILE * self.rows
+        if len(sprites) > max_sprites:
+            raise ValueError(f'{len(sprites)} sprites, but only room for {max_sprites}')
+        # reading the sprites' rows between lines takes TILE clocks each
+        if TILE * max_sprites + 2 > timing.res.h.overscan:
+            raise ValueError(
+                f'{max_sprites} sprites take too long to read in the '
+                f'{timing.res.h.overscan} clocks between lines'
+            )
+
+        self.index_bits = bits_for(len(self.palette) - 1)
+        self.tile_bits = bits_for(len(self.tiles) - 1)
+        # enough to put a sprite out of sight
+        self.coord_bits = bits_for(max(self.width, self.height) + TILE)
+        self.hidden = (0, max(self.width, self.height), 0)
+        self.sprites = list(sprites) + [self.hidden] * (max_sprites - len(sprites))
+
+        self.red = Signal(self.color_depth)
+        self.green = Signal(self.color_depth)
+        self.blue = Signal(self.color_depth)
+
+        self.write_addr = Signal(range(max_sprites))
+        self.write_data = Signal(2 * self.coord_bits + self.tile_bits)
+        self.write_en = Signal()
+
+    def sprite_entry(self, x, y, tile):
+        """The sprite table word for a sprite at (`x`, `y`) showing
+        `tile`."""
+        mask = 2 ** self.coord_bits - 1
+        return (x & mask) | (y & mask) << self.coord_bits | tile << (2 * self.coord_bits)
+
+    def elaborate(self, platform):
+        m = Module()
+        timing, res = self.timing, self.timing.res
+        count, bits = self.max_sprites, self.coord_bits
+
+        # the background: a Scaler each for the pixels and the cells
+        # of the map keeps both addresses up to date with adders
+        m.submodules.pixels = pixels = Scaler(timing, self.width, self.height, self.scale)
+        m.submodules.cells = cells = Scaler(timing, self.cols, self.rows, TILE * self.scale)
+        tilemap = Memory(width=self.tile_bits, depth=self.tilemap.size, init=self.tilemap.flatten().tolist())
+        m.submodules.map_port = map_port = tilemap.read_port(domain='pixel')
+        tiles = Memory(width=self.index_bits, depth=self.tiles.size, init=self.tiles.flatten().tolist())
+        m.submodules.tile_port = tile_port = tiles.read_port(domain='pixel')
+        tile_x = Signal(3)
+        tile_y = Signal(3)
+        m.d.comb += map_port.addr.eq(cells.addr)
+        m.d.pixel += [
+            tile_x.eq(pixels.x[:3]),
+            tile_y.eq(pixels.y[:3]),
+        ]
+
+        # the sprite table, copied into registers at the top of each
+        # frame
+        table = Memory(
+            width=len(self.write_data),
+            depth=count,
+            init=[self.sprite_entry(*sprite) for sprite in self.sprites],
+        )
+        m.submodules.table_port = table_port = table.read_port(domain='pixel')
+        if self.writable:
+            m.submodules.table_write = table_write = table.write_port(domain='sync')
+            m.d.comb += [
+                table_write.addr.eq(self.write_addr),
+                table_write.data.eq(self.write_data),
+                table_write.en.eq(self.write_en),
+            ]
+        sprite_x = Array(Signal(bits, name=f'sprite{i}_x') for i in range(count))
+        sprite_y = Array(Signal(bits, name=f'sprite{i}_y') for i in range(count))
+        sprite_tile = Array(Signal(self.tile_bits, name=f'sprite{i}_tile') for i in range(count))
+        copy = Signal(range(count + 1), reset=count)
+        copied = Signal(range(count))
+        copying = Signal()
+        m.d.comb += table_port.addr.eq(copy)
+        m.d.pixel += [
+            copied.eq(copy),
+            copying.eq(copy != count),
+        ]
+        with m.If((timing.line_counter == 0) & (timing.scan_counter == 0)):
+            m.d.pixel += copy.eq(0)
+        with m.Elif(copy != count):
+            m.d.pixel += copy.eq(copy + 1)
+        with m.If(copying):
+            m.d.pixel += [
+                sprite_x[copied].eq(table_port.data[:bits]),
+                sprite_y[copied].eq(table_port.data[bits:2 * bits]),
+                sprite_tile[copied].eq(table_port.data[2 * bits:]),
+            ]
+
+        # the scene row on the next line, worked out at the end of
+        # each line the same way the Scaler does
+        row = Signal(bits)
+        repeat = Signal(range(self.scale))
+        end_of_line = Signal()
+        m.d.comb += end_of_line.eq(timing.scan_counter == res.h.prescan + res.width)
+        with m.If(end_of_line):
+            with m.If(timing.line_counter == res.v.prescan - 1):
+                m.d.pixel += [
+                    row.eq(0),
+                    repeat.eq(0),
+                ]
+            with m.Elif(repeat == self.scale - 1):
+                m.d.pixel += [
+                    row.eq(Mux(row == self.height - 1, 0, row + 1)),
+                    repeat.eq(0),
+                ]
+            with m.Else():
+                m.d.pixel += repeat.eq(repeat + 1)
+
+        # then each sprite's row on it, a pixel a clock, while the
+        # tiles aren't being read for the background
+        lines = [Signal(TILE * self.index_bits, name=f'sprite{i}_line') for i in range(count)]
+        fetch = Signal(range(TILE * count + 1), reset=TILE * count)
+        fetching = Signal()
+        sprite = Signal(range(count))
+        on_line = Signal()
+        offset = Signal(bits)
+        m.d.comb += [
+            fetching.eq(fetch != TILE * count),
+            offset.eq(row - sprite_y[fetch[3:]]),
+        ]
+        with m.If(end_of_line):
+            m.d.pixel += fetch.eq(0)
+        with m.Elif(fetching):
+            m.d.pixel += fetch.eq(fetch + 1)
+        with m.If(fetching):
+            m.d.comb += tile_port.addr.eq(Cat(fetch[:3], offset[:3], sprite_tile[fetch[3:]]))
+        with m.Else():
+            m.d.comb += tile_port.addr.eq(Cat(tile_x, tile_y, map_port.data))
+        fetched = Signal()
+        m.d.pixel += [
+            fetched.eq(fetching),
+            sprite.eq(fetch[3:]),
+            on_line.eq(offset < TILE),
+        ]
+        for i, line in enumerate(lines):
+            with m.If(fetched & (sprite == i)):
+                # the first pixel ends up at the bottom
+                m.d.pixel += line.eq(Cat(line[self.index_bits:], Mux(on_line, tile_port.data, 0)))
+
+        # the sprites' pixels at the scan, the first one that isn't
+        # transparent winning, lined up with the background
+        front = Const(0, self.index_bits)
+        for i, line in reversed(list(enumerate(lines))):
+            column = Signal(bits, name=f'sprite{i}_column')
+            m.d.comb += column.eq(pixels.x - sprite_x[i])
+            pixel = Mux(column < TILE, line.word_select(column[:3], self.index_bits), 0)
+            front = Mux(pixel != 0, pixel, front)
+        sprite_pixel = Signal(self.index_bits)
+        shown_pixel = Signal(self.index_bits)
+        m.d.pixel += [
+            sprite_pixel.eq(front),
+            shown_pixel.eq(sprite_pixel),
+        ]
+
+        palette = Memory(width=3 * self.color_depth, depth=len(self.palette), init=self.palette)
+        m.submodules.palette_port = palette_port = palette.read_port(domain='comb')
+        m.d.comb += palette_port.addr.eq(Mux(shown_pixel != 0, shown_pixel, tile_port.data))
+        color = palette_port.data
+        with m.If(timing.active):
+            m.d.comb += [
+                self.red.eq(color[2*self.color_depth:3*self.color_depth]),
+                self.green.eq(color[self.color_depth:2*self.color_depth]),
+                self.blue.eq(color[0:self.color_depth]),
+            ]
+
+        return m
+
+
+class TestBench(Elaboratable):
+    def __init__(self, timing, engine):
+        self.timing = timing
+        self.engine = engine
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += [
+            self.timing,
+            self.engine,
+        ]
+        return m
+
+
+def scene(color_depth, cols, rows, count=12, seed=0):
+    # random tiles and map, with a ball for sprites as tile 0
+    rng = np.random.RandomState(seed)
+    palette = rng.randint(0, 2 ** (3 * color_depth), 16).tolist()
+    tiles = np.concatenate([[ball(15)], rng.randint(0, 16, (count - 1, TILE, TILE))])
+    tilemap = rng.randint(0, count, (rows, cols))
+    return palette, tiles, tilemap
+
+
+def bench(resolution, color_depth, scale=2):
+    # a random scene, a little smaller than the screen so it repeats,
+    # with sprites over each other, off the edges and across tiles
+    timing = VgaTiming(resolution)
+    cols = resolution.width // (TILE * scale) - 1
+    rows = resolution.height // (TILE * scale) - 1
+    palette, tiles, tilemap = scene(color_depth, cols, rows)
+    sprites = [(3, 2, 0), (7, 5, 0), (8 * cols - 4, 12, 3), (20, 8 * rows - 5, 0), (13, 13, 5)]
+    engine = TileEngine(timing, color_depth, palette, tiles, tilemap, sprites=sprites, scale=scale)
+
+    def check(capture):
+        image = render(palette, tiles, tilemap, sprites)
+        rows = np.arange(resolution.height) // scale % image.shape[0]
+        columns = np.arange(resolution.width) // scale % image.shape[1]
+        expected = image[rows][:, columns]
+        # two clocks behind
+        for number, captured in enumerate(capture.buffer):
+            mismatches = np.count_nonzero(captured[:, 2:] != expected[:, :-2])
+            assert mismatches == 0, f'{mismatches} pixels of frame {number} differ from the scene'
+
+    return Bench(TestBench(timing, engine), timing=timing, source=engine, check=check)
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='tiles')
@@ -1,22 +1,126 @@
+import argparse
+from fractions import Fraction
+import os
 from os import path
+import tempfile
 
 from nmigen import *
+from nmigen.build.run import LocalBuildProducts
 from nmigen_boards.icebreaker import ICEBreakerPlatform
 from PIL import Image
 
+from pixtolic.buildcache import BuildCache
 from pixtolic.config.resolutions import ResolutionName, resolutions
 from pixtolic.output.timing import VgaTiming
+from pixtolic.host.compiler import compile_program
+from pixtolic.host.tiles import ball, brightest, tileset
+from pixtolic.processors.fixed import FixedProcessor
+from pixtolic.processors.ppu import PixelProcessor
+from pixtolic.sources.flash import FlashStream
+from pixtolic.sources.framebuffer import Framebuffer
+from pixtolic.sources.indexed import IndexedStill
 from pixtolic.sources.patterns import TestPattern
-from pixtolic.sources.still import Still
-from pixtolic.ui.uart import UARTLoopback
+from pixtolic.sources.still import Still, image_words
+from pixtolic.sources.tiles import TileEngine
+from pixtolic.ui.image_loader import ImageLoader
+from pixtolic.ui.loader import ProgramLoader
+from pixtolic.ui.packet import PacketReceiver
+from pixtolic.ui.sprite_loader import SpriteLoader
+from pixtolic.ui.uart import DEFAULT_BAUD_RATE, UART, baud_rates
 
+from pixtolic.device import icebram
 from pixtolic.device.iCE40 import iCE40PLL
 from pixtolic.device.icebreaker import vga_pmod
 
 
+IMAGE = path.join(
+    path.dirname(__file__),
+    '../resources/RGB_12bits_parrot.png',
+)
+
+# image sizes that fit in about the same block RAM as the 100x75 one
+# at 12 bits per pixel, by palette size
+PALETTE_IMAGE_SIZES = {
+    16: (160, 120),
+    64: (140, 105),
+}
+
+# a framebuffer in SPRAM is twice the size each way
+FRAMEBUFFER_IMAGE_SIZE = (200, 150)
+
+# images streamed from the SPI flash are only limited by how fast it
+# reads, which is enough for every pixel shown twice each way
+FLASH_IMAGE_SIZE = (400, 300)
+FLASH_SCALE = 2
+
+# a scene of tiles, shown twice the size, and how many different tiles
+# it can use
+TILES_SCENE_SIZE = (400, 304)
+TILES_SCALE = 2
+MAX_TILES = 128
+
+
 class PixtolicTop(Elaboratable):
-    def __init__(self, color_depth):
+    def __init__(self, color_depth, image_file=IMAGE, image_size=(100, 75),
+                 placeholder=False, ppu_lanes=None, ppu_pipeline=0, fixed_program=None,
+                 baud_rate=DEFAULT_BAUD_RATE, palette=None, framebuffer=False,
+                 flash_frames=None, flash_hold=1, tiles=False):
         self.color_depth = color_depth
+        self.image_file = image_file
+        self.image_size = image_size
+        # build with random words in the Still's memory instead of the
+        # image, so images can be patched into the bitstream later
+        self.placeholder = placeholder
+        # show the pixel processor instead of the test pattern
+        self.ppu_lanes = ppu_lanes
+        self.ppu_pipeline = ppu_pipeline
+        # or instead, this program (instruction words) built into logic
+        self.fixed_program = fixed_program
+        self.baud_rate = baud_rate
+        # store palette indices for the image instead of colors, with
+        # a palette of this many
+        self.palette = palette
+        # show a double-buffered image in SPRAM, drawn over the UART,
+        # instead of the one in block RAM
+        self.framebuffer = framebuffer
+        # or this many frames streamed from the SPI flash, each shown
+        # for `flash_hold` frames
+        self.flash_frames = flash_frames
+        self.flash_hold = flash_hold
+        # or the image cut into tiles, with sprites over it that move
+        # over the UART
+        self.tiles = tiles
+
+    def params(self):
+        # everything the design depends on besides the source code and
+        # the image contents, for the build cache
+        return {
+            'color_depth': self.color_depth,
+            'image_size': list(self.image_size),
+            'placeholder': self.placeholder,
+            'ppu_lanes': self.ppu_lanes,
+            'ppu_pipeline': self.ppu_pipeline,
+            'fixed_program': self.fixed_program,
+            'baud_rate': self.baud_rate,
+            'palette': self.palette,
+            'framebuffer': self.framebuffer,
+            'flash_frames': self.flash_frames,
+            'flash_hold': self.flash_hold,
+            'tiles': self.tiles,
+        }
+
+    def files(self):
+        if self.placeholder or self.framebuffer or self.flash_frames:
+            return []
+        return [self.image_file]
+
+    def image_words(self, image_file):
+        image = Image.open(image_file).resize(self.image_size)
+        return image_words(image, self.color_depth)
+
+    def placeholder_words(self):
+        width, height = self.image_size
+        return icebram.placeholder(width * height, 3 * self.color_depth)
 
     def elaborate(self, platform):
         m = Module()
@@ -48,18 +152,103 @@ class PixtolicTop(Elaboratable):
         platform.add_clock_constraint(pll.clk_pin, res.pixclk_freq)
 
         m.submodules.vga_timing = vga_timing = VgaTiming(res)
-        m.submodules.test_pattern = test_pattern = TestPattern(vga_timing, color_depth=self.color_depth)
+        # stretch the image to fill the screen
+        width, height = self.image_size
+        scale = (Fraction(res.width, width), Fraction(res.height, height))
+        if self.fixed_program is not None:
+            m.submodules.fixed = pattern = FixedProcessor(
+                vga_timing,
+                self.fixed_program,
+                pixel_depth=self.color_depth,
+                pipeline=self.ppu_pipeline,
+            )
+        elif self.ppu_lanes:
+            m.submodules.ppu = pattern = PixelProcessor(
+                vga_timing,
+                num_pixels=self.ppu_lanes,
+                pixel_depth=self.color_depth,
+                pipeline=self.ppu_pipeline,
+                loadable=True,
+            )
+        else:
+            m.submodules.test_pattern = pattern = TestPattern(vga_timing, color_depth=self.color_depth)
 
-        fname = path.join(
-            path.dirname(__file__),
-            '../resources/RGB_12bits_parrot.png',
-        )
-        image = Image.open(fname).resize((100, 75))
-        m.submodules.still = still = Still(
-            timing=vga_timing,
-            color_depth=self.color_depth,
-            image=image,
-        )
+        if self.tiles:
+            image = Image.open(self.image_file).convert('RGB').resize(self.image_size)
+            # the ball is tile 0, for pixtolic.host.sprites
+            palette, tiles, tilemap = tileset(image, self.color_depth, MAX_TILES, first=1)
+            tiles = [ball(brightest(palette, self.color_depth))] + list(tiles)
+            m.submodules.still = still = TileEngine(
+                timing=vga_timing,
+                color_depth=self.color_depth,
+                palette=palette,
+                tiles=tiles,
+                tilemap=tilemap,
+                sprites=[(24 + 48 * i, 24, 0) for i in range(8)],
+                scale=TILES_SCALE,
+                writable=True,
+            )
+        elif self.flash_frames:
+            m.submodules.still = still = FlashStream(
+                timing=vga_timing,
+                color_depth=self.color_depth,
+                width=width,
+                height=height,
+                scale=FLASH_SCALE,
+                frames=self.flash_frames,
+                hold=self.flash_hold,
+            )
+            # every pin is registered in its I/O cell, and the clock
+            # pulses in the second half of each pixel clock from a DDR
+            # one, which has another register in front of it. so
+            # everything reaches the flash a clock late together, the
+            # way pixtolic.sim.flash models it
+            flash_pads = platform.request('spi_flash_4x', xdr={'cs': 1, 'clk': 2, 'dq': 1})
+            m.d.comb += [
+                flash_pads.cs.o_clk.eq(ClockSignal('pixel')),
+                flash_pads.cs.o.eq(still.cs),
+                flash_pads.clk.o_clk.eq(ClockSignal('pixel')),
+                flash_pads.clk.o0.eq(0),
+                flash_pads.clk.o1.eq(still.sck),
+                flash_pads.dq.o_clk.eq(ClockSignal('pixel')),
+                flash_pads.dq.i_clk.eq(ClockSignal('pixel')),
+                flash_pads.dq.o.eq(still.dq_o),
+                flash_pads.dq.oe.eq(still.dq_oe),
+                still.dq_i.eq(flash_pads.dq.i),
+            ]
+        elif self.framebuffer:
+            m.submodules.still = still = Framebuffer(
+                timing=vga_timing,
+                color_depth=self.color_depth,
+                width=width,
+                height=height,
+                scale=scale,
+            )
+        elif self.palette:
+            m.submodules.still = still = IndexedStill(
+                timing=vga_timing,
+                color_depth=self.color_depth,
+                image=Image.open(self.image_file).resize(self.image_size),
+                colors=self.palette,
+                scale=scale,
+            )
+        elif self.placeholder:
+            m.submodules.still = still = Still(
+                timing=vga_timing,
+                color_depth=self.color_depth,
+                image=Image.new('RGB', self.image_size),
+                init=self.placeholder_words(),
+                writable=True,
+                scale=scale,
+            )
+        else:
+            m.submodules.still = still = Still(
+                timing=vga_timing,
+                color_depth=self.color_depth,
+                image=Image.open(self.image_file).resize(self.image_size),
+                writable=True,
+                scale=scale,
+            )
 
         m.d.comb += [
             vga_pads.hsync.eq(vga_timing.hsync),
@@ -74,16 +263,30 @@ class PixtolicTop(Elaboratable):
             ]
         with m.Else():
             m.d.comb += [
-                vga_pads.red.eq(test_pattern.red),
-                vga_pads.green.eq(test_pattern.green),
-                vga_pads.blue.eq(test_pattern.blue),
+                vga_pads.red.eq(pattern.red),
+                vga_pads.green.eq(pattern.green),
+                vga_pads.blue.eq(pattern.blue),
             ]
 
-        m.submodules.uart = uart = UARTLoopback(
+        m.submodules.uart = uart = UART(
             uart_pads,
             clk_freq=12e6,
-            baud_rate=115200,
+            baud_rate=self.baud_rate,
+            fifo_depth=16,
         )
+        m.submodules.packets = packets = PacketReceiver(uart)
+        if self.tiles:
+            # sprite positions come in over the UART, see
+            # pixtolic.host.sprites
+            m.submodules.sprite_loader = SpriteLoader(packets, still)
+        elif not (self.palette or self.flash_frames):
+            # new images for the Still or framebuffer come in over the
+            # UART, see pixtolic.host.show
+            m.submodules.image_loader = ImageLoader(packets, still)
+        if self.ppu_lanes and self.fixed_program is None:
+            # and programs for the pixel processor, see
+            # pixtolic.host.upload
+            m.submodules.loader = ProgramLoader(packets, pattern)
         m.d.comb += [
             leds.eq(uart.rx_data[0:2]),
         ]
@@ -91,9 +294,120 @@ class PixtolicTop(Elaboratable):
         return m
 
 
+def swap_image(top, products, image_file, bin_file, name='top'):
+    # write `image_file` over the placeholder in a build of `top`
+    asc = icebram.patch(
+        products.get(f'{name}.asc', 't'),
+        top.placeholder_words(),
+        top.image_words(image_file),
+        width=3 * top.color_depth,
+    )
+    icebram.pack(asc, bin_file)
+
+
 if __name__ == '__main__':
-    top = PixtolicTop(color_depth=4)
+    p = argparse.ArgumentParser(prog='python -m pixtolic.top')
+    p.add_argument('--no-cache', action='store_true',
+                   help='always run the whole toolchain')
+    p.add_argument('--cache-dir', help='where to keep cached builds')
+    p.add_argument('--image', action='append',
+                   help='image to show when the button is pressed (repeatable with --output-dir)')
+    p.add_argument('--patch', action='store_true',
+                   help='build once with a placeholder image and write images '
+                        'straight into the bitstream, skipping synthesis and place and route')
+    p.add_argument('--ppu-lanes', type=int,
+                   help='show the pixel processor with this many lanes instead of the test pattern')
+    p.add_argument('--ppu-pipeline', type=int, default=0, choices=(0, 1, 2),
+                   help='pipeline depth of the pixel processor\'s ALUs')
+    p.add_argument('--fixed', metavar='PROGRAM',
+                   help="build this pixel program (e.g. 'out = x ^ y') into logic instead "
+                        "of running it on the pixel processor")
+    p.add_argument('--baud', type=int, default=DEFAULT_BAUD_RATE,
+                   help='UART baud rate (default: %(default)s). rates that divide the 12 MHz '
+                        'clock exactly are best: ' + ', '.join(f'{rate:g}' for rate in baud_rates(12e6)[:6]))
+    p.add_argument('--palette', type=int, choices=sorted(PALETTE_IMAGE_SIZES),
+                   help='store the image as indices into a palette of this many colors, '
+                        'which fits a bigger image')
+    p.add_argument('--framebuffer', action='store_true',
+                   help=f'show a {FRAMEBUFFER_IMAGE_SIZE[0]}x{FRAMEBUFFER_IMAGE_SIZE[1]} '
+                        'double-buffered image in SPRAM, sent with pixtolic.host.show '
+                        '--double-buffered, instead of the image in block RAM')
+    p.add_argument('--flash', type=int, metavar='FRAMES',
+                   help=f'show this many {FLASH_IMAGE_SIZE[0]}x{FLASH_IMAGE_SIZE[1]} frames '
+                        'streamed from the SPI flash, written there with pixtolic.host.flash, '
+                        'instead of the image in block RAM')
+    p.add_argument('--flash-hold', type=int, default=4,
+                   help='with --flash, show each frame this many times (default: %(default)s)')
+    p.add_argument('--tiles', action='store_true',
+                   help=f'cut the image into tiles for a {TILES_SCENE_SIZE[0]}x{TILES_SCENE_SIZE[1]} '
+                        'scene with sprites over it, moved with pixtolic.host.sprites')
+    p.add_argument('--output-dir',
+                   help='with --patch, write a bitstream for each --image here '
+                        'instead of programming the board')
+    args = p.parse_args()
+    images = args.image or [IMAGE]
+    if args.output_dir is None and len(images) > 1:
+        p.error('more than one --image needs --output-dir')
+    if args.output_dir is not None and not args.patch:
+        p.error('--output-dir needs --patch')
+    if args.patch and args.palette:
+        # the palette is in logic, which icebram can't patch
+        p.error('--patch only works without --palette')
+    if args.framebuffer and (args.patch or args.palette):
+        p.error('--framebuffer doesn\'t use an image built into the bitstream, '
+                'so it can\'t go with --patch or --palette')
+    if args.flash and (args.patch or args.palette or args.framebuffer):
+        p.error('--flash can\'t go with --patch, --palette or --framebuffer')
+    if args.tiles and (args.patch or args.palette or args.framebuffer or args.flash):
+        p.error('--tiles can\'t go with --patch, --palette, --framebuffer or --flash')
+
+    top = PixtolicTop(
+        color_depth=4,
+        image_file=images[0],
+        placeholder=args.patch,
+        ppu_lanes=args.ppu_lanes,
+        ppu_pipeline=args.ppu_pipeline,
+        fixed_program=compile_program(args.fixed) if args.fixed else None,
+        baud_rate=args.baud,
+        palette=args.palette,
+        framebuffer=args.framebuffer,
+        flash_frames=args.flash,
+        flash_hold=args.flash_hold,
+        tiles=args.tiles,
+        image_size=(
+            TILES_SCENE_SIZE if args.tiles
+            else FLASH_IMAGE_SIZE if args.flash
+            else FRAMEBUFFER_IMAGE_SIZE if args.framebuffer
+            else PALETTE_IMAGE_SIZES.get(args.palette, (100, 75))
+        ),
+    )
     platform = ICEBreakerPlatform()
     platform.add_resources(vga_pmod)
-    products = platform.build(top, do_build=True, do_program=False)
-    platform.toolchain_program(products, 'top')
+    # let yosys put the ALUs' multipliers in the DSP blocks
+    synth_opts = '-dsp'
+    if args.no_cache:
+        products = platform.build(top, do_build=True, do_program=False, synth_opts=synth_opts)
+    else:
+        cache = BuildCache(args.cache_dir) if args.cache_dir else BuildCache()
+        products = cache.build(
+            platform,
+            top,
+            'top',
+            params=top.params(),
+            files=top.files(),
+            synth_opts=synth_opts,
+        )
+
+    if not args.patch:
+        platform.toolchain_program(products, 'top')
+    elif args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for image_file in images:
+            root, _ = path.splitext(path.basename(image_file))
+            bin_file = path.join(args.output_dir, f'{root}.bin')
+            swap_image(top, products, image_file, bin_file)
+            print('wrote', bin_file)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            swap_image(top, products, images[0], path.join(tmp, 'top.bin'))
+            platform.toolchain_program(LocalBuildProducts(tmp), 'top')
@@ -0,0 +1,385 @@
+# replaces the image shown by a writable Still while it runs. an IMAGE
+# packet (see pixtolic.ui.packet) starts with the address of its first
+# pixel, two bytes least significant first, followed by tokens of one
+# byte each, with the top two bits saying what the rest means:
+#
+#     00nnnnnn            the previous pixel again, n + 1 times
+#     01rrggbb            the previous pixel with rr - 2 added to red,
+#                         gg - 2 to green and bb - 2 to blue
+#     10nnnnnn            leave the next n + 1 pixels as they are
+#     11hhhhhh llllllll   a pixel of hhhhhhllllllll, which takes a
+#                         second byte
+#
+# the previous pixel is the last one written by the packet, or 0 at
+# its start, so every packet can be decoded on its own. skipping
+# pixels is what makes an update small when most of the image stays
+# the same, and runs and small differences do the same for flat or
+# smooth parts of an image. pixels are written as they are decoded, so
+# a packet that turns out to be corrupted has already written garbage
+# by the time it is answered with NAK, and with a broken address or
+# SKIP count that can be anywhere in the image, not just where the
+# packet was going. so after a NAK the host sends the whole image
+# again, without SKIP tokens. one that runs past the end of the image
+# is answered with NAK too. pixtolic.host.show is the other end.
+#
+# a Framebuffer takes the same packets, into the buffer that isn't
+# shown, and an empty SHOW packet to swap the buffers once a whole
+# image is in.
+
+import sys
+
+from nmigen import *
+import numpy as np
+from PIL import Image
+
+from pixtolic.host.testvec import gradient
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sim import uart as sim_uart
+from pixtolic.sim.bench import Bench
+from pixtolic.sources.still import Still, image_words
+from pixtolic.ui.packet import ACK, NAK, TestBench, harness, packet
+
+
+IMAGE = ord('I')
+SHOW = ord('F')
+RUN = 0b00
+DIFF = 0b01
+SKIP = 0b10
+LITERAL = 0b11
+MAX_COUNT = 64
+LITERAL_BITS = 14
+
+
+def _channels(word, color_depth):
+    mask = 2 ** color_depth - 1
+    return [(word >> (color_depth * shift)) & mask for shift in (2, 1, 0)]
+
+
+def _diff(word, previous, color_depth):
+    # the DIFF token taking `previous` to `word`, if there is one
+    token = DIFF << 6
+    for shift, (a, b) in zip((4, 2, 0), zip(_channels(word, color_depth), _channels(previous, color_depth))):
+        delta = (a - b + 2) % 2 ** color_depth
+        if delta > 3:
+            return None
+        token |= delta << shift
+    return token
+
+
+def encode(words, previous=None, color_depth=4):
+    """Tokens that turn `previous` (or whatever is in memory, if None)
+    into `words`, starting with a previous pixel of 0."""
+    out = bytearray()
+    last = 0
+    i = 0
+    while i < len(words):
+        if previous is not None and words[i] == previous[i]:
+            n = 1
+            while i + n < len(words) and n < MAX_COUNT and words[i + n] == previous[i + n]:
+                n += 1
+            out.append(SKIP << 6 | n - 1)
+        elif words[i] == last:
+            n = 1
+            while i + n < len(words) and n < MAX_COUNT and words[i + n] == last:
+                n += 1
+            out.append(RUN << 6 | n - 1)
+        else:
+            n = 1
+            token = _diff(words[i], last, color_depth)
+            if token is None:
+                out += (LITERAL << 14 | words[i]).to_bytes(2, 'big')
+            else:
+                out.append(token)
+            last = words[i]
+        i += n
+    return bytes(out)
+
+
+def decode(data, words, start, color_depth=4):
+    """Apply the tokens in `data` to the pixels `words` from `start`
+    on, like the ImageLoader does."""
+    last = 0
+    addr = start
+    i = 0
+
+    def write(word):
+        nonlocal addr, last
+        words[addr] = last = word
+        addr += 1
+
+    while i < len(data):
+        kind, arg = data[i] >> 6, data[i] & 0x3F
+        i += 1
+        if kind == RUN:
+            for _ in range(arg + 1):
+                write(last)
+        elif kind == DIFF:
+            channels = [
+                (c + ((arg >> shift) & 3) - 2) % 2 ** color_depth
+                for c, shift in zip(_channels(last, color_depth), (4, 2, 0))
+            ]
+            write(channels[0] << 2 * color_depth | channels[1] << color_depth | channels[2])
+        elif kind == SKIP:
+            addr += arg + 1
+        else:
+            write((arg << 8 | data[i]) & (2 ** (3 * color_depth) - 1))
+            i += 1
+    return words
+
+
+def image_payloads(words, previous=None, color_depth=4, chunk=4096):
+    """IMAGE packet payloads updating the pixels from `previous` to
+    `words`, `chunk` pixels at a time. Chunks with nothing to change
+    aren't sent at all."""
+    payloads = []
+    for start in range(0, len(words), chunk):
+        end = start + chunk
+        if previous is not None and list(words[start:end]) == list(previous[start:end]):
+            continue
+        tokens = encode(
+            words[start:end],
+            None if previous is None else previous[start:end],
+            color_depth,
+        )
+        payloads.append(start.to_bytes(2, 'little') + tokens)
+    return payloads
+
+
+class ImageLoader(Elaboratable):
+
+    """Takes IMAGE packets from `receiver` and writes them into
+    `target`, which is a Still built with `writable=True` or a
+    Framebuffer. For a Framebuffer, SHOW packets (with no payload) show
+    what has been written. Runs in the `sync` domain, like the UART."""
+
+    def __init__(self, receiver, target):
+        if 3 * target.color_depth > LITERAL_BITS:
+            raise ValueError(
+                f'{3 * target.color_depth}-bit pixels are wider than the '
+                f'{LITERAL_BITS} bits a literal can carry'
+            )
+        self.receiver = receiver
+        self.channel = receiver.channel(IMAGE)
+        self.show_channel = receiver.channel(SHOW) if hasattr(target, 'show') else None
+        self.target = target
+        self.addr = Signal(16)
+        self.last = Signal(3 * target.color_depth)
+        self.count = Signal(6)
+        self.high = Signal(6)
+        self.reject = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        receiver, channel, target = self.receiver, self.channel, self.target
+        depth = target.color_depth
+        data = receiver.data
+        # a payload byte is taken only once the target can take a write
+        taken = channel.valid & target.write_ready
+        ended = Signal()
+
+        m.d.comb += channel.reject.eq(self.reject)
+        with m.If(channel.end):
+            m.d.sync += ended.eq(1)
+
+        def write(word):
+            m.d.comb += [
+                target.write_addr.eq(self.addr),
+                target.write_data.eq(word),
+                target.write_en.eq(self.addr < target.pixcount),
+            ]
+            m.d.sync += [
+                self.addr.eq(self.addr + 1),
+                self.last.eq(word),
+            ]
+            with m.If(self.addr >= target.pixcount):
+                m.d.sync += self.reject.eq(1)
+
+        def take(next_state):
+            # the next byte of the payload, or if the packet ended
+            # before it, refuse it
+            m.d.comb += [
+                channel.busy.eq(1),
+                channel.ready.eq(target.write_ready),
+            ]
+            with m.If(taken):
+                m.next = next_state
+            with m.Elif(ended):
+                m.d.sync += self.reject.eq(1)
+                m.next = 'IDLE'
+
+        # the previous pixel with a DIFF token's differences added
+        diffed = Cat(*(
+            (self.last[depth * shift:depth * (shift + 1)] + data[2 * shift:2 * shift + 2] - 2)[:depth]
+            for shift in (0, 1, 2)
+        ))
+
+        with m.FSM():
+            with m.State('IDLE'):
+                with m.If(channel.start):
+                    m.d.sync += [
+                        self.last.eq(0),
+                        self.reject.eq(0),
+                        ended.eq(0),
+                    ]
+                    m.next = 'ADDR_LO'
+
+            with m.State('ADDR_LO'):
+                with m.If(taken):
+                    m.d.sync += self.addr[:8].eq(data)
+                take('ADDR_HI')
+
+            with m.State('ADDR_HI'):
+                with m.If(taken):
+                    m.d.sync += self.addr[8:].eq(data)
+                take('TOKEN')
+
+            with m.State('TOKEN'):
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    channel.ready.eq(target.write_ready),
+                ]
+                with m.If(taken):
+                    with m.Switch(data[6:]):
+                        with m.Case(RUN):
+                            m.d.sync += self.count.eq(data[:6])
+                            m.next = 'RUN'
+                        with m.Case(DIFF):
+                            write(diffed)
+                        with m.Case(SKIP):
+                            skipped = self.addr + data[:6] + 1
+                            m.d.sync += self.addr.eq(skipped)
+                            with m.If(skipped > target.pixcount):
+                                m.d.sync += self.reject.eq(1)
+                        with m.Case(LITERAL):
+                            m.d.sync += self.high.eq(data[:6])
+                            m.next = 'LITERAL'
+                with m.Elif(ended):
+                    m.next = 'IDLE'
+
+            with m.State('LITERAL'):
+                with m.If(taken):
+                    write(Cat(data, self.high)[:len(self.last)])
+                take('TOKEN')
+
+            with m.State('RUN'):
+                m.d.comb += channel.busy.eq(1)
+                with m.If(target.write_ready):
+                    write(self.last)
+                    m.d.sync += self.count.eq(self.count - 1)
+                    with m.If(self.count == 0):
+                        m.next = 'TOKEN'
+
+        if self.show_channel is not None:
+            self.show(m)
+
+        return m
+
+    def show(self, m):
+        channel, receiver, target = self.show_channel, self.receiver, self.target
+        # SHOW has no payload, and is refused if there is one
+        rejected = Signal()
+        m.d.comb += [
+            channel.ready.eq(1),
+            channel.reject.eq(rejected),
+        ]
+        with m.If(channel.start):
+            m.d.sync += rejected.eq(receiver.length != 0)
+        swapped = Signal()
+        with m.FSM():
+            with m.State('IDLE'):
+                with m.If(channel.end & receiver.crc_ok & ~rejected):
+                    m.next = 'SHOW'
+
+            with m.State('SHOW'):
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    target.show.eq(1),
+                ]
+                with m.If(target.write_ready):
+                    m.d.sync += swapped.eq(target.swapped)
+                    m.next = 'SWAP'
+
+            # the reply waits for the swap, so the host doesn't send
+            # the next image while it couldn't be written and would
+            # overflow the UART
+            with m.State('SWAP'):
+                m.d.comb += channel.busy.eq(1)
+                with m.If(target.swapped != swapped):
+                    m.next = 'IDLE'
+
+
+def bench(resolution, color_depth):
+    # replaces a 16x16 gradient in a Still with the same gradient upside
+    # down, except for a flat block and some noise, in packets of 128
+    # pixels. the last one is sent with its address broken, which
+    # writes it somewhere else, and is NAKed, so the whole image is sent
+    # again the way pixtolic.host.show does. the rest of the frame
+    # after the last reply should show the new image
+    timing = VgaTiming.warm(resolution)
+    # the same size at every color depth, so there's more than one
+    # packet and room for the changes below
+    old = gradient(color_depth=color_depth).resize((16, 16), Image.NEAREST)
+    still = Still(timing, color_depth=color_depth, image=old, writable=True)
+    divisor = 4
+    serial, uart, receiver = harness(divisor)
+    loader = ImageLoader(receiver, still)
+
+    rng = np.random.RandomState(0)
+    new = np.array(old)[::-1].copy()
+    new[2:6, 3:12] = (255, 0, 128)
+    new[10:12] = rng.randint(0, 256, new[10:12].shape)
+    previous = image_words(old, color_depth)
+    words = image_words(Image.fromarray(new), color_depth)
+    payloads = image_payloads(words, previous, color_depth, chunk=128)
+    bad = bytearray(packet(IMAGE, payloads[-1]))
+    # the low byte of the address, 128 -> 0 or 0 -> 128
+    bad[4] ^= 0x80
+    resent = image_payloads(words, None, color_depth, chunk=128)
+    # and one that skips past the end of the image, which writes
+    # nothing and is NAKed as well
+    overrun = packet(IMAGE, (len(words) - 1).to_bytes(2, 'little') + bytes([SKIP << 6 | 1]))
+    sent = [overrun] + [packet(IMAGE, payload) for payload in payloads[:-1]] + [bytes(bad)]
+    sent += [packet(IMAGE, payload) for payload in resent]
+    replies = []
+    done = []
+
+    def upload():
+        for data in sent:
+            yield from sim_uart.send(serial, data, divisor)
+            replies.append((yield from sim_uart.receive(serial, divisor, timeout=200 * divisor)))
+        done.append((yield timing.line_counter) - resolution.v.prescan)
+
+    def check(capture):
+        expected_replies = (
+            [bytes([NAK])]
+            + [bytes([ACK])] * (len(payloads) - 1)
+            + [bytes([NAK])]
+            + [bytes([ACK])] * len(resent)
+        )
+        assert replies == expected_replies, f'expected {expected_replies}, got {replies}'
+        decoded = list(previous)
+        for payload in payloads:
+            decode(payload[2:], decoded, int.from_bytes(payload[:2], 'little'), color_depth)
+        assert decoded == words, 'the payloads decode to something else than the new image'
+        image = np.array(words, dtype='uint32').reshape(still.height, still.width)
+        tiles = (-(-resolution.height // still.height), -(-resolution.width // still.width))
+        expected = np.tile(image, tiles)[:resolution.height, :resolution.width]
+        first = done[0] + 1
+        # the memory read takes a clock, as in the Still bench
+        mismatches = np.count_nonzero(capture.buffer[0, first:, 1:] != expected[first:, :-1])
+        mismatches += np.count_nonzero(capture.buffer[1:, :, 1:] != expected[:, :-1])
+        assert mismatches == 0, f'{mismatches} pixels differ from the new image'
+
+    return Bench(
+        TestBench(timing, still, uart, receiver, loader),
+        timing=timing,
+        source=still,
+        processes=[upload],
+        domains=('sync', 'pixel'),
+        check=check,
+    )
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='image_loader')
@@ -0,0 +1,206 @@
+# loads pixel programs sent by the host over the UART into a running
+# PixelProcessor. a PROGRAM packet (see pixtolic.ui.packet) carries
+# instruction words of WORD_BYTES bytes each, least significant byte
+# first, and is answered with ACK once every word has been handed to
+# the processor, or with NAK if the CRC doesn't match, the payload
+# isn't a whole number of words or there are more than the processor
+# has room for. the words are kept in the loader until the CRC has
+# been checked and only then handed to the processor, so a bad packet
+# never touches the running program, or one that was accepted but
+# hasn't been switched to yet. the switch happens at the top of the
+# next frame.
+# pixtolic.host.upload is the other end.
+
+import sys
+
+from nmigen import *
+import numpy as np
+
+from pixtolic.host.compiler import compile_program
+from pixtolic.host.emulator import PixelEmulator
+from pixtolic.output.timing import VgaTiming
+from pixtolic.processors.alu import pixel_instruction_layout
+from pixtolic.processors.ppu import PixelProcessor, default_program
+from pixtolic.sim import uart as sim_uart
+from pixtolic.sim.bench import Bench
+from pixtolic.sim.fastforward import sleep
+from pixtolic.ui.packet import ACK, NAK, TestBench, harness, packet
+from pixtolic.util import layout_width
+
+
+PROGRAM = ord('P')
+WORD_BYTES = (layout_width(pixel_instruction_layout) + 7) // 8
+
+
+class ProgramLoader(Elaboratable):
+
+    """Takes PROGRAM packets from `receiver` and writes them into
+    `ppu`, which has to be built with `loadable=True`. Runs in the
+    `sync` domain, like the UART."""
+
+    def __init__(self, receiver, ppu):
+        self.receiver = receiver
+        self.channel = receiver.channel(PROGRAM)
+        self.ppu = ppu
+        self.addr = Signal(range(ppu.instruction_depth + 1))
+        self.word = Signal(8 * WORD_BYTES)
+        self.reject = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        receiver, channel, ppu = self.receiver, self.channel, self.ppu
+        byte = Signal(range(WORD_BYTES))
+        ended = Signal()
+        crc_ok = Signal()
+        copy = Signal(range(ppu.instruction_depth))
+
+        m.d.comb += channel.reject.eq(self.reject)
+        with m.If(channel.end):
+            m.d.sync += [
+                ended.eq(1),
+                crc_ok.eq(receiver.crc_ok),
+            ]
+
+        # the words of the packet so far, handed to the processor once
+        # it turns out to be good
+        staged = Memory(width=len(self.word), depth=ppu.instruction_depth)
+        m.submodules.staged_write = staged_write = staged.write_port()
+        m.submodules.staged_read = staged_read = staged.read_port(domain='comb')
+
+        # the word with the byte coming in now
+        word = Cat(self.word[8:], receiver.data)
+
+        with m.FSM():
+            with m.State('IDLE'):
+                with m.If(channel.start):
+                    m.d.sync += [
+                        self.addr.eq(0),
+                        self.reject.eq(0),
+                        byte.eq(0),
+                        ended.eq(0),
+                    ]
+                    m.next = 'DATA'
+
+            with m.State('DATA'):
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    channel.ready.eq(1),
+                ]
+                with m.If(channel.valid):
+                    m.d.sync += [
+                        self.word.eq(word),
+                        byte.eq(byte + 1),
+                    ]
+                    with m.If(byte == WORD_BYTES - 1):
+                        m.d.sync += byte.eq(0)
+                        with m.If(self.addr == ppu.instruction_depth):
+                            m.d.sync += self.reject.eq(1)
+                        with m.Else():
+                            m.d.comb += [
+                                staged_write.addr.eq(self.addr),
+                                staged_write.data.eq(word),
+                                staged_write.en.eq(1),
+                            ]
+                            m.d.sync += self.addr.eq(self.addr + 1)
+                with m.Elif(ended):
+                    with m.If(crc_ok & (self.addr != 0) & (byte == 0) & ~self.reject):
+                        m.d.sync += copy.eq(0)
+                        m.next = 'COMMIT'
+                    with m.Else():
+                        m.d.sync += self.reject.eq(1)
+                        m.next = 'IDLE'
+
+            with m.State('COMMIT'):
+                last = copy == self.addr - 1
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    staged_read.addr.eq(copy),
+                    ppu.load_addr.eq(copy),
+                    ppu.load_data.eq(staged_read.data),
+                    ppu.load_last.eq(last),
+                    ppu.load_valid.eq(1),
+                ]
+                with m.If(ppu.load_ready):
+                    m.d.sync += copy.eq(copy + 1)
+                    with m.If(last):
+                        m.next = 'IDLE'
+
+        return m
+
+
+def program_payload(words):
+    """The payload of a PROGRAM packet for instruction `words`."""
+    return b''.join(word.to_bytes(WORD_BYTES, 'little') for word in words)
+
+
+def bench(resolution, color_depth, num_pixels=8, program='out = (x ^ y) + frame'):
+    # sends a corrupted copy of a program halfway through frame 0, and
+    # the program itself a frame later, followed straight away by the
+    # corrupted copy again, before the processor has switched to it.
+    # frames 0 and 1 should be computed entirely with the default
+    # program and the rest with the new one, so it takes three frames
+    # to see it
+    timing = VgaTiming(resolution)
+    ppu = PixelProcessor(
+        timing,
+        num_pixels=num_pixels,
+        pixel_depth=color_depth,
+        loadable=True,
+    )
+    # 3 Mbaud, as on the board
+    divisor = 4
+    serial, uart, receiver = harness(divisor)
+    loader = ProgramLoader(receiver, ppu)
+    words = compile_program(program)
+    good = packet(PROGRAM, program_payload(words))
+    # the same program with a bit flipped in transit, which has to be
+    # refused without touching the running program
+    bad = bytearray(good)
+    bad[-3] ^= 0x10
+    replies = []
+    sent = []
+    middle = resolution.v.prescan + resolution.height // 2
+
+    def upload():
+        yield from sleep(middle * resolution.h.fullscan, 1e-6)
+        yield from sim_uart.send(serial, bad, divisor)
+        replies.append((yield from sim_uart.receive(serial, divisor, timeout=100 * divisor)))
+        # on to the middle of the next frame
+        while (yield timing.line_counter) == middle:
+            yield
+        while (yield timing.line_counter) != middle:
+            yield
+        for data in (good, bad):
+            yield from sim_uart.send(serial, data, divisor)
+            replies.append((yield from sim_uart.receive(serial, divisor, timeout=100 * divisor)))
+        sent.append((yield timing.line_counter))
+
+    def check(capture):
+        expected = [bytes([NAK]), bytes([ACK]), bytes([NAK])]
+        assert replies == expected, f'expected {expected}, got {replies}'
+        assert sent[0] >= middle, 'the second bad packet was answered after frame 1 ended'
+        assert len(capture.buffer) > 2, 'the uploaded program only shows from frame 2 on, capture at least 3 frames'
+        golden = PixelEmulator(resolution.width, resolution.height, color_depth)
+        for number, captured in enumerate(capture.buffer):
+            golden.reset()
+            golden.run(default_program() if number < 2 else words, frame=number)
+            mismatches = np.count_nonzero(captured != golden.output)
+            assert mismatches == 0, (
+                f'{mismatches} pixels of frame {number} differ from the '
+                f'{"default" if number < 2 else "uploaded"} program'
+            )
+
+    return Bench(
+        TestBench(timing, ppu, uart, receiver, loader),
+        timing=timing,
+        source=ppu,
+        processes=[upload],
+        domains=('sync', 'pixel'),
+        check=check,
+        frames=3,
+    )
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='loader')
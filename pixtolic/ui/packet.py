@@ -0,0 +1,409 @@
+# commands from the host over the UART. a packet is
+#
+#     SYNC COMMAND LENGTH_LO LENGTH_HI payload... CRC_LO CRC_HI
+#
+# with up to 65535 payload bytes and a CRC-16/CCITT-FALSE (see crc16)
+# of everything from COMMAND to the end of the payload. anything before
+# SYNC is ignored, and a packet that stops arriving partway through is
+# dropped without a reply once the line has been idle for
+# IDLE_BYTES byte times, so a host that lost track can just send the
+# packet again. every other packet is answered with one byte once it
+# has been dealt with: ACK, or NAK if the CRC didn't match, nobody
+# handles COMMAND or its handler refused it. the payload is passed to
+# the handler as it arrives, so handlers have to hold off on anything
+# they can't undo until the end of the packet says the CRC matched.
+#
+# with the UART's FIFOs, packets can be sent back to back at the full
+# line rate, which at 3 Mbaud is 300 KB/s less the 6 bytes of framing
+# and the wait for each reply; `python -m pixtolic.ui.packet throughput`
+# measures it.
+
+import argparse
+import sys
+
+from nmigen import *
+from nmigen.sim import Passive
+from nmigen.hdl.rec import Record
+
+from pixtolic.sim import uart as sim_uart
+from pixtolic.sim.bench import Bench
+from pixtolic.ui.uart import UART
+
+
+SYNC = 0xA5
+ACK = 0x06
+NAK = 0x15
+CRC_POLY = 0x1021
+CRC_INIT = 0xFFFF
+MAX_LENGTH = 0xFFFF
+# about 3 ms at 3 Mbaud, well past any gap the host's USB adapter
+# leaves in the middle of a packet
+IDLE_BYTES = 1024
+
+
+def crc16(data, crc=CRC_INIT):
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC_POLY if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+def crc16_next(crc, byte):
+    # crc16 of one more byte, in gateware
+    crc = crc ^ Cat(C(0, 8), byte)
+    for _ in range(8):
+        crc = Mux(crc[15], (crc << 1) ^ CRC_POLY, crc << 1)[:16]
+    return crc
+
+
+def packet(command, payload=b''):
+    """The bytes of a packet carrying `payload` for `command`."""
+    if len(payload) > MAX_LENGTH:
+        raise ValueError(f'{len(payload)} bytes is more than a packet can carry')
+    body = bytes([command]) + len(payload).to_bytes(2, 'little') + bytes(payload)
+    return bytes([SYNC]) + body + crc16(body).to_bytes(2, 'little')
+
+
+class Channel:
+
+    """A handler's end of a PacketReceiver, for one command.
+
+    `start` is high for a clock once the header of a packet for this
+    command is in, with its length on the receiver's `length`. Then
+    each payload byte is offered on the receiver's `data` while `valid`
+    is high and taken with `ready`. `end` is high for a clock after the
+    last byte, with the receiver's `crc_ok` saying whether the packet
+    arrived intact, or early with `crc_ok` low if the rest of the
+    packet never came. The reply waits while `busy` is high, which it has
+    to be by the clock after `end` if the handler still has work to do,
+    and is a NAK if `reject` is high by the time `busy` is low.
+
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.start = Signal()
+        self.valid = Signal()
+        self.ready = Signal()
+        self.end = Signal()
+        self.busy = Signal()
+        self.reject = Signal()
+
+
+class PacketReceiver(Elaboratable):
+
+    """Takes packets off `uart` and hands their payloads to the channel
+    for their command, then replies. A packet is given up on after
+    `timeout` clocks without a byte (by default IDLE_BYTES byte times).
+    Runs in the `sync` domain, like the UART."""
+
+    def __init__(self, uart, timeout=None):
+        self.uart = uart
+        if timeout is None:
+            timeout = IDLE_BYTES * 10 * uart.divisor
+        self.timeout = timeout
+        self.channels = []
+        self.command = Signal(8)
+        self.length = Signal(16)
+        self.data = Signal(8)
+        self.crc = Signal(16, reset=CRC_INIT)
+        self.crc_ok = Signal()
+        self.remaining = Signal(16)
+        self.reply = Signal(8)
+        self.idle = Signal(range(timeout + 1))
+
+    def channel(self, command):
+        if any(channel.command == command for channel in self.channels):
+            raise ValueError(f'command {command:#04x} already has a channel')
+        channel = Channel(command)
+        self.channels.append(channel)
+        return channel
+
+    def elaborate(self, platform):
+        m = Module()
+        uart = self.uart
+
+        # the channel for the command being received, if there is one
+        known = Signal()
+        ready = Signal()
+        busy = Signal()
+        reject = Signal()
+        for channel in self.channels:
+            with m.If(self.command == channel.command):
+                m.d.comb += [
+                    known.eq(1),
+                    ready.eq(channel.ready),
+                    busy.eq(channel.busy),
+                    reject.eq(channel.reject),
+                ]
+
+        m.d.comb += self.data.eq(uart.rx_data)
+        byte = Signal(8)
+        with m.If(uart.rx_ready & uart.rx_ack):
+            m.d.sync += byte.eq(uart.rx_data)
+
+        # clocks spent waiting for the next byte of a packet
+        waiting = Signal()
+        timed_out = Signal()
+        m.d.comb += timed_out.eq(waiting & ~uart.rx_ready & (self.idle == self.timeout))
+        with m.If(waiting & ~uart.rx_ready):
+            m.d.sync += self.idle.eq(self.idle + 1)
+        with m.Else():
+            m.d.sync += self.idle.eq(0)
+
+        def take(next_state, crc=True):
+            # consume a byte of the header and go on
+            m.d.comb += uart.rx_ack.eq(1)
+            with m.If(uart.rx_ready):
+                if crc:
+                    m.d.sync += self.crc.eq(crc16_next(self.crc, uart.rx_data))
+                m.next = next_state
+
+        with m.FSM():
+            with m.State('SYNC'):
+                m.d.comb += uart.rx_ack.eq(1)
+                with m.If(uart.rx_ready & (uart.rx_data == SYNC)):
+                    m.d.sync += self.crc.eq(CRC_INIT)
+                    m.next = 'COMMAND'
+
+            # a header that stops short is just forgotten
+            with m.State('COMMAND'):
+                m.d.comb += waiting.eq(1)
+                with m.If(uart.rx_ready):
+                    m.d.sync += self.command.eq(uart.rx_data)
+                take('LENGTH_LO')
+                with m.If(timed_out):
+                    m.next = 'SYNC'
+
+            with m.State('LENGTH_LO'):
+                m.d.comb += waiting.eq(1)
+                take('LENGTH_HI')
+                with m.If(timed_out):
+                    m.next = 'SYNC'
+
+            with m.State('LENGTH_HI'):
+                m.d.comb += waiting.eq(1)
+                with m.If(uart.rx_ready):
+                    m.d.sync += [
+                        self.length.eq(Cat(byte, uart.rx_data)),
+                        self.remaining.eq(Cat(byte, uart.rx_data)),
+                    ]
+                take('START')
+                with m.If(timed_out):
+                    m.next = 'SYNC'
+
+            with m.State('START'):
+                for channel in self.channels:
+                    m.d.comb += channel.start.eq(self.command == channel.command)
+                with m.If(self.remaining == 0):
+                    m.next = 'CRC_LO'
+                with m.Else():
+                    m.next = 'PAYLOAD'
+
+            # but once the handler has started on it, it has to be told
+            with m.State('PAYLOAD'):
+                m.d.comb += waiting.eq(1)
+                for channel in self.channels:
+                    m.d.comb += channel.valid.eq((self.command == channel.command) & uart.rx_ready)
+                # without a channel, the payload is dropped
+                m.d.comb += uart.rx_ack.eq(ready | ~known)
+                with m.If(uart.rx_ready & uart.rx_ack):
+                    m.d.sync += [
+                        self.crc.eq(crc16_next(self.crc, uart.rx_data)),
+                        self.remaining.eq(self.remaining - 1),
+                    ]
+                    with m.If(self.remaining == 1):
+                        m.next = 'CRC_LO'
+                with m.If(timed_out):
+                    m.d.sync += self.crc_ok.eq(0)
+                    m.next = 'ABORT'
+
+            with m.State('CRC_LO'):
+                m.d.comb += waiting.eq(1)
+                take('CRC_HI', crc=False)
+                with m.If(timed_out):
+                    m.d.sync += self.crc_ok.eq(0)
+                    m.next = 'ABORT'
+
+            with m.State('CRC_HI'):
+                m.d.comb += waiting.eq(1)
+                with m.If(uart.rx_ready):
+                    m.d.sync += self.crc_ok.eq(Cat(byte, uart.rx_data) == self.crc)
+                take('END', crc=False)
+                with m.If(timed_out):
+                    m.d.sync += self.crc_ok.eq(0)
+                    m.next = 'ABORT'
+
+            with m.State('END'):
+                for channel in self.channels:
+                    m.d.comb += channel.end.eq(self.command == channel.command)
+                m.next = 'WAIT'
+
+            with m.State('WAIT'):
+                with m.If(~busy):
+                    with m.If(self.crc_ok & known & ~reject):
+                        m.d.sync += self.reply.eq(ACK)
+                    with m.Else():
+                        m.d.sync += self.reply.eq(NAK)
+                    m.next = 'REPLY'
+
+            # the end of a packet that never finished, without a reply:
+            # the host has given up on it and may already be sending it
+            # again
+            with m.State('ABORT'):
+                for channel in self.channels:
+                    m.d.comb += channel.end.eq(self.command == channel.command)
+                m.next = 'DRAIN'
+
+            with m.State('DRAIN'):
+                with m.If(~busy):
+                    m.next = 'SYNC'
+
+            with m.State('REPLY'):
+                m.d.comb += [
+                    uart.tx_data.eq(self.reply),
+                    uart.tx_ready.eq(1),
+                ]
+                with m.If(uart.tx_ack):
+                    m.next = 'SYNC'
+
+        return m
+
+
+class Sink(Elaboratable):
+
+    """Takes every payload byte for its channel as soon as it arrives
+    and keeps a running sum of them, so there is something to check."""
+
+    def __init__(self, receiver, channel):
+        self.receiver = receiver
+        self.channel = channel
+        self.sum = Signal(32)
+        self.count = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.comb += self.channel.ready.eq(1)
+        with m.If(self.channel.valid):
+            m.d.sync += [
+                self.sum.eq(self.sum + self.receiver.data),
+                self.count.eq(self.count + 1),
+            ]
+        return m
+
+
+class TestBench(Elaboratable):
+    def __init__(self, *submodules):
+        self.submodules = submodules
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules += self.submodules
+        return m
+
+
+SINK = ord('S')
+
+
+def harness(divisor, fifo_depth=16, timeout=None):
+    """A PacketReceiver on a UART at 12e6 / `divisor` baud, giving up
+    on a packet after `timeout` idle clocks, for a testbench to give
+    handlers to. Returns the serial lines, which the
+    pixtolic.sim.uart helpers drive, the UART and the receiver; the
+    UART and the receiver still have to go in the bench's TestBench."""
+    serial = Record([('rx', 1), ('tx', 1)], fields={'rx': Signal(reset=1), 'tx': Signal(reset=1)})
+    uart = UART(serial, clk_freq=12e6, baud_rate=12e6 / divisor, fifo_depth=fifo_depth)
+    return serial, uart, PacketReceiver(uart, timeout)
+
+
+def sink_harness(divisor, timeout=None):
+    serial, uart, receiver = harness(divisor, timeout=timeout)
+    sink = Sink(receiver, receiver.channel(SINK))
+    return serial, TestBench(uart, receiver, sink), sink
+
+
+def bench(resolution, color_depth, divisor=4, timeout=320):
+    # good packets are ACKed and reach the sink, the others are NAKed,
+    # and one that is cut short gets no reply, and the same packet sent
+    # again once the receiver has given up on it is ACKed
+    serial, top, sink = sink_harness(divisor, timeout)
+    payloads = [b'', bytes(range(200)), b'pixtolic']
+    corrupt = bytearray(packet(SINK, b'lost'))
+    corrupt[-1] ^= 0x40
+    sent = [packet(SINK, payload) for payload in payloads] + [
+        bytes(corrupt),
+        packet(SINK + 1, b'nobody'),
+        b'\x00\xff' + packet(SINK, b'resync'),
+    ]
+    expected = bytes([ACK, ACK, ACK, NAK, NAK, ACK])
+    retried = packet(SINK, b'cut short')
+    # SYNC, the header and 3 bytes of the payload
+    cut = retried[:7]
+
+    def host():
+        replies = b''
+        for data in sent:
+            yield from sim_uart.send(serial, data, divisor)
+            replies += yield from sim_uart.receive(serial, divisor, timeout=100 * divisor)
+        assert replies == expected, f'expected replies {expected}, got {replies}'
+        yield from sim_uart.send(serial, cut, divisor)
+        reply = yield from sim_uart.receive(serial, divisor, timeout=2 * timeout)
+        assert reply == b'', f'a packet cut short was answered with {reply}'
+        yield from sim_uart.send(serial, retried, divisor)
+        reply = yield from sim_uart.receive(serial, divisor, timeout=100 * divisor)
+        assert reply == bytes([ACK]), f'the packet sent again was answered with {reply}, not an ACK'
+        # the corrupt and cut short packets' payloads still reach the
+        # sink, it's up to the handler to drop them
+        total = sum(sum(payload) for payload in payloads + [b'lost', b'resync', b'cut', b'cut short'])
+        assert (yield sink.sum) == total, f'the sink summed {(yield sink.sum)}, not {total}'
+
+    return Bench(top, processes=[host], domains=('sync',))
+
+
+def throughput(divisor=4, payload_size=1024, packets=4, clk_freq=12e6):
+    """Sustained payload bytes per second from the host to a handler,
+    simulated: packets sent one after another, each once the last one
+    was ACKed."""
+    serial, top, sink = sink_harness(divisor)
+    payload = bytes(i & 0xFF for i in range(payload_size))
+    clocks = []
+
+    def host():
+        for _ in range(packets):
+            yield from sim_uart.send(serial, packet(SINK, payload), divisor)
+            reply = yield from sim_uart.receive(serial, divisor, timeout=100 * divisor)
+            assert reply == bytes([ACK]), f'expected an ACK, got {reply}'
+        received = yield sink.count
+        assert received == packets * payload_size, f'the handler got {received} of {packets * payload_size} bytes'
+
+    def clock():
+        yield Passive()
+        while True:
+            clocks.append(None)
+            yield
+
+    Bench(top, processes=[host, clock], domains=('sync',)).run()
+    return packets * payload_size / (len(clocks) / clk_freq)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'throughput':
+        p = argparse.ArgumentParser(
+            prog='python -m pixtolic.ui.packet throughput',
+            description='simulate sending packets to the board and report the payload rate',
+        )
+        p.add_argument('--baud', type=int, default=3000000)
+        p.add_argument('--payload', type=int, default=1024, help='bytes per packet')
+        p.add_argument('--packets', type=int, default=4)
+        args = p.parse_args(sys.argv[2:])
+        divisor = round(12e6 / args.baud)
+        rate = throughput(divisor, args.payload, args.packets)
+        line = 12e6 / divisor / 10
+        print(
+            f'{12e6 / divisor / 1e6:g} Mbaud, {args.payload} byte packets: '
+            f'{rate / 1e3:.1f} KB/s of payload ({100 * rate / line:.1f}% of the line rate)'
+        )
+    else:
+        from pixtolic.sim.cli import main
+        main(sys.argv[1:], bench='packet')
@@ -0,0 +1,222 @@
+# moves the sprites of a writable TileEngine while it runs. a SPRITES
+# packet (see pixtolic.ui.packet) starts with the number of the first
+# sprite it moves, one byte, followed by ENTRY_BYTES bytes for it and
+# each one after it:
+#
+#     x (2 bytes) y (2 bytes) tile (1 byte)
+#
+# with x and y least significant byte first, where negative numbers
+# put a sprite partly off the top or left. the sprites are held until
+# the end of the packet says the CRC matched, then written together,
+# and the engine copies them all at the top of each frame, so sending
+# every sprite once a frame moves them smoothly. a packet with part of
+# a sprite left over, or one past the last sprite, or a tile that
+# doesn't exist, is answered with NAK and moves nothing.
+# pixtolic.host.sprites is the other end.
+
+import sys
+
+from nmigen import *
+import numpy as np
+
+from pixtolic.host.tiles import render
+from pixtolic.output.timing import VgaTiming
+from pixtolic.sim import uart as sim_uart
+from pixtolic.sim.bench import Bench
+from pixtolic.sources.tiles import TileEngine, scene
+from pixtolic.ui.packet import ACK, NAK, TestBench, harness, packet
+
+
+SPRITES = ord('O')
+ENTRY_BYTES = 5
+
+
+def sprite_payload(first, sprites):
+    """The payload of a SPRITES packet moving sprites `first` on to
+    `sprites`, (x, y, tile) each."""
+    return bytes([first]) + b''.join(
+        (x & 0xffff).to_bytes(2, 'little') + (y & 0xffff).to_bytes(2, 'little') + bytes([tile])
+        for x, y, tile in sprites
+    )
+
+
+class SpriteLoader(Elaboratable):
+
+    """Takes SPRITES packets from `receiver` and writes them into
+    `engine`, which has to be built with `writable=True`. Runs in the
+    `sync` domain, like the UART."""
+
+    def __init__(self, receiver, engine):
+        self.receiver = receiver
+        self.channel = receiver.channel(SPRITES)
+        self.engine = engine
+        self.first = Signal(8)
+        self.addr = Signal(8)
+        self.entry = Signal(8 * ENTRY_BYTES)
+        self.reject = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        receiver, channel, engine = self.receiver, self.channel, self.engine
+        bits = engine.coord_bits
+        byte = Signal(range(ENTRY_BYTES))
+        ended = Signal()
+        crc_ok = Signal()
+        copy = Signal(8)
+
+        m.d.comb += channel.reject.eq(self.reject)
+        with m.If(channel.end):
+            m.d.sync += [
+                ended.eq(1),
+                crc_ok.eq(receiver.crc_ok),
+            ]
+
+        # the entries of the packet so far, copied into the engine once
+        # it turns out to be good
+        staged = Memory(width=len(engine.write_data), depth=engine.max_sprites)
+        m.submodules.staged_write = staged_write = staged.write_port()
+        m.submodules.staged_read = staged_read = staged.read_port(domain='comb')
+
+        # the entry with the byte coming in now
+        entry = Cat(self.entry[8:], receiver.data)
+        x, y, tile = entry[:16], entry[16:32], entry[32:]
+
+        with m.FSM():
+            with m.State('IDLE'):
+                with m.If(channel.start):
+                    m.d.sync += [
+                        self.reject.eq(0),
+                        byte.eq(0),
+                        ended.eq(0),
+                    ]
+                    m.next = 'FIRST'
+
+            with m.State('FIRST'):
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    channel.ready.eq(1),
+                ]
+                with m.If(channel.valid):
+                    m.d.sync += [
+                        self.first.eq(receiver.data),
+                        self.addr.eq(receiver.data),
+                    ]
+                    m.next = 'ENTRY'
+                with m.Elif(ended):
+                    m.d.sync += self.reject.eq(1)
+                    m.next = 'IDLE'
+
+            with m.State('ENTRY'):
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    channel.ready.eq(1),
+                ]
+                with m.If(channel.valid):
+                    m.d.sync += [
+                        self.entry.eq(entry),
+                        byte.eq(byte + 1),
+                    ]
+                    with m.If(byte == ENTRY_BYTES - 1):
+                        m.d.sync += [
+                            byte.eq(0),
+                            self.addr.eq(self.addr + 1),
+                        ]
+                        with m.If((self.addr < engine.max_sprites) & (tile < len(engine.tiles))):
+                            m.d.comb += [
+                                staged_write.addr.eq(self.addr),
+                                staged_write.data.eq(Cat(x[:bits], y[:bits], tile[:engine.tile_bits])),
+                                staged_write.en.eq(1),
+                            ]
+                        with m.Else():
+                            m.d.sync += self.reject.eq(1)
+                with m.Elif(ended):
+                    with m.If(crc_ok & (byte == 0) & ~self.reject & (self.addr != self.first)):
+                        m.d.sync += copy.eq(self.first)
+                        m.next = 'COMMIT'
+                    with m.Else():
+                        with m.If(byte != 0):
+                            m.d.sync += self.reject.eq(1)
+                        m.next = 'IDLE'
+
+            with m.State('COMMIT'):
+                m.d.comb += [
+                    channel.busy.eq(1),
+                    staged_read.addr.eq(copy),
+                    engine.write_addr.eq(copy),
+                    engine.write_data.eq(staged_read.data),
+                    engine.write_en.eq(1),
+                ]
+                m.d.sync += copy.eq(copy + 1)
+                with m.If(copy == self.addr - 1):
+                    m.next = 'IDLE'
+
+        return m
+
+
+def bench(resolution, color_depth, scale=2):
+    # sends a corrupted copy of a packet moving three sprites during
+    # frame 0, then one that runs past the last sprite, and the good
+    # packet in frame 1. neither bad packet may move anything, so
+    # frames 0 and 1 should show the sprites where they started and
+    # frames after them where they were moved
+    timing = VgaTiming(resolution)
+    cols = resolution.width // (8 * scale)
+    rows = resolution.height // (8 * scale)
+    palette, tiles, tilemap = scene(color_depth, cols, rows)
+    before = [(4, 4, 0), (20, 6, 0), (30, 10, 2), (40, 3, 0)]
+    engine = TileEngine(
+        timing, color_depth, palette, tiles, tilemap,
+        sprites=before, max_sprites=4, scale=scale, writable=True,
+    )
+    divisor = 4
+    serial, uart, receiver = harness(divisor)
+    loader = SpriteLoader(receiver, engine)
+
+    moved = [(-3, 9, 0), (17, -2, 5), (22, 12, 0)]
+    after = [before[0]] + moved
+    good = packet(SPRITES, sprite_payload(1, moved))
+    bad = bytearray(good)
+    bad[7] ^= 0x01
+    # sprite 3 is fine, sprite 4 doesn't exist
+    sent = [bytes(bad), packet(SPRITES, sprite_payload(3, moved[:2]))]
+    replies = []
+
+    def upload():
+        for data in sent:
+            yield from sim_uart.send(serial, data, divisor)
+            replies.append((yield from sim_uart.receive(serial, divisor, timeout=200 * divisor)))
+        # on into frame 1
+        while (yield timing.line_counter) != resolution.v.prescan + resolution.height:
+            yield
+        while (yield timing.line_counter) != resolution.v.prescan:
+            yield
+        yield from sim_uart.send(serial, good, divisor)
+        replies.append((yield from sim_uart.receive(serial, divisor, timeout=200 * divisor)))
+
+    def check(capture):
+        assert replies == [bytes([NAK]), bytes([NAK]), bytes([ACK])], f'expected NAK, NAK, ACK, got {replies}'
+        assert len(capture.buffer) > 2, 'the sprites only move in frame 2, capture at least 3 frames'
+        for number, captured in enumerate(capture.buffer):
+            sprites = before if number < 2 else after
+            image = render(palette, tiles, tilemap, sprites)
+            rows = np.arange(resolution.height) // scale % image.shape[0]
+            columns = np.arange(resolution.width) // scale % image.shape[1]
+            expected = image[rows][:, columns]
+            # two clocks behind, as in the TileEngine bench
+            mismatches = np.count_nonzero(captured[:, 2:] != expected[:, :-2])
+            assert mismatches == 0, f'{mismatches} pixels of frame {number} differ'
+
+    return Bench(
+        TestBench(timing, engine, uart, receiver, loader),
+        timing=timing,
+        source=engine,
+        processes=[upload],
+        domains=('sync', 'pixel'),
+        check=check,
+        frames=3,
+    )
+
+
+if __name__ == '__main__':
+    from pixtolic.sim.cli import main
+    main(sys.argv[1:], bench='sprite_loader')
@@ -2,21 +2,55 @@
 
 from nmigen import *
 from nmigen.build import *
+from nmigen.lib.cdc import FFSynchronizer
+from nmigen.lib.fifo import SyncFIFOBuffered
+
+
+# the FTDI chip on the iCEBreaker does up to 3 Mbaud, which 12 MHz
+# divides exactly
+DEFAULT_BAUD_RATE = 3000000
+
 
 def _divisor(freq_in, freq_out, max_ppm=None):
-    divisor = int(freq_in // freq_out)
-    if divisor <= 0:
-        raise ArgumentError("Output frequency is too high.")
+    divisor = round(freq_in / freq_out)
+    if divisor < 4:
+        # the receiver needs a few clocks per bit to find the middle
+        raise ValueError("Output frequency is too high.")
 
-    ppm = 100000 * ((freq_in / divisor) - freq_out) / freq_out
-    if max_ppm is not None and ppm > max_ppm:
-        raise ArgumentError("Output frequency deviation is too high.")
+    ppm = 1e6 * ((freq_in / divisor) - freq_out) / freq_out
+    if max_ppm is not None and abs(ppm) > max_ppm:
+        raise ValueError("Output frequency deviation is too high.")
 
     return divisor
 
 
+def baud_rates(clk_freq, max_baud_rate=DEFAULT_BAUD_RATE):
+    """Baud rates `clk_freq` divides exactly, fastest first."""
+    return [
+        clk_freq / divisor
+        for divisor in range(4, int(clk_freq // 9600) + 1)
+        if clk_freq / divisor <= max_baud_rate and clk_freq % divisor == 0
+    ]
+
+
 class UART(Elaboratable):
-    def __init__(self, serial, clk_freq, baud_rate):
+
+    """8N1 serial port in the `sync` domain.
+
+    Received bytes are offered on `rx_data` while `rx_ready` is high
+    and taken with `rx_ack`; bytes to send go on `tx_data` with
+    `tx_ready` and are taken while `tx_ack` is high. With `fifo_depth`
+    both directions are buffered, so bytes can arrive back to back
+    without the user taking each one within a bit time, and can be
+    queued to send faster than the line goes.
+
+    """
+
+    # clocks between the start bit reaching the pin and the receiver
+    # seeing it: two in the synchronizer and one in the FSM
+    RX_LATENCY = 3
+
+    def __init__(self, serial, clk_freq, baud_rate, fifo_depth=0):
         self.rx_data = Signal(8)
         self.rx_ready = Signal()
         self.rx_ack = Signal()
@@ -34,6 +68,7 @@ class UART(Elaboratable):
         self.tx_fsm = None
 
         self.serial = serial
+        self.fifo_depth = fifo_depth
 
         self.divisor = _divisor(
             freq_in=clk_freq, freq_out=baud_rate, max_ppm=50000)
@@ -41,8 +76,47 @@ class UART(Elaboratable):
     def elaborate(self, _platform: Platform) -> Module:
         m = Module()
 
+        # the FSMs work on these, which are either the ports or the
+        # FIFOs' ends
+        rx_data = Signal(8)
+        rx_ready = Signal()
+        rx_ack = Signal()
+        tx_data = Signal(8)
+        tx_ready = Signal()
+        tx_ack = Signal()
+        if self.fifo_depth:
+            m.submodules.rx_fifo = rx_fifo = SyncFIFOBuffered(width=8, depth=self.fifo_depth)
+            m.submodules.tx_fifo = tx_fifo = SyncFIFOBuffered(width=8, depth=self.fifo_depth)
+            m.d.comb += [
+                rx_fifo.w_data.eq(rx_data),
+                rx_fifo.w_en.eq(rx_ready),
+                rx_ack.eq(rx_fifo.w_rdy),
+                self.rx_data.eq(rx_fifo.r_data),
+                self.rx_ready.eq(rx_fifo.r_rdy),
+                rx_fifo.r_en.eq(self.rx_ack),
+
+                tx_fifo.w_data.eq(self.tx_data),
+                tx_fifo.w_en.eq(self.tx_ready),
+                self.tx_ack.eq(tx_fifo.w_rdy),
+                tx_data.eq(tx_fifo.r_data),
+                tx_ready.eq(tx_fifo.r_rdy),
+                tx_fifo.r_en.eq(tx_ack),
+            ]
+        else:
+            m.d.comb += [
+                self.rx_data.eq(rx_data),
+                self.rx_ready.eq(rx_ready),
+                rx_ack.eq(self.rx_ack),
+                tx_data.eq(self.tx_data),
+                tx_ready.eq(self.tx_ready),
+                self.tx_ack.eq(tx_ack),
+            ]
+
         # RX
 
+        rx = Signal(reset=1)
+        m.submodules += FFSynchronizer(self.serial.rx, rx, reset=1)
+
         rx_counter = Signal(range(self.divisor))
         m.d.comb += self.rx_strobe.eq(rx_counter == 0)
         with m.If(rx_counter == 0):
@@ -53,8 +127,10 @@ class UART(Elaboratable):
         self.rx_bitno = rx_bitno = Signal(3)
         with m.FSM(reset="IDLE") as self.rx_fsm:
             with m.State("IDLE"):
-                with m.If(~self.serial.rx):
-                    m.d.sync += rx_counter.eq(self.divisor // 2)
+                with m.If(~rx):
+                    # sample in the middle of each bit, counting from
+                    # when the start bit reached the pin
+                    m.d.sync += rx_counter.eq(max(self.divisor // 2 - self.RX_LATENCY + 1, 0))
                     m.next = "START"
 
             with m.State("START"):
@@ -64,8 +140,8 @@ class UART(Elaboratable):
             with m.State("DATA"):
                 with m.If(self.rx_strobe):
                     m.d.sync += [
-                        self.rx_data.eq(
-                            Cat(self.rx_data[1:8], self.serial.rx)),
+                        rx_data.eq(
+                            Cat(rx_data[1:8], rx)),
                         rx_bitno.eq(rx_bitno + 1)
                     ]
                     with m.If(rx_bitno == 7):
@@ -73,20 +149,23 @@ class UART(Elaboratable):
 
             with m.State("STOP"):
                 with m.If(self.rx_strobe):
-                    with m.If(~self.serial.rx):
+                    with m.If(~rx):
                         m.next = "ERROR"
                     with m.Else():
                         m.next = "FULL"
 
             with m.State("FULL"):
-                m.d.comb += self.rx_ready.eq(1)
-                with m.If(self.rx_ack):
+                m.d.comb += rx_ready.eq(1)
+                with m.If(rx_ack):
                     m.next = "IDLE"
-                with m.Elif(~self.serial.rx):
+                with m.Elif(~rx):
                     m.next = "ERROR"
 
             with m.State("ERROR"):
                 m.d.comb += self.rx_error.eq(1)
+                # start over once the line is idle again
+                with m.If(rx):
+                    m.next = "IDLE"
 
         # TX
 
@@ -101,11 +180,11 @@ class UART(Elaboratable):
         self.tx_latch = tx_latch = Signal(8)
         with m.FSM(reset="IDLE") as self.tx_fsm:
             with m.State("IDLE"):
-                m.d.comb += self.tx_ack.eq(1)
-                with m.If(self.tx_ready):
+                m.d.comb += tx_ack.eq(1)
+                with m.If(tx_ready):
                     m.d.sync += [
                         tx_counter.eq(self.divisor - 1),
-                        tx_latch.eq(self.tx_data)
+                        tx_latch.eq(tx_data)
                     ]
                     m.next = "START"
                 with m.Else():
@@ -138,7 +217,7 @@ class UARTLoopback(UART):
 
     def elaborate(self, platform):
         m = super().elaborate(platform)
-        
+
         rx_strobe = Signal()
         tx_strobe = Signal()
         empty = Signal(reset=1)
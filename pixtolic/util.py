@@ -0,0 +1,38 @@
+from nmigen import Shape
+from nmigen.hdl.rec import Layout
+
+
+def field_widths(layout):
+    # accepts either a plain list of (name, width) pairs or a Record's
+    # Layout
+    for name, (shape, _) in Layout.cast(layout).fields.items():
+        yield name, Shape.cast(shape).width
+
+
+def int_for(layout, **fields):
+    # pack named fields into an integer the same way a Record with
+    # this layout lays them out: first field in the lowest bits
+    value = 0
+    offset = 0
+    for name, width in field_widths(layout):
+        field = fields.pop(name, 0)
+        if not 0 <= field < 2 ** width:
+            raise ValueError(f'{name}={field} does not fit in {width} bits')
+        value |= field << offset
+        offset += width
+    if fields:
+        raise ValueError(f'unknown fields: {", ".join(fields)}')
+    return value
+
+
+def fields_for(layout, value):
+    # inverse of int_for
+    fields = {}
+    for name, width in field_widths(layout):
+        fields[name] = value & (2 ** width - 1)
+        value >>= width
+    return fields
+
+
+def layout_width(layout):
+    return sum(width for _, width in field_widths(layout))
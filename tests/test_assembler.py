@@ -0,0 +1,11 @@
+from pixtolic.host.assembler import assemble, disassemble
+
+
+def test_tabs_between_mnemonic_and_operands():
+    assert assemble('add\tgp0, x, y') == assemble('add gp0, x, y')
+    assert assemble('  not \t out,\tgp1 ; invert') == assemble('not out, gp1')
+
+
+def test_round_trip():
+    source = 'sub gp0, x, y\ngt out, gp0, 0\nselect gp1, frame, 7'
+    assert disassemble(assemble(source)) == source
@@ -0,0 +1,27 @@
+from pathlib import Path
+
+import pytest
+
+from pixtolic.processors.fixed import parse_log
+
+
+LOG = (Path(__file__).parent / 'nextpnr_fixed.tim').read_text()
+
+
+def test_fmax_after_routing():
+    # the log has 40.92 MHz after placement and 35.24 MHz after routing
+    fmax, _ = parse_log('fixed', LOG)
+    assert fmax == 35.24
+
+
+def test_cell_counts():
+    _, cells = parse_log('fixed', LOG)
+    assert cells['ICESTORM_LC'] == 153
+    assert cells['ICESTORM_RAM'] == 0
+    assert cells['ICESTORM_DSP'] == 0
+    assert cells['SB_IO'] == 2
+
+
+def test_no_fmax():
+    with pytest.raises(RuntimeError):
+        parse_log('fixed', 'Info: Program finished normally.\n')